@@ -6,6 +6,8 @@ from .models import FilmWork
 from .models import Person
 from .models import GenreFilmWork
 from .models import PersonFilmWork
+from .pagination import KeysetPaginationMixin
+from .search import SearchMixin
 
 
 class GenreFilmInline(admin.TabularInline):
@@ -64,18 +66,20 @@ class DateCreatedListFilter(admin.SimpleListFilter):
 
 
 @admin.register(Genre)
-class GenreAdmin(admin.ModelAdmin):
+class GenreAdmin(SearchMixin, admin.ModelAdmin):
     list_display = ('name',)
     search_fields = ('name', 'id')
+    trigram_fields = ('name',)
 
 
 @admin.register(FilmWork)
-class FilmWorkAdmin(admin.ModelAdmin):
+class FilmWorkAdmin(SearchMixin, KeysetPaginationMixin, admin.ModelAdmin):
     inlines = (GenreFilmInline, PersonFilmInline)
 
     list_display = ('title', 'type', 'get_genres', 'creation_date', 'rating')
     list_filter = ('type', DateCreatedListFilter)
     search_fields = ('title', 'description', 'id')
+    vector_field = 'search_vector'
 
     list_prefetch_related = ('genres',)
 
@@ -89,6 +93,7 @@ class FilmWorkAdmin(admin.ModelAdmin):
 
 
 @admin.register(Person)
-class PersonAdmin(admin.ModelAdmin):
+class PersonAdmin(SearchMixin, KeysetPaginationMixin, admin.ModelAdmin):
     list_display = ('full_name',)
     search_fields = ('full_name', 'id')
+    trigram_fields = ('full_name',)
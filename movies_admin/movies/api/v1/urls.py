@@ -0,0 +1,10 @@
+from django.urls import path
+
+from movies.api.v1 import views
+
+urlpatterns = [
+    path('movies/', views.FilmWorkListApi.as_view()),
+    path('movies/<uuid:pk>/', views.FilmWorkDetailApi.as_view()),
+    path('genres/<uuid:pk>/', views.GenreDetailApi.as_view()),
+    path('persons/<uuid:pk>/', views.PersonDetailApi.as_view()),
+]
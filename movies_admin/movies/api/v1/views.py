@@ -0,0 +1,162 @@
+from abc import ABC, abstractmethod
+import hashlib
+import uuid
+
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.contrib.postgres.aggregates import JSONBAgg
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.db.models.functions import JSONObject
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.cache import quote_etag
+from django.utils.http import http_date
+from django.views import View
+
+from movies.models import FilmWork
+from movies.models import Genre
+from movies.models import Person
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, detail: str):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+def film_queryset():
+    """Кинопроизведения с жанрами и участниками, собранными агрегатами
+    в том же запросе. modified — время обновления документа кинопроизведения
+    (film_work_document): триггеры обновляют его при любом изменении записи, её жанров,
+    участников и связей с ними, в том числе при удалении связей"""
+    return FilmWork.objects.values(
+        'id', 'title', 'description', 'creation_date', 'rating', 'type'
+    ).annotate(
+        genres=ArrayAgg(
+            'genrefilmwork__genre__name',
+            distinct=True,
+            ordering='genrefilmwork__genre__name',
+            default=Value([]),
+        ),
+        persons=JSONBAgg(
+            JSONObject(
+                id='personfilmwork__person__id',
+                full_name='personfilmwork__person__full_name',
+                role='personfilmwork__role',
+            ),
+            distinct=True,
+            filter=Q(personfilmwork__isnull=False),
+            default=Value('[]'),
+        ),
+        modified=Coalesce('document__updated_at', 'updated_at'),
+    )
+
+
+def group_persons(film: dict) -> dict:
+    """Участники кинопроизведения в виде {роль: [{id, full_name}]}"""
+    persons = {}
+    for person in sorted(film['persons'], key=lambda item: (item['full_name'], item['id'])):
+        persons.setdefault(person.pop('role'), []).append(person)
+    film['persons'] = persons
+    return film
+
+
+class ApiView(ABC, View):
+    """Ответ JSON только для чтения. get_data возвращает данные и время их
+    последнего изменения (Last-Modified) или None; ETag — хеш тела ответа.
+    По If-None-Match / If-Modified-Since отдаётся 304"""
+    http_method_names = ['get', 'head']
+
+    @abstractmethod
+    def get_data(self, request, **kwargs) -> tuple:
+        pass
+
+    def get(self, request, **kwargs):
+        try:
+            data, modified = self.get_data(request, **kwargs)
+        except ApiError as error:
+            return JsonResponse({'detail': error.detail}, status=error.status)
+        data.pop('modified', None)
+        response = JsonResponse(data, encoder=DjangoJSONEncoder, json_dumps_params={'ensure_ascii': False})
+        etag = quote_etag(hashlib.md5(response.content).hexdigest())
+        response['ETag'] = etag
+        last_modified = int(modified.timestamp()) if modified else None
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        return get_conditional_response(request, etag=etag, last_modified=last_modified, response=response)
+
+    @staticmethod
+    def get_object(queryset, pk) -> dict:
+        data = queryset.filter(id=pk).first()
+        if data is None:
+            raise ApiError(404, 'Not found')
+        return data
+
+
+class FilmWorkListApi(ApiView):
+    """Список кинопроизведений по возрастанию id с переходом по курсору
+    (id последней записи страницы). Страница собирается одним запросом:
+    агрегаты считаются только по id страницы, выбранным подзапросом с LIMIT"""
+
+    def get_data(self, request, **kwargs) -> tuple:
+        try:
+            page_size = min(int(request.GET.get('page_size', PAGE_SIZE)), MAX_PAGE_SIZE)
+            cursor = uuid.UUID(request.GET['cursor']) if 'cursor' in request.GET else None
+        except ValueError:
+            raise ApiError(400, 'Invalid page_size or cursor')
+        if page_size < 1:
+            raise ApiError(400, 'Invalid page_size or cursor')
+        page_ids = FilmWork.objects.order_by('id').values('id')
+        if cursor:
+            page_ids = page_ids.filter(id__gt=cursor)
+        results = [group_persons(film) for film in
+                   film_queryset().filter(id__in=page_ids[:page_size + 1]).order_by('id')]
+        next_url = None
+        if len(results) > page_size:
+            results = results[:page_size]
+            params = request.GET.copy()
+            params['cursor'] = str(results[-1]['id'])
+            next_url = request.build_absolute_uri('?' + params.urlencode())
+        modified = max((film.pop('modified') for film in results), default=None)
+        return {'next': next_url, 'results': results}, modified
+
+
+class FilmWorkDetailApi(ApiView):
+
+    def get_data(self, request, pk=None, **kwargs) -> tuple:
+        data = group_persons(self.get_object(film_queryset(), pk))
+        return data, data['modified']
+
+
+class GenreDetailApi(ApiView):
+
+    def get_data(self, request, pk=None, **kwargs) -> tuple:
+        data = self.get_object(Genre.objects.values('id', 'name', 'description', 'updated_at'), pk)
+        return data, data.pop('updated_at')
+
+
+class PersonDetailApi(ApiView):
+    """Персона со списком кинопроизведений и ролей в каждом из них.
+    Удаление связи с кинопроизведением не оставляет времени у персоны,
+    поэтому Last-Modified не отдаётся, и проверка актуальности идёт только по ETag"""
+
+    def get_data(self, request, pk=None, **kwargs) -> tuple:
+        queryset = Person.objects.values('id', 'full_name').annotate(
+            roles=JSONBAgg(
+                JSONObject(id='personfilmwork__film_work_id', role='personfilmwork__role'),
+                filter=Q(personfilmwork__isnull=False),
+                default=Value('[]'),
+            ),
+        )
+        data = self.get_object(queryset, pk)
+        films = {}
+        for item in data.pop('roles'):
+            films.setdefault(item['id'], []).append(item['role'])
+        data['films'] = [{'id': film_id, 'roles': sorted(roles)} for film_id, roles in sorted(films.items())]
+        return data, None
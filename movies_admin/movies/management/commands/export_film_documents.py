@@ -0,0 +1,93 @@
+from datetime import datetime
+from datetime import timezone
+import json
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+BATCH_SIZE = 1000
+STATE_FILE = 'state.json'
+
+# Документы и надгробия, изменённые транзакциями с номером не меньше отметки.
+# Отметка - xmin снимка, взятого перед прошлой выгрузкой: все транзакции с меньшими номерами
+# к тому моменту завершились и попали в неё, а незавершённые имеют номер не меньше xmin.
+# Поэтому поздняя фиксация не теряется, а строки, зафиксированные до прошлой выгрузки
+# транзакциями с номером не меньше xmin, выгружаются повторно
+SQL_CHANGED_DOCUMENTS = """
+    SELECT document::text
+    FROM content.film_work_document
+    WHERE changed_xid >= %(xmin)s::xid8
+    UNION ALL
+    SELECT jsonb_build_object('id', film_work_id, 'deleted', true)::text
+    FROM content.film_work_tombstone
+    WHERE changed_xid >= %(xmin)s::xid8;
+    """
+SQL_SNAPSHOT_XMIN = """SELECT pg_snapshot_xmin(pg_current_snapshot())::text"""
+
+START = '0'
+
+
+def load_watermark(path: str) -> str:
+    """xmin снимка перед прошлой выгрузкой; без отметки выгружается всё"""
+    if not os.path.exists(path):
+        return START
+    with open(path) as state_file:
+        return json.load(state_file).get('xmin', START)
+
+
+def save_watermark(path: str, xmin: str) -> None:
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as state_file:
+        json.dump({'xmin': xmin}, state_file, indent=2)
+    os.replace(tmp_path, path)
+
+
+class Command(BaseCommand):
+    help = ('Выгрузить в NDJSON документы кинопроизведений, изменившихся с прошлого запуска, '
+            'и надгробия {"id": ..., "deleted": true} удалённых. '
+            'Отметка (xmin снимка перед выгрузкой) хранится в state.json каталога выгрузки')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', default='export',
+                            help='каталог файлов выгрузки и отметки')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='число документов, читаемых из курсора за раз')
+        parser.add_argument('--full', action='store_true',
+                            help='выгрузить все кинопроизведения, не учитывая отметку')
+
+    def handle(self, *args, output_dir='export', batch_size=BATCH_SIZE, full=False, **options):
+        os.makedirs(output_dir, exist_ok=True)
+        state_path = os.path.join(output_dir, STATE_FILE)
+        watermark = START if full else load_watermark(state_path)
+        # Снимок берётся до чтения документов: транзакции, не зафиксированные к этому моменту,
+        # попадут в следующую выгрузку
+        with connection.cursor() as cursor:
+            cursor.execute(SQL_SNAPSHOT_XMIN)
+            xmin = cursor.fetchone()[0]
+        name = 'film_work_{}.ndjson'.format(datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f'))
+        path = os.path.join(output_dir, name)
+        exported = self.export(path, {'xmin': watermark}, batch_size)
+        save_watermark(state_path, xmin)
+        self.stdout.write(self.style.SUCCESS(
+            'exported {} to {}'.format(exported, path) if exported else 'no changes'))
+
+    def export(self, path: str, params: dict, batch_size: int) -> int:
+        """Потоковая запись документов из серверного курсора пачками по batch_size строк.
+        Файл появляется под своим именем только целиком. Возвращает число строк"""
+        exported = 0
+        tmp_path = path + '.tmp'
+        with connection.chunked_cursor() as cursor, open(tmp_path, 'w') as output:
+            cursor.itersize = batch_size
+            cursor.execute(SQL_CHANGED_DOCUMENTS, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                output.writelines(document + '\n' for document, in rows)
+                exported += len(rows)
+        if exported:
+            os.replace(tmp_path, path)
+        else:
+            os.remove(tmp_path)
+        return exported
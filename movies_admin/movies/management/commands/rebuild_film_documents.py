@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db import transaction
+
+from movies.models import FilmWork
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = ('Пересобрать content.film_work_document пачками по id кинопроизведений '
+            'и заменить документы удалённых кинопроизведений надгробиями')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='число кинопроизведений в одной транзакции')
+
+    def handle(self, *args, batch_size=BATCH_SIZE, **options):
+        rebuilt = 0
+        last_id = None
+        while True:
+            film_ids = FilmWork.objects.order_by('id').values_list('id', flat=True)
+            if last_id:
+                film_ids = film_ids.filter(id__gt=last_id)
+            film_ids = list(film_ids[:batch_size])
+            if not film_ids:
+                break
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute("""SELECT content.refresh_film_work_documents(%s::uuid[])""", [film_ids])
+            rebuilt += len(film_ids)
+            last_id = film_ids[-1]
+            self.stdout.write('rebuilt {}'.format(rebuilt))
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                WITH removed AS (
+                    DELETE FROM content.film_work_document d
+                    WHERE NOT EXISTS (SELECT 1 FROM content.film_work fw WHERE fw.id = d.film_work_id)
+                    RETURNING film_work_id
+                )
+                INSERT INTO content.film_work_tombstone (film_work_id, deleted_at)
+                SELECT film_work_id, now() FROM removed
+                ON CONFLICT (film_work_id) DO UPDATE
+                SET deleted_at = EXCLUDED.deleted_at, changed_xid = EXCLUDED.changed_xid
+                """)
+            removed = cursor.rowcount
+            # Кинопроизведения, вставленные заново при отключённых триггерах
+            cursor.execute("""
+                DELETE FROM content.film_work_tombstone t
+                WHERE EXISTS (SELECT 1 FROM content.film_work fw WHERE fw.id = t.film_work_id)
+                """)
+        self.stdout.write(self.style.SUCCESS('rebuilt {}, removed {}'.format(rebuilt, removed)))
@@ -0,0 +1,42 @@
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# Конфигурация должна совпадать с movies.search.SEARCH_CONFIG.
+# Существующие строки заполняются пачками в миграции 0005_backfill_search_vector
+SEARCH_VECTOR_TRIGGER = """
+    CREATE FUNCTION content.film_work_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(NEW.description, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER film_work_search_vector
+        BEFORE INSERT OR UPDATE OF title, description ON content.film_work
+        FOR EACH ROW EXECUTE FUNCTION content.film_work_search_vector();
+    """
+
+DROP_SEARCH_VECTOR_TRIGGER = """
+    DROP TRIGGER film_work_search_vector ON content.film_work;
+    DROP FUNCTION content.film_work_search_vector();
+    """
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0002_rename_created_filmwork_created_at_and_more'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='filmwork',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(SEARCH_VECTOR_TRIGGER, DROP_SEARCH_VECTOR_TRIGGER),
+    ]
@@ -0,0 +1,35 @@
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY не выполняется внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('movies', '0003_filmwork_search_vector'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='filmwork',
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=['search_vector'], name='film_work_search_vector_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='genre',
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'),
+                name='genre_name_trgm_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='person',
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper('full_name'), name='gin_trgm_ops'),
+                name='person_full_name_trgm_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations
+
+BATCH_SIZE = 5000
+
+# Пачка кинопроизведений без search_vector после id; UPDATE вызывает триггер film_work_search_vector
+BACKFILL_BATCH = """
+    WITH batch AS (
+        SELECT id FROM content.film_work
+        WHERE id > %s AND search_vector IS NULL
+        ORDER BY id
+        LIMIT %s
+    )
+    UPDATE content.film_work f SET title = f.title
+    FROM batch WHERE f.id = batch.id
+    RETURNING f.id;
+    """
+
+
+def backfill_search_vector(apps, schema_editor):
+    """Заполнение search_vector существующих строк пачками по BATCH_SIZE:
+    каждая пачка фиксируется отдельно, блокировки строк держатся недолго"""
+    last_id = '00000000-0000-0000-0000-000000000000'
+    with schema_editor.connection.cursor() as cursor:
+        while True:
+            cursor.execute(BACKFILL_BATCH, [last_id, BATCH_SIZE])
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                break
+            last_id = max(ids)
+
+
+class Migration(migrations.Migration):
+    # Пачки заполняются вне общей транзакции миграции.
+    # Миграция идёт до 0006_film_work_document: триггеров документов ещё нет,
+    # и UPDATE каждой пачки не пересобирает документы кинопроизведений
+    atomic = False
+
+    dependencies = [
+        ('movies', '0004_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_search_vector, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,169 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Документ собирается из film_work, жанров и участников, сгруппированных по роли;
+# неизменившийся документ не перезаписывается и не попадает в инкрементальную выгрузку
+REFRESH_FUNCTION = """
+    CREATE FUNCTION content.refresh_film_work_documents(film_ids uuid[]) RETURNS void AS $$
+        INSERT INTO content.film_work_document (film_work_id, document, updated_at)
+        SELECT fw.id,
+               jsonb_build_object(
+                   'id', fw.id,
+                   'title', fw.title,
+                   'description', fw.description,
+                   'creation_date', fw.creation_date,
+                   'rating', fw.rating,
+                   'type', fw.type,
+                   'genres', coalesce((
+                       SELECT jsonb_agg(jsonb_build_object('id', g.id, 'name', g.name) ORDER BY g.name, g.id)
+                       FROM content.genre_film_work gfw
+                       JOIN content.genre g ON g.id = gfw.genre_id
+                       WHERE gfw.film_work_id = fw.id
+                   ), '[]'::jsonb),
+                   'persons', coalesce((
+                       SELECT jsonb_object_agg(roles.role, roles.persons)
+                       FROM (
+                           SELECT pfw.role,
+                                  jsonb_agg(jsonb_build_object('id', p.id, 'full_name', p.full_name)
+                                            ORDER BY p.full_name, p.id) AS persons
+                           FROM content.person_film_work pfw
+                           JOIN content.person p ON p.id = pfw.person_id
+                           WHERE pfw.film_work_id = fw.id
+                           GROUP BY pfw.role
+                       ) AS roles
+                   ), '{}'::jsonb)
+               ),
+               now()
+        FROM content.film_work fw
+        WHERE fw.id = ANY(film_ids)
+        ON CONFLICT (film_work_id) DO UPDATE
+        SET document = EXCLUDED.document, updated_at = EXCLUDED.updated_at
+        WHERE content.film_work_document.document IS DISTINCT FROM EXCLUDED.document;
+    $$ LANGUAGE sql;
+    """
+
+# Триггеры уровня оператора: документы обновляются один раз на пачку строк
+# по таблицам переходов old_rows / new_rows
+TRIGGER_FUNCTIONS = """
+    CREATE FUNCTION content.film_work_document_on_film_work() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'TRUNCATE' THEN
+            TRUNCATE content.film_work_document;
+        ELSIF TG_OP = 'DELETE' THEN
+            DELETE FROM content.film_work_document WHERE film_work_id IN (SELECT id FROM old_rows);
+        ELSE
+            PERFORM content.refresh_film_work_documents(ARRAY(SELECT id FROM new_rows));
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE FUNCTION content.film_work_document_on_link() RETURNS trigger AS $$
+    DECLARE
+        film_ids uuid[] := '{}';
+    BEGIN
+        IF TG_OP <> 'DELETE' THEN
+            film_ids := film_ids || ARRAY(SELECT film_work_id FROM new_rows);
+        END IF;
+        IF TG_OP <> 'INSERT' THEN
+            film_ids := film_ids || ARRAY(SELECT film_work_id FROM old_rows);
+        END IF;
+        PERFORM content.refresh_film_work_documents(film_ids);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE FUNCTION content.film_work_document_on_genre() RETURNS trigger AS $$
+    BEGIN
+        PERFORM content.refresh_film_work_documents(ARRAY(
+            SELECT gfw.film_work_id
+            FROM new_rows n
+            JOIN old_rows o ON o.id = n.id
+            JOIN content.genre_film_work gfw ON gfw.genre_id = n.id
+            WHERE n.name IS DISTINCT FROM o.name
+        ));
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE FUNCTION content.film_work_document_on_truncate() RETURNS trigger AS $$
+    BEGIN
+        PERFORM content.refresh_film_work_documents(ARRAY(SELECT id FROM content.film_work));
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE FUNCTION content.film_work_document_on_person() RETURNS trigger AS $$
+    BEGIN
+        PERFORM content.refresh_film_work_documents(ARRAY(
+            SELECT pfw.film_work_id
+            FROM new_rows n
+            JOIN old_rows o ON o.id = n.id
+            JOIN content.person_film_work pfw ON pfw.person_id = n.id
+            WHERE n.full_name IS DISTINCT FROM o.full_name
+        ));
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+    """
+
+TRIGGER = """
+    CREATE TRIGGER film_work_document_{event} AFTER {event} ON content.{table}
+        {transition} FOR EACH STATEMENT EXECUTE FUNCTION content.film_work_document_on_{function}();
+    """
+TRANSITIONS = {
+    'insert': 'REFERENCING NEW TABLE AS new_rows',
+    'update': 'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows',
+    'delete': 'REFERENCING OLD TABLE AS old_rows',
+    'truncate': '',
+}
+TRIGGER_EVENTS = {
+    'film_work': ('film_work', ('insert', 'update', 'delete', 'truncate')),
+    'genre_film_work': ('link', ('insert', 'update', 'delete')),
+    'person_film_work': ('link', ('insert', 'update', 'delete')),
+    'genre': ('genre', ('update',)),
+    'person': ('person', ('update',)),
+}
+# Очистка таблиц связей, жанров или участников затрагивает все документы:
+# таблиц переходов у TRUNCATE нет, поэтому обновляются документы всех кинопроизведений
+TRUNCATE_TABLES = ('genre_film_work', 'person_film_work', 'genre', 'person')
+TRIGGERS = ''.join(
+    TRIGGER.format(event=event, table=table, function=function, transition=TRANSITIONS[event])
+    for table, (function, events) in TRIGGER_EVENTS.items() for event in events
+) + ''.join(
+    TRIGGER.format(event='truncate', table=table, function='truncate', transition=TRANSITIONS['truncate'])
+    for table in TRUNCATE_TABLES
+)
+
+DROP_FUNCTIONS = """
+    DROP FUNCTION content.film_work_document_on_film_work() CASCADE;
+    DROP FUNCTION content.film_work_document_on_link() CASCADE;
+    DROP FUNCTION content.film_work_document_on_genre() CASCADE;
+    DROP FUNCTION content.film_work_document_on_person() CASCADE;
+    DROP FUNCTION content.film_work_document_on_truncate() CASCADE;
+    DROP FUNCTION content.refresh_film_work_documents(uuid[]);
+    """
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0005_backfill_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FilmWorkDocument',
+            fields=[
+                ('film_work', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='document', serialize=False, to='movies.filmwork')),
+                ('document', models.JSONField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'content"."film_work_document',
+            },
+        ),
+        migrations.RunSQL(REFRESH_FUNCTION + TRIGGER_FUNCTIONS + TRIGGERS, DROP_FUNCTIONS),
+    ]
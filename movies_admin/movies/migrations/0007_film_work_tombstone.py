@@ -0,0 +1,162 @@
+from django.db import migrations, models
+
+# Номер транзакции, последней изменившей документ или надгробие. Выгрузка запоминает xmin снимка:
+# транзакция, не зафиксированная к этому моменту, имеет номер не меньше xmin и попадёт
+# в следующую выгрузку, даже если зафиксируется позже транзакций с большими номерами
+CHANGED_XID = """
+    ALTER TABLE content.film_work_document
+        ADD COLUMN changed_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+    ALTER TABLE content.film_work_tombstone
+        ADD COLUMN changed_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+    """
+
+DROP_CHANGED_XID = """
+    ALTER TABLE content.film_work_document DROP COLUMN changed_xid;
+    ALTER TABLE content.film_work_tombstone DROP COLUMN changed_xid;
+    """
+
+REFRESH_FUNCTION = """
+    CREATE OR REPLACE FUNCTION content.refresh_film_work_documents(film_ids uuid[]) RETURNS void AS $$
+        INSERT INTO content.film_work_document (film_work_id, document, updated_at, changed_xid)
+        SELECT fw.id,
+               jsonb_build_object(
+                   'id', fw.id,
+                   'title', fw.title,
+                   'description', fw.description,
+                   'creation_date', fw.creation_date,
+                   'rating', fw.rating,
+                   'type', fw.type,
+                   'genres', coalesce((
+                       SELECT jsonb_agg(jsonb_build_object('id', g.id, 'name', g.name) ORDER BY g.name, g.id)
+                       FROM content.genre_film_work gfw
+                       JOIN content.genre g ON g.id = gfw.genre_id
+                       WHERE gfw.film_work_id = fw.id
+                   ), '[]'::jsonb),
+                   'persons', coalesce((
+                       SELECT jsonb_object_agg(roles.role, roles.persons)
+                       FROM (
+                           SELECT pfw.role,
+                                  jsonb_agg(jsonb_build_object('id', p.id, 'full_name', p.full_name)
+                                            ORDER BY p.full_name, p.id) AS persons
+                           FROM content.person_film_work pfw
+                           JOIN content.person p ON p.id = pfw.person_id
+                           WHERE pfw.film_work_id = fw.id
+                           GROUP BY pfw.role
+                       ) AS roles
+                   ), '{}'::jsonb)
+               ),
+               now(),
+               pg_current_xact_id()
+        FROM content.film_work fw
+        WHERE fw.id = ANY(film_ids)
+        ON CONFLICT (film_work_id) DO UPDATE
+        SET document = EXCLUDED.document, updated_at = EXCLUDED.updated_at, changed_xid = EXCLUDED.changed_xid
+        WHERE content.film_work_document.document IS DISTINCT FROM EXCLUDED.document;
+    $$ LANGUAGE sql;
+    """
+
+OLD_REFRESH_FUNCTION = """
+    CREATE OR REPLACE FUNCTION content.refresh_film_work_documents(film_ids uuid[]) RETURNS void AS $$
+        INSERT INTO content.film_work_document (film_work_id, document, updated_at)
+        SELECT fw.id,
+               jsonb_build_object(
+                   'id', fw.id,
+                   'title', fw.title,
+                   'description', fw.description,
+                   'creation_date', fw.creation_date,
+                   'rating', fw.rating,
+                   'type', fw.type,
+                   'genres', coalesce((
+                       SELECT jsonb_agg(jsonb_build_object('id', g.id, 'name', g.name) ORDER BY g.name, g.id)
+                       FROM content.genre_film_work gfw
+                       JOIN content.genre g ON g.id = gfw.genre_id
+                       WHERE gfw.film_work_id = fw.id
+                   ), '[]'::jsonb),
+                   'persons', coalesce((
+                       SELECT jsonb_object_agg(roles.role, roles.persons)
+                       FROM (
+                           SELECT pfw.role,
+                                  jsonb_agg(jsonb_build_object('id', p.id, 'full_name', p.full_name)
+                                            ORDER BY p.full_name, p.id) AS persons
+                           FROM content.person_film_work pfw
+                           JOIN content.person p ON p.id = pfw.person_id
+                           WHERE pfw.film_work_id = fw.id
+                           GROUP BY pfw.role
+                       ) AS roles
+                   ), '{}'::jsonb)
+               ),
+               now()
+        FROM content.film_work fw
+        WHERE fw.id = ANY(film_ids)
+        ON CONFLICT (film_work_id) DO UPDATE
+        SET document = EXCLUDED.document, updated_at = EXCLUDED.updated_at
+        WHERE content.film_work_document.document IS DISTINCT FROM EXCLUDED.document;
+    $$ LANGUAGE sql;
+    """
+
+# Удаление кинопроизведений оставляет надгробия для выгрузки, повторная вставка их снимает
+FILM_WORK_FUNCTION = """
+    CREATE OR REPLACE FUNCTION content.film_work_document_on_film_work() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'TRUNCATE' THEN
+            INSERT INTO content.film_work_tombstone (film_work_id, deleted_at)
+            SELECT film_work_id, now() FROM content.film_work_document
+            ON CONFLICT (film_work_id) DO UPDATE
+            SET deleted_at = EXCLUDED.deleted_at, changed_xid = EXCLUDED.changed_xid;
+            TRUNCATE content.film_work_document;
+        ELSIF TG_OP = 'DELETE' THEN
+            INSERT INTO content.film_work_tombstone (film_work_id, deleted_at)
+            SELECT id, now() FROM old_rows
+            ON CONFLICT (film_work_id) DO UPDATE
+            SET deleted_at = EXCLUDED.deleted_at, changed_xid = EXCLUDED.changed_xid;
+            DELETE FROM content.film_work_document WHERE film_work_id IN (SELECT id FROM old_rows);
+        ELSE
+            IF TG_OP = 'INSERT' THEN
+                DELETE FROM content.film_work_tombstone WHERE film_work_id IN (SELECT id FROM new_rows);
+            END IF;
+            PERFORM content.refresh_film_work_documents(ARRAY(SELECT id FROM new_rows));
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+    """
+
+OLD_FILM_WORK_FUNCTION = """
+    CREATE OR REPLACE FUNCTION content.film_work_document_on_film_work() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'TRUNCATE' THEN
+            TRUNCATE content.film_work_document;
+        ELSIF TG_OP = 'DELETE' THEN
+            DELETE FROM content.film_work_document WHERE film_work_id IN (SELECT id FROM old_rows);
+        ELSE
+            PERFORM content.refresh_film_work_documents(ARRAY(SELECT id FROM new_rows));
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+    """
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0006_film_work_document'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FilmWorkTombstone',
+            fields=[
+                ('film_work_id', models.UUIDField(primary_key=True, serialize=False)),
+                ('deleted_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'content"."film_work_tombstone',
+            },
+        ),
+        migrations.RunSQL(CHANGED_XID, DROP_CHANGED_XID),
+        migrations.RunSQL(
+            REFRESH_FUNCTION + FILM_WORK_FUNCTION,
+            OLD_REFRESH_FUNCTION + OLD_FILM_WORK_FUNCTION,
+        ),
+    ]
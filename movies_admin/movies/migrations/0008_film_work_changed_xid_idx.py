@@ -0,0 +1,20 @@
+from django.db import migrations
+
+# Выгрузка документов и надгробий по номеру изменившей их транзакции
+CHANGED_XID_INDEXES = [
+    ("""CREATE INDEX CONCURRENTLY film_work_document_changed_idx ON content.film_work_document (changed_xid)""",
+     """DROP INDEX CONCURRENTLY content.film_work_document_changed_idx"""),
+    ("""CREATE INDEX CONCURRENTLY film_work_tombstone_changed_idx ON content.film_work_tombstone (changed_xid)""",
+     """DROP INDEX CONCURRENTLY content.film_work_tombstone_changed_idx"""),
+]
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY не выполняется внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('movies', '0007_film_work_tombstone'),
+    ]
+
+    operations = [migrations.RunSQL(sql, reverse_sql) for sql, reverse_sql in CHANGED_XID_INDEXES]
@@ -1,7 +1,11 @@
 import uuid
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.indexes import OpClass
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.db.models import UniqueConstraint
 from django.db.models import Index
+from django.db.models.functions import Upper
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils.translation import gettext_lazy as _
 
@@ -36,6 +40,12 @@ class Genre(UUIDMixin, TimeStampedMixin):
 
     class Meta:
         db_table = "content\".\"genre"
+        indexes = [
+            GinIndex(
+                OpClass(Upper('name'), name='gin_trgm_ops'),
+                name='genre_name_trgm_idx'
+            ),
+        ]
         verbose_name = _('Genre')
         verbose_name_plural = _('Genres')
 
@@ -63,9 +73,17 @@ class FilmWork(UUIDMixin, TimeStampedMixin):
     )
     genres = models.ManyToManyField(Genre, through='GenreFilmWork')
     persons = models.ManyToManyField('Person', through='PersonFilmWork')
+    # Заполняется триггером film_work_search_vector из title и description
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         db_table = "content\".\"film_work"
+        indexes = [
+            GinIndex(
+                fields=['search_vector'],
+                name='film_work_search_vector_idx'
+            ),
+        ]
         verbose_name = _('Film production')
         verbose_name_plural = _('Film productions')
 
@@ -102,6 +120,12 @@ class Person(UUIDMixin, TimeStampedMixin):
 
     class Meta:
         db_table = "content\".\"person"
+        indexes = [
+            GinIndex(
+                OpClass(Upper('full_name'), name='gin_trgm_ops'),
+                name='person_full_name_trgm_idx'
+            ),
+        ]
         verbose_name = _('Participant of the film')
         verbose_name_plural = _('Participants of the film')
 
@@ -136,4 +160,34 @@ class PersonFilmWork(UUIDMixin):
                 fields=['film_work', 'person', 'role'],
                 name='unique_film_work_person_id_role'
             ),
-        ]
\ No newline at end of file
+        ]
+
+
+class FilmWorkDocument(models.Model):
+    # Кинопроизведение с жанрами и участниками по ролям одним документом;
+    # поддерживается триггерами на film_work, genre, person и таблицах связей,
+    # заполняется целиком командой rebuild_film_documents.
+    # Колонка changed_xid (номер изменившей транзакции, xid8) заполняется в SQL, в модели её нет
+    film_work = models.OneToOneField(
+        FilmWork,
+        primary_key=True,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='document'
+    )
+    document = models.JSONField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "content\".\"film_work_document"
+
+
+class FilmWorkTombstone(models.Model):
+    # Удалённое кинопроизведение для инкрементальной выгрузки документов;
+    # записывается триггером на удаление из film_work, снимается при повторной вставке;
+    # changed_xid, как у документа, заполняется значением по умолчанию в базе
+    film_work_id = models.UUIDField(primary_key=True)
+    deleted_at = models.DateTimeField()
+
+    class Meta:
+        db_table = "content\".\"film_work_tombstone"
@@ -0,0 +1,152 @@
+import base64
+import binascii
+import json
+
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import FieldDoesNotExist
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+CURSOR_VAR = 'cursor'
+
+
+def estimate_count(queryset) -> int:
+    """Оценка числа строк планировщиком Postgres: для запроса без условий —
+    pg_class.reltuples таблицы, иначе Plan Rows из EXPLAIN.
+    None, если статистики по таблице ещё нет"""
+    query = queryset.query
+    with connections[queryset.db].cursor() as cursor:
+        if not query.where and not query.distinct and not query.combinator:
+            cursor.execute(
+                """SELECT reltuples FROM pg_class WHERE oid = %s::regclass""",
+                ['"{}"'.format(queryset.model._meta.db_table)]
+            )
+            estimate = cursor.fetchone()[0]
+            return int(estimate) if estimate >= 0 else None
+        sql, params = queryset.order_by().query.sql_with_params()
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор с оценкой числа строк вместо COUNT(*), если оценка не меньше
+    exact_count_threshold; на небольших выборках считает точно"""
+    exact_count_threshold = 10000
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is None or estimate < self.exact_count_threshold:
+            self.estimated = False
+            return super().count
+        self.estimated = True
+        return estimate
+
+
+class KeysetChangeList(ChangeList):
+    """Список объектов админки с постраничным переходом по ключу сортировки
+    (keyset): страница выбирается условием по значениям полей сортировки
+    последней (или первой) строки соседней страницы, а не OFFSET.
+    Используется, если сортировка состоит только из полей модели без NULL,
+    иначе остаются обычные номера страниц"""
+
+    def __init__(self, request, *args, **kwargs):
+        self.cursor = request.GET.get(CURSOR_VAR)
+        self.keyset_next_url = self.keyset_previous_url = self.keyset_first_url = None
+        super().__init__(request, *args, **kwargs)
+        # Курсор не переносится в ссылки сортировки, фильтров и поиска
+        self.params.pop(CURSOR_VAR, None)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def keyset_fields(self) -> list:
+        """Поля сортировки в виде (имя, поле модели, по убыванию) или None,
+        если по такой сортировке переход по ключу невозможен"""
+        keys = []
+        for item in self.queryset.query.order_by:
+            if not isinstance(item, str):
+                return None
+            name = item.lstrip('-')
+            try:
+                field = self.opts.pk if name == 'pk' else self.opts.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            if not field.concrete or field.null:
+                return None
+            keys.append((name, field, item.startswith('-')))
+        return keys or None
+
+    def encode_cursor(self, keys: list, obj, direction: str) -> str:
+        values = [getattr(obj, field.attname) for _, field, _ in keys]
+        data = json.dumps([direction, values], cls=DjangoJSONEncoder)
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self, keys: list) -> tuple:
+        try:
+            direction, values = json.loads(base64.urlsafe_b64decode(self.cursor.encode()))
+            if direction not in ('next', 'previous') or len(values) != len(keys):
+                raise ValueError(self.cursor)
+            return direction, [field.to_python(value) for (_, field, _), value in zip(keys, values)]
+        except (ValueError, TypeError, binascii.Error, ValidationError) as error:
+            raise IncorrectLookupParameters(error)
+
+    @staticmethod
+    def keyset_filter(keys: list, values: list, forward: bool) -> Q:
+        """Строки после values в порядке keys (forward) или перед ними"""
+        condition = Q()
+        equal = {}
+        for (name, _, descending), value in zip(keys, values):
+            lookup = '__lt' if descending == forward else '__gt'
+            condition |= Q(**equal, **{name + lookup: value})
+            equal[name] = value
+        return condition
+
+    def get_results(self, request):
+        super().get_results(request)
+        self.result_count_estimated = getattr(self.paginator, 'estimated', False)
+        keys = self.keyset_fields()
+        if keys is None or not self.multi_page or self.show_all and self.can_show_all:
+            return
+        queryset = self.queryset
+        direction = 'next'
+        if self.cursor:
+            direction, values = self.decode_cursor(keys)
+            queryset = queryset.filter(self.keyset_filter(keys, values, direction == 'next'))
+        if direction == 'previous':
+            queryset = queryset.reverse()
+        rows = list(queryset[:self.list_per_page + 1])
+        more = len(rows) > self.list_per_page
+        rows = rows[:self.list_per_page]
+        if direction == 'previous':
+            rows.reverse()
+        self.result_list = rows
+        self.keyset_first_url = self.get_query_string(remove=[CURSOR_VAR])
+        if not rows:
+            return
+        if direction == 'next' and more or direction == 'previous':
+            self.keyset_next_url = self.get_query_string(
+                {CURSOR_VAR: self.encode_cursor(keys, rows[-1], 'next')})
+        if direction == 'previous' and more or direction == 'next' and self.cursor:
+            self.keyset_previous_url = self.get_query_string(
+                {CURSOR_VAR: self.encode_cursor(keys, rows[0], 'previous')})
+
+
+class KeysetPaginationMixin:
+    """Оценка числа строк и переход по ключу сортировки в списке объектов админки.
+    Полное число строк без фильтров не считается"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
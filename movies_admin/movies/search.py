@@ -0,0 +1,48 @@
+import uuid
+
+from django.contrib.postgres.search import SearchQuery
+from django.contrib.postgres.search import SearchRank
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db.models import F
+from django.db.models import Q
+from django.db.models.functions import Greatest
+from django.db.models.functions import Upper
+
+# Конфигурация триггера film_work_search_vector (миграция 0003)
+SEARCH_CONFIG = 'english'
+
+
+class SearchMixin:
+    """Поиск в админке по индексам Postgres вместо ILIKE по search_fields.
+    vector_field ищется полнотекстовым запросом по GIN-индексу tsvector,
+    trigram_fields — подстрокой и нечётким совпадением по индексам gin_trgm_ops по UPPER(field),
+    строка в виде UUID ищется точным совпадением первичного ключа.
+    Результаты упорядочены по убыванию search_rank"""
+    vector_field = None
+    trigram_fields = ()
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        try:
+            return queryset.filter(pk=uuid.UUID(term)), False
+        except ValueError:
+            pass
+        filters = Q()
+        ranks = []
+        if self.vector_field:
+            query = SearchQuery(term, config=SEARCH_CONFIG, search_type='websearch')
+            filters |= Q(**{self.vector_field: query})
+            ranks.append(SearchRank(F(self.vector_field), query))
+        for field in self.trigram_fields:
+            # Сравнение по UPPER(field), чтобы запрос использовал индекс по тому же выражению
+            upper = field + '_upper'
+            queryset = queryset.alias(**{upper: Upper(field)})
+            filters |= Q(**{upper + '__contains': term.upper()}) | Q(**{upper + '__trigram_similar': term.upper()})
+            ranks.append(TrigramSimilarity(field, term))
+        if not ranks:
+            return super().get_search_results(request, queryset, search_term)
+        rank = ranks[0] if len(ranks) == 1 else Greatest(*ranks)
+        queryset = queryset.filter(filters).annotate(search_rank=rank)
+        return queryset.order_by('-search_rank'), False
@@ -0,0 +1,338 @@
+from datetime import datetime
+from datetime import timezone
+import glob
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import http_date
+
+from .models import FilmWork
+from .models import FilmWorkDocument
+from .models import Genre
+from .models import GenreFilmWork
+from .models import Person
+from .models import PersonFilmWork
+from .pagination import EstimatedCountPaginator
+from .pagination import estimate_count
+
+
+class FilmWorkApiTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        genres = [Genre.objects.create(name='genre {}'.format(n)) for n in range(3)]
+        persons = [Person.objects.create(full_name='person {}'.format(n)) for n in range(4)]
+        cls.films = []
+        for n in range(12):
+            film = FilmWork.objects.create(title='film {}'.format(n), rating=n)
+            for genre in genres[:n % 3 + 1]:
+                GenreFilmWork.objects.create(film_work=film, genre=genre)
+            PersonFilmWork.objects.create(film_work=film, person=persons[n % 4],
+                                          role=PersonFilmWork.RoleTypes.ACTOR)
+            PersonFilmWork.objects.create(film_work=film, person=persons[(n + 1) % 4],
+                                          role=PersonFilmWork.RoleTypes.DIRECTOR)
+            cls.films.append(film)
+
+    def get_page(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/movies/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(queries)
+
+    def test_list_queries_do_not_grow_with_page_size(self):
+        small, small_queries = self.get_page(page_size=2)
+        large, large_queries = self.get_page(page_size=10)
+        self.assertEqual(len(small['results']), 2)
+        self.assertEqual(len(large['results']), 10)
+        self.assertEqual(small_queries, large_queries)
+        self.assertEqual(large_queries, 1)
+
+    def test_cursor_pagination(self):
+        ids = []
+        page, _ = self.get_page(page_size=5)
+        while True:
+            ids += [film['id'] for film in page['results']]
+            if not page['next']:
+                break
+            response = self.client.get(page['next'])
+            page = response.json()
+        self.assertEqual(ids, sorted(str(film.id) for film in self.films))
+
+    def test_detail_groups_persons_by_role(self):
+        film = self.films[2]
+        response = self.client.get('/api/v1/movies/{}/'.format(film.id))
+        data = response.json()
+        self.assertEqual(data['genres'], ['genre 0', 'genre 1', 'genre 2'])
+        self.assertEqual([person['full_name'] for person in data['persons']['ACT']], ['person 2'])
+        self.assertEqual([person['full_name'] for person in data['persons']['DRC']], ['person 3'])
+
+    def test_not_modified(self):
+        url = '/api/v1/movies/{}/'.format(self.films[0].id)
+        response = self.client.get(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        Person.objects.filter(full_name='person 0').update(full_name='renamed')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_last_modified_follows_document(self):
+        # Удаление связи не оставляет своего времени, но обновляет документ кинопроизведения
+        film = self.films[1]
+        PersonFilmWork.objects.filter(film_work=film, role=PersonFilmWork.RoleTypes.DIRECTOR).delete()
+        updated_at = datetime(2030, 1, 1, tzinfo=timezone.utc)
+        FilmWorkDocument.objects.filter(pk=film.pk).update(updated_at=updated_at)
+        response = self.client.get('/api/v1/movies/{}/'.format(film.id))
+        self.assertEqual(response['Last-Modified'], http_date(updated_at.timestamp()))
+        self.assertNotIn('DRC', response.json()['persons'])
+
+    def test_person_etag_follows_deleted_link(self):
+        person = Person.objects.get(full_name='person 0')
+        url = '/api/v1/persons/{}/'.format(person.id)
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        PersonFilmWork.objects.filter(person=person, film_work=self.films[0]).delete()
+        response_after = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response_after.status_code, 200)
+        self.assertNotIn(str(self.films[0].id), [film['id'] for film in response_after.json()['films']])
+
+    def test_missing_object(self):
+        response = self.client.get('/api/v1/genres/00000000-0000-0000-0000-000000000000/')
+        self.assertEqual(response.status_code, 404)
+
+
+class FilmWorkDocumentTest(TestCase):
+
+    def test_document_follows_changes(self):
+        film = FilmWork.objects.create(title='film')
+        genre = Genre.objects.create(name='genre')
+        person = Person.objects.create(full_name='person')
+        GenreFilmWork.objects.create(film_work=film, genre=genre)
+        link = PersonFilmWork.objects.create(film_work=film, person=person, role=PersonFilmWork.RoleTypes.ACTOR)
+        person.full_name = 'renamed'
+        person.save()
+        document = FilmWorkDocument.objects.get(pk=film.pk).document
+        self.assertEqual(document['title'], 'film')
+        self.assertEqual(document['genres'], [{'id': str(genre.id), 'name': 'genre'}])
+        self.assertEqual(document['persons'], {'ACT': [{'id': str(person.id), 'full_name': 'renamed'}]})
+        link.delete()
+        self.assertEqual(FilmWorkDocument.objects.get(pk=film.pk).document['persons'], {})
+        film.delete()
+        self.assertFalse(FilmWorkDocument.objects.filter(pk=film.pk).exists())
+
+    def document_version(self, film_id) -> str:
+        """Положение строки документа: UPDATE создаёт новую версию строки даже в той же транзакции"""
+        with connection.cursor() as cursor:
+            cursor.execute("""SELECT ctid::text FROM content.film_work_document WHERE film_work_id = %s""",
+                           [film_id])
+            return cursor.fetchone()[0]
+
+    def test_unchanged_document_is_not_rewritten(self):
+        film = FilmWork.objects.create(title='film')
+        version = self.document_version(film.pk)
+        film.save()
+        self.assertEqual(self.document_version(film.pk), version)
+        film.title = 'changed'
+        film.save()
+        self.assertNotEqual(self.document_version(film.pk), version)
+
+    def test_truncate_refreshes_documents(self):
+        film = FilmWork.objects.create(title='film')
+        GenreFilmWork.objects.create(film_work=film, genre=Genre.objects.create(name='genre'))
+        person = Person.objects.create(full_name='person')
+        PersonFilmWork.objects.create(film_work=film, person=person, role=PersonFilmWork.RoleTypes.ACTOR)
+        with connection.cursor() as cursor:
+            # Отложенные проверки внешних ключей не дают выполнить TRUNCATE в той же транзакции
+            cursor.execute("""SET CONSTRAINTS ALL IMMEDIATE""")
+            cursor.execute("""TRUNCATE content.genre_film_work""")
+            self.assertEqual(FilmWorkDocument.objects.get(pk=film.pk).document['genres'], [])
+            cursor.execute("""TRUNCATE content.person CASCADE""")
+        self.assertEqual(FilmWorkDocument.objects.get(pk=film.pk).document['persons'], {})
+
+
+class ExportFilmDocumentsTest(TransactionTestCase):
+    """Выгрузка смотрит на номера зафиксированных транзакций, поэтому изменения
+    фиксируются по-настоящему, а таблицы content очищаются после каждого теста"""
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            cursor.execute("""TRUNCATE content.film_work, content.genre, content.person CASCADE""")
+            cursor.execute("""TRUNCATE content.film_work_tombstone""")
+
+    def export(self, output_dir: str) -> set:
+        """Названия выгруженных документов и id надгробий"""
+        before = set(glob.glob(os.path.join(output_dir, '*.ndjson')))
+        call_command('export_film_documents', output_dir=output_dir, batch_size=2, stdout=io.StringIO())
+        exported = set()
+        for path in set(glob.glob(os.path.join(output_dir, '*.ndjson'))) - before:
+            with open(path) as output:
+                for line in output:
+                    document = json.loads(line)
+                    exported.add(('deleted', document['id']) if document.get('deleted') else document['title'])
+        return exported
+
+    def test_exports_only_changed_films(self):
+        person = Person.objects.create(full_name='person')
+        films = [FilmWork.objects.create(title='film {}'.format(n)) for n in range(5)]
+        PersonFilmWork.objects.create(film_work=films[0], person=person, role=PersonFilmWork.RoleTypes.ACTOR)
+        link = PersonFilmWork.objects.create(film_work=films[3], person=person, role=PersonFilmWork.RoleTypes.ACTOR)
+        with tempfile.TemporaryDirectory() as output_dir:
+            self.assertEqual(len(self.export(output_dir)), 5)
+            self.assertEqual(self.export(output_dir), set())
+            films[1].title = 'changed'
+            films[1].save()
+            person.full_name = 'renamed'
+            person.save()
+            self.assertEqual(self.export(output_dir), {'changed', 'film 0', 'film 3'})
+            link.delete()
+            self.assertEqual(self.export(output_dir), {'film 3'})
+            film_id = films[2].id
+            films[2].delete()
+            self.assertEqual(self.export(output_dir), {('deleted', str(film_id))})
+
+    def test_late_commit_is_not_lost(self):
+        films = [FilmWork.objects.create(title='film {}'.format(n)) for n in range(2)]
+        late = connection.copy()
+        self.addCleanup(late.close)
+        with tempfile.TemporaryDirectory() as output_dir:
+            self.export(output_dir)
+            # Транзакция начинается раньше, а фиксируется позже выгрузки
+            late.set_autocommit(False)
+            with late.cursor() as cursor:
+                cursor.execute("""UPDATE content.film_work SET title = 'late' WHERE id = %s""", [films[0].id])
+            films[1].title = 'changed'
+            films[1].save()
+            self.assertEqual(self.export(output_dir), {'changed'})
+            late.commit()
+            late.set_autocommit(True)
+            self.assertIn('late', self.export(output_dir))
+
+
+class SearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.wars = FilmWork.objects.create(title='Star Wars', description='A galaxy far away')
+        cls.trek = FilmWork.objects.create(title='Star Trek', description='Space travel')
+        cls.galaxy = FilmWork.objects.create(title='Galaxy Quest', description='Actors in space')
+        cls.persons = [Person.objects.create(full_name=name) for name in ('John Smith', 'Jane Doe')]
+
+    def search(self, model, term: str) -> list:
+        model_admin = admin.site._registry[model]
+        queryset, _ = model_admin.get_search_results(None, model.objects.all(), term)
+        return list(queryset)
+
+    def require_trigram(self):
+        with connection.cursor() as cursor:
+            cursor.execute("""SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'""")
+            if cursor.fetchone() is None:
+                self.skipTest('pg_trgm не установлен')
+
+    def test_uuid_matches_primary_key(self):
+        self.assertEqual(self.search(FilmWork, ' {} '.format(self.trek.id)), [self.trek])
+
+    def test_websearch_query(self):
+        self.assertEqual(self.search(FilmWork, 'star -trek'), [self.wars])
+        self.assertEqual(self.search(FilmWork, '"star trek"'), [self.trek])
+        self.assertEqual(self.search(FilmWork, 'unknown'), [])
+
+    def test_rank_prefers_title(self):
+        # Совпадение в title (вес A) выше совпадения в description (вес B)
+        self.assertEqual(self.search(FilmWork, 'galaxy'), [self.galaxy, self.wars])
+
+    def test_trigram_substring_and_similarity(self):
+        self.require_trigram()
+        self.assertEqual(self.search(Person, 'ohn smi'), [self.persons[0]])
+        self.assertEqual(self.search(Person, 'Jon Smiht'), [self.persons[0]])
+        self.assertEqual(self.search(Person, str(self.persons[1].id)), [self.persons[1]])
+
+
+class EstimatedCountPaginatorTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for n in range(5):
+            Person.objects.create(full_name='person {}'.format(n))
+
+    def paginate(self, estimate):
+        paginator = EstimatedCountPaginator(Person.objects.order_by('pk'), 2)
+        paginator.exact_count_threshold = 100
+        with mock.patch('movies.pagination.estimate_count', return_value=estimate):
+            return paginator.count, paginator.estimated
+
+    def test_exact_count_below_threshold(self):
+        self.assertEqual(self.paginate(None), (5, False))
+        self.assertEqual(self.paginate(99), (5, False))
+
+    def test_estimate_from_threshold(self):
+        self.assertEqual(self.paginate(100), (100, True))
+        self.assertEqual(self.paginate(5000), (5000, True))
+
+    def test_estimate_count(self):
+        self.assertIsInstance(estimate_count(Person.objects.filter(full_name__startswith='person')), int)
+
+
+@mock.patch('movies.pagination.estimate_count', return_value=None)
+@mock.patch.object(admin.site._registry[Person], 'list_per_page', 2)
+class KeysetChangeListTest(TestCase):
+    url = '/admin/movies/person/'
+
+    @classmethod
+    def setUpTestData(cls):
+        # Повторяющиеся имена: порядок внутри них задаёт pk
+        for name in ('a', 'a', 'a', 'b', 'b', 'c', 'c'):
+            Person.objects.create(full_name=name)
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def get_page(self, query: str):
+        response = self.client.get(self.url + query)
+        self.assertEqual(response.status_code, 200)
+        cl = response.context['cl']
+        return [person.pk for person in cl.result_list], cl
+
+    def expected_pages(self, ordering: tuple) -> list:
+        pks = list(Person.objects.order_by(*ordering).values_list('pk', flat=True))
+        return [pks[n:n + 2] for n in range(0, len(pks), 2)]
+
+    def walk(self, query: str) -> tuple:
+        """Страницы при переходе вперёд до последней и затем назад до первой"""
+        forward, backward = [], []
+        rows, cl = self.get_page(query)
+        forward.append(rows)
+        while cl.keyset_next_url:
+            rows, cl = self.get_page(cl.keyset_next_url)
+            forward.append(rows)
+        backward.append(rows)
+        while cl.keyset_previous_url:
+            rows, cl = self.get_page(cl.keyset_previous_url)
+            backward.append(rows)
+        return forward, backward[::-1]
+
+    def test_next_and_previous_with_ties(self, *mocks):
+        expected = self.expected_pages(('full_name', '-pk'))
+        forward, backward = self.walk('?o=1')
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward, expected)
+
+    def test_descending_with_ties(self, *mocks):
+        expected = self.expected_pages(('-full_name', '-pk'))
+        forward, backward = self.walk('?o=-1')
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward, expected)
+
+    def test_first_page_has_no_previous(self, *mocks):
+        _, cl = self.get_page('?o=1')
+        self.assertIsNone(cl.keyset_previous_url)
+        self.assertIsNotNone(cl.keyset_next_url)
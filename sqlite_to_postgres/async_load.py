@@ -0,0 +1,233 @@
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, asynccontextmanager
+from dataclasses import dataclass
+import io
+import time
+
+import asyncpg
+
+from load_data import LoadOptions, attach_reporters, get_table_order
+from metrics import LoadMetrics
+from pg_work import copy_value
+from base import conflict_clause
+from settings import ASYNC_BATCH_SIZE
+from settings import ASYNC_CONNECTIONS
+from settings import ASYNC_QUEUE_SIZE
+from settings import dsl
+from settings import sqlite3_path
+from sqlite_work import SQLiteExtractor
+from table_init import TABLE_NAME_CLASSES
+
+SQL_COLUMN_TYPES = """
+    SELECT attname, format_type(atttypid, NULL)
+    FROM pg_attribute
+    WHERE attrelid = ('content.' || $1)::regclass AND attnum > 0 AND NOT attisdropped;
+    """
+
+
+def asyncpg_params(pg_data: dict) -> dict:
+    """Параметры подключения psycopg2 (settings.dsl) в виде параметров asyncpg"""
+    names = {'dbname': 'database', 'user': 'user', 'password': 'password', 'host': 'host', 'port': 'port'}
+    params = {names[key]: value for key, value in pg_data.items() if value not in (None, '')}
+    if 'port' in params:
+        params['port'] = int(params['port'])
+    return params
+
+
+def read_text_batch(cursor, size: int, transform) -> list:
+    """Пачка строк SQLite, преобразованная и переведённая в текст (без rowid).
+    Выполняется в потоке чтения SQLite"""
+    rows = cursor.fetchmany(size)
+    if not rows:
+        return []
+    return [tuple(None if value is None else str(value) for value in row)
+            for row in transform([row[1:] for row in rows])]
+
+
+async def column_casts(conn: asyncpg.Connection, table: str, headers: list) -> list:
+    """Типы колонок Postgres для приведения текстовых параметров; без модификатора длины,
+    чтобы слишком длинное значение вызывало ошибку, а не обрезалось приведением"""
+    types = dict(await conn.fetch(SQL_COLUMN_TYPES, table))
+    return [types[colm] for colm in headers]
+
+
+@dataclass
+class CountedConnection:
+    """Соединение asyncpg, считающее обращения к Postgres: каждый ожидаемый вызов соединения,
+    начало и фиксация транзакции. executemany отправляет команды конвейером и считается одним"""
+    conn: asyncpg.Connection
+    round_trips: int = 0
+
+    def __getattr__(self, name: str):
+        method = getattr(self.conn, name)
+
+        async def counted(*args, **kwargs):
+            self.round_trips += 1
+            return await method(*args, **kwargs)
+        return counted
+
+    @asynccontextmanager
+    async def transaction(self):
+        async with self.conn.transaction():
+            self.round_trips += 1
+            yield
+            self.round_trips += 1
+
+
+async def insert_batch(conn: CountedConnection, table: str, headers: list, casts: list, data: list) -> int:
+    """INSERT пачки одним атомарным executemany: параметры передаются текстом и приводятся
+    к типам колонок, команды отправляются конвейером без ожидания ответа на каждую строку.
+    Возвращает объём данных"""
+    sql_text = """INSERT INTO content.{} ({}) VALUES ({}) {}""".format(
+        table, ', '.join(headers),
+        ', '.join('${}::text::{}'.format(n, cast) for n, cast in enumerate(casts, 1)),
+        conflict_clause(headers))
+    await conn.executemany(sql_text, data)
+    return sum(len(value) for row in data for value in row if value is not None)
+
+
+async def copy_batch(conn: CountedConnection, table: str, headers: list, casts: list, data: list) -> int:
+    """COPY пачки в текстовом формате во временную таблицу и слияние с основной"""
+    staging = 'staging_{}'.format(table)
+    buffer = io.BytesIO(''.join(
+        '\t'.join(copy_value(value) for value in row) + '\n' for row in data
+    ).encode())
+    async with conn.transaction():
+        await conn.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE content.{table} INCLUDING DEFAULTS);
+            TRUNCATE {staging};
+            """.format(staging=staging, table=table))
+        await conn.copy_to_table(staging, source=buffer, columns=headers, format='text')
+        await conn.execute("""INSERT INTO content.{0} ({1}) SELECT {1} FROM {2} {3}""".format(
+            table, ', '.join(headers), staging, conflict_clause(headers)))
+    return len(buffer.getvalue())
+
+
+WRITE_METHODS = {'insert': insert_batch, 'copy': copy_batch}
+
+
+async def read_batches_async(loop: asyncio.AbstractEventLoop,
+                             executor: ThreadPoolExecutor,
+                             cursor,
+                             transform,
+                             batch_size: int,
+                             batches: asyncio.Queue,
+                             writers: int,
+                             metrics: LoadMetrics,
+                             table: str) -> None:
+    """Чтение пачек в потоке SQLite и передача их писателям; в конце по None на писателя"""
+    while True:
+        started = time.perf_counter()
+        data = await loop.run_in_executor(executor, read_text_batch, cursor, batch_size, transform)
+        metrics.record(table, rows_read=len(data), read_time=time.perf_counter() - started)
+        if not data:
+            break
+        await batches.put(data)
+    for _ in range(writers):
+        await batches.put(None)
+
+
+async def write_batches_async(pool: asyncpg.Pool,
+                              table: str,
+                              headers: list,
+                              batches: asyncio.Queue,
+                              insert_method: str,
+                              metrics: LoadMetrics) -> None:
+    """Писатель: своё соединение из пула, каждая пачка в отдельной транзакции"""
+    write = WRITE_METHODS[insert_method]
+    async with pool.acquire() as conn:
+        casts = await column_casts(conn, table, headers)
+        while True:
+            data = await batches.get()
+            if data is None:
+                return
+            started = time.perf_counter()
+            counted = CountedConnection(conn)
+            size = await write(counted, table, headers, casts, data)
+            metrics.record(table, rows_written=len(data), batches=1, bytes_sent=size,
+                           round_trips=counted.round_trips, write_time=time.perf_counter() - started)
+
+
+async def load_table_async(loop: asyncio.AbstractEventLoop,
+                           executor: ThreadPoolExecutor,
+                           sqlite_extractor: SQLiteExtractor,
+                           pool: asyncpg.Pool,
+                           table: str,
+                           connections: int,
+                           batch_size: int,
+                           queue_size: int,
+                           insert_method: str,
+                           metrics: LoadMetrics) -> None:
+    """Загрузка таблицы: одно чтение SQLite и connections писателей, одновременно ждущих Postgres.
+    При ошибке писателя остальные задачи таблицы отменяются"""
+    headers = await loop.run_in_executor(
+        executor, TABLE_NAME_CLASSES[table].create_headers_list, sqlite_extractor, table)
+    transform = TABLE_NAME_CLASSES[table].create_transformer(headers)
+    cursor = await loop.run_in_executor(executor, sqlite_extractor.get_data_from, table, headers)
+    metrics.start_table(table)
+    batches = asyncio.Queue(maxsize=queue_size)
+    tasks = [asyncio.ensure_future(read_batches_async(
+        loop, executor, cursor, transform, batch_size, batches, connections, metrics, table))]
+    tasks += [asyncio.ensure_future(write_batches_async(pool, table, headers, batches, insert_method, metrics))
+              for _ in range(connections)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def load_from_sqlite_async(db_path: str,
+                                 pg_data: dict,
+                                 connections: int = ASYNC_CONNECTIONS,
+                                 batch_size: int = ASYNC_BATCH_SIZE,
+                                 queue_size: int = ASYNC_QUEUE_SIZE,
+                                 insert_method: str = 'insert',
+                                 metrics: LoadMetrics = None) -> LoadMetrics:
+    """Асинхронная загрузка из SQLite в Postgres в том же порядке таблиц, что и load_from_sqlite.
+    SQLite читается в отдельном потоке, которому принадлежит соединение;
+    в Postgres пишут connections соединений из пула asyncpg без потока на соединение"""
+    metrics = metrics or LoadMetrics()
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        sqlite_extractor = await loop.run_in_executor(executor, SQLiteExtractor, db_path)
+        try:
+            async with asyncpg.create_pool(min_size=1, max_size=connections,
+                                           **asyncpg_params(pg_data)) as pool:
+                for table in await loop.run_in_executor(executor, get_table_order, sqlite_extractor):
+                    await load_table_async(loop, executor, sqlite_extractor, pool, table, connections,
+                                           batch_size, queue_size, insert_method, metrics)
+        finally:
+            await loop.run_in_executor(executor, sqlite_extractor.close)
+    return metrics
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Асинхронный перенос данных из SQLite в Postgres')
+    parser.add_argument('--connections', type=int, default=ASYNC_CONNECTIONS,
+                        help='число соединений с Postgres, одновременно ждущих ответа')
+    parser.add_argument('--batch-size', type=int, default=ASYNC_BATCH_SIZE,
+                        help='число строк в пачке')
+    parser.add_argument('--queue-size', type=int, default=ASYNC_QUEUE_SIZE,
+                        help='число прочитанных пачек, ожидающих записи')
+    parser.add_argument('--insert-method', choices=tuple(WRITE_METHODS), default='insert',
+                        help='способ записи в Postgres')
+    parser.add_argument('--progress', action='store_true',
+                        help='выводить прогресс загрузки в терминал')
+    parser.add_argument('--metrics-file',
+                        help='файл метрик в формате Prometheus, обновляется во время загрузки')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    metrics = LoadMetrics()
+    with ExitStack() as stack:
+        with SQLiteExtractor(sqlite3_path) as sqlite_conn:
+            attach_reporters(stack, sqlite_conn, metrics,
+                             LoadOptions(progress=args.progress, metrics_file=args.metrics_file))
+        asyncio.run(load_from_sqlite_async(sqlite3_path, dsl, args.connections, args.batch_size,
+                                           args.queue_size, args.insert_method, metrics))
@@ -0,0 +1,159 @@
+from abc import ABC, abstractmethod
+
+
+def conflict_clause(headers: list, upsert: bool = False) -> str:
+    """Обработка конфликта по id: пропуск строки или обновление всех полей, кроме created_at.
+    Синтаксис общий для Postgres и SQLite"""
+    if not upsert:
+        return 'on conflict (id) do nothing'
+    columns = [i for i in headers if i not in ('id', 'created_at')]
+    return 'on conflict (id) do update set ' + ', '.join(
+        '{0} = EXCLUDED.{0}'.format(i) for i in columns)
+
+
+class BaseExtractor(ABC):
+    """Источник данных: список таблиц, колонки и чтение строк по возрастанию ключа.
+    Ключ строки идёт первой колонкой и используется для контрольных точек"""
+
+    @abstractmethod
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    @abstractmethod
+    def get_list_table(self) -> list:
+        """Список таблиц в виде кортежей (имя,)"""
+
+    @abstractmethod
+    def get_headers(self, table_name: str) -> list:
+        """Колонки таблицы в порядке объявления"""
+
+    @abstractmethod
+    def get_row_count(self, table_name: str) -> int:
+        """Число строк таблицы"""
+
+    @abstractmethod
+    def get_data_from(self, table_name: str, headers: list, last_key=0, until_key=None):
+        """Курсор со строками после ключа last_key (и не дальше until_key), ключ первой колонкой"""
+
+    def plan_rowid_ranges(self, table_name: str, parts: int) -> list:
+        """Диапазоны ключей для параллельного чтения; по умолчанию таблица читается целиком"""
+        return [None]
+
+
+class BaseSaver(ABC):
+    """Приёмник данных с фиксацией по политике commit_policy.
+    Подкласс задаёт поля commit_policy, commit_every, pending_rows, pending_bytes,
+    commit_callbacks и metrics и реализует запись пачки и работу с транзакцией"""
+    # Ошибки из-за данных отдельных строк, при которых пачка делится пополам
+    row_errors = ()
+
+    @abstractmethod
+    def write_rows(self, headers: list, data: list, table_name: str, upsert: bool = False) -> int:
+        """Запись пачки строк в текущую транзакцию; возвращает объём отправленных данных"""
+
+    @abstractmethod
+    def execute_savepoint(self, statement: str) -> None:
+        """Выполнить SAVEPOINT, RELEASE или ROLLBACK TO в текущей транзакции"""
+
+    def check_constraints(self) -> None:
+        """Проверить отложенные ограничения до выхода из точки сохранения"""
+
+    @abstractmethod
+    def commit_transaction(self) -> None:
+        pass
+
+    @abstractmethod
+    def rollback_transaction(self) -> None:
+        pass
+
+    @abstractmethod
+    def clone(self):
+        """Новое соединение с теми же настройками записи"""
+
+    @abstractmethod
+    def close_connect(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close_connect()
+
+    def save_data(self, headers: list, data: list, table_name: str, upsert: bool = False) -> None:
+        """Запись пачки строк и фиксация по политике commit_policy"""
+        self.after_write(len(data), self.write_rows(headers, data, table_name, upsert))
+
+    def save_data_isolated(self,
+                           headers: list,
+                           data: list,
+                           table_name: str,
+                           reject,
+                           upsert: bool = False) -> int:
+        """Запись пачки с отделением плохих строк: пачка с ошибкой откатывается
+        до точки сохранения и делится пополам, пока ошибка не сведётся к одной строке.
+        Такие строки передаются в reject(row, reason), остальные записываются.
+        Возвращает число записанных строк"""
+        written, size = self.write_isolated(headers, data, table_name, reject, upsert)
+        self.after_write(written, size)
+        return written
+
+    def write_isolated(self, headers: list, data: list, table_name: str, reject, upsert: bool) -> tuple:
+        self.execute_savepoint('SAVEPOINT isolate_rows')
+        try:
+            size = self.write_rows(headers, data, table_name, upsert)
+            self.check_constraints()
+        except self.row_errors as error:
+            self.execute_savepoint('ROLLBACK TO SAVEPOINT isolate_rows')
+            self.execute_savepoint('RELEASE SAVEPOINT isolate_rows')
+            if len(data) == 1:
+                reject(data[0], str(error).strip())
+                return 0, 0
+            middle = len(data) // 2
+            first = self.write_isolated(headers, data[:middle], table_name, reject, upsert)
+            second = self.write_isolated(headers, data[middle:], table_name, reject, upsert)
+            return first[0] + second[0], first[1] + second[1]
+        self.execute_savepoint('RELEASE SAVEPOINT isolate_rows')
+        return len(data), size
+
+    def commit(self) -> None:
+        """Фиксация транзакции и вызов отложенных до неё действий"""
+        self.commit_transaction()
+        self.metrics.record_commit()
+        callbacks, self.commit_callbacks = self.commit_callbacks, []
+        self.pending_rows = self.pending_bytes = 0
+        for callback in callbacks:
+            callback()
+
+    def rollback_connect(self) -> None:
+        """Откат транзакции; отложенные действия (контрольные точки) отбрасываются"""
+        self.rollback_transaction()
+        self.commit_callbacks = []
+        self.pending_rows = self.pending_bytes = 0
+
+    def on_commit(self, callback) -> None:
+        """Выполнить callback после фиксации записанных данных"""
+        if self.pending_rows:
+            self.commit_callbacks.append(callback)
+        else:
+            callback()
+
+    def after_write(self, rows: int, size: int) -> None:
+        """Учёт записанной пачки и фиксация по политике commit_policy"""
+        self.pending_rows += rows
+        self.pending_bytes += size
+        if (self.commit_policy == 'batch'
+                or self.commit_policy == 'rows' and self.pending_rows >= self.commit_every
+                or self.commit_policy == 'bytes' and self.pending_bytes >= self.commit_every):
+            self.commit()
+
+    def end_table(self) -> None:
+        """Конец таблицы: фиксация для всех политик, кроме одной транзакции на загрузку"""
+        if self.commit_policy != 'load':
+            self.commit()
@@ -0,0 +1,46 @@
+from dataclasses import dataclass
+
+from settings import ADAPTIVE_BATCH
+from settings import BATCH_MAX_SIZE
+from settings import BATCH_MEMORY_BUDGET
+from settings import BATCH_MIN_SIZE
+from settings import BATCH_TARGET_LATENCY
+from settings import COUNT_FETCHMANY
+from settings import COUNT_FETCHMANY_TABLES
+
+SAMPLE_ROWS = 20
+
+
+def estimate_row_bytes(data: list) -> int:
+    """Оценка объёма строки по выборке из пачки"""
+    sample = data[:SAMPLE_ROWS]
+    total = sum(len(value) if isinstance(value, (str, bytes)) else 8
+                for row in sample for value in row)
+    return max(total // len(sample), 1)
+
+
+@dataclass
+class BatchSizer:
+    """Размер пачки для таблицы, подстраиваемый по объёму строк и времени записи"""
+    size: int = COUNT_FETCHMANY
+    adaptive: bool = ADAPTIVE_BATCH
+    min_size: int = BATCH_MIN_SIZE
+    max_size: int = BATCH_MAX_SIZE
+    memory_budget: int = BATCH_MEMORY_BUDGET
+    target_latency: float = BATCH_TARGET_LATENCY
+
+    def update(self, rows: int, row_bytes: int, latency: float) -> None:
+        """Пересчитать размер пачки после записи rows строк по row_bytes байт за latency секунд"""
+        if not self.adaptive or not rows:
+            return
+        by_memory = self.memory_budget // row_bytes
+        by_latency = int(rows * self.target_latency / latency) if latency > 0 else self.max_size
+        target = min(by_memory, by_latency, self.max_size, self.size * 2)
+        self.size = max(target, self.min_size)
+
+
+def batch_sizer_for(table_name: str) -> BatchSizer:
+    """Размер пачки из настроек таблицы или адаптивный"""
+    if table_name in COUNT_FETCHMANY_TABLES:
+        return BatchSizer(size=COUNT_FETCHMANY_TABLES[table_name], adaptive=False)
+    return BatchSizer()
@@ -0,0 +1,44 @@
+import argparse
+import os
+import time
+
+from settings import SQLITE_CACHE_SIZE
+from settings import SQLITE_MMAP_SIZE
+from sqlite_work import SQLiteExtractor
+from synthetic import create_synthetic_db
+from table_init import TABLE_NAME_CLASSES
+
+FETCH_SIZE = 10000
+
+
+def scan(db_path: str, read_only: bool) -> int:
+    """Полное чтение загружаемых таблиц, как при переносе; возвращает число строк"""
+    rows = 0
+    with SQLiteExtractor(db_path, read_only=read_only) as extractor:
+        for table in TABLE_NAME_CLASSES:
+            cursor = extractor.get_data_from(table, extractor.get_headers(table))
+            while True:
+                data = cursor.fetchmany(FETCH_SIZE)
+                if not data:
+                    break
+                rows += len(data)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Сравнение обычного и read-only (mmap) чтения SQLite')
+    parser.add_argument('path', help='база SQLite; создаётся, если не существует')
+    parser.add_argument('--films', type=int, default=100000, help='размер синтетической базы')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    if not os.path.exists(args.path):
+        create_synthetic_db(args.path, args.films)
+    print('db size {:.1f} MB, mmap_size {} B, cache_size {} KB'.format(
+        os.path.getsize(args.path) / 2 ** 20, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE))
+    for _ in range(args.repeat):
+        for read_only in (False, True):
+            started = time.perf_counter()
+            rows = scan(args.path, read_only)
+            elapsed = time.perf_counter() - started
+            print('{:<9} {:>10} rows {:>8.3f} s {:>12.0f} rows/s'.format(
+                'read-only' if read_only else 'default', rows, elapsed, rows / elapsed))
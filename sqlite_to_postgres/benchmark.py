@@ -0,0 +1,131 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import resource
+import subprocess
+import time
+
+from load_data import LoadOptions, load_from_sqlite, open_load
+from pg_work import PostgresSaver
+from schema import is_content_empty
+from settings import COMMIT_POLICY
+from settings import INSERT_METHOD
+from settings import dsl
+from synthetic import create_synthetic_db
+from table_init import TABLE_NAME_CLASSES
+
+DEFAULT_SIZES = (10000, 1000000, 10000000)
+
+
+def prepare_target(pg_data: dict, truncate: bool) -> None:
+    """Перед замером схема content должна быть пустой"""
+    with PostgresSaver(pg_data) as postgres_saver:
+        if truncate:
+            with postgres_saver.conn_pg.cursor() as pg_cursor:
+                pg_cursor.execute("""TRUNCATE {} CASCADE""".format(
+                    ', '.join('content.{}'.format(table) for table in TABLE_NAME_CLASSES)))
+            postgres_saver.conn_pg.commit()
+        elif not is_content_empty(postgres_saver):
+            raise ValueError('Схема content не пуста: очистите её или запустите с --truncate')
+
+
+def run_load(db_path: str, pg_data: dict, options: LoadOptions) -> dict:
+    """Один прогон загрузки; выполняется в отдельном процессе, чтобы пиковая RSS
+    относилась только к нему"""
+    started = time.perf_counter()
+    with ExitStack() as stack:
+        sqlite_conn, pg_conn, sync_state, checkpoint, rejects, dead_letter = open_load(
+            stack, db_path, pg_data, options)
+        load_from_sqlite(sqlite_conn, pg_conn, sync_state, checkpoint, rejects, dead_letter,
+                         options.writers, options.queue_size, options.transform_mode)
+        metrics = pg_conn.metrics.as_dict()
+    return {
+        'seconds': time.perf_counter() - started,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'metrics': metrics,
+    }
+
+
+def benchmark_size(films: int, workdir: str, pg_data: dict, options: LoadOptions, truncate: bool) -> dict:
+    db_path = os.path.join(workdir, 'synthetic_{}.db'.format(films))
+    if not os.path.exists(db_path):
+        create_synthetic_db(db_path, films)
+    prepare_target(pg_data, truncate)
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        result = executor.submit(run_load, db_path, pg_data, options).result()
+    totals = result['metrics']['totals']
+    return {
+        'films': films,
+        'rows': totals['rows_written'],
+        'seconds': result['seconds'],
+        'rows_per_sec': totals['rows_written'] / result['seconds'],
+        'peak_rss_kb': result['peak_rss_kb'],
+        'round_trips': result['metrics']['round_trips'],
+        'bytes_sent': totals['bytes_sent'],
+        'stages': {
+            'read': totals['read_time'],
+            'transform': totals['transform_time'],
+            'write': totals['write_time'],
+        },
+        'tables': result['metrics']['tables'],
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Замеры загрузки SQLite -> Postgres на синтетических данных')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='число фильмов в синтетических базах')
+    parser.add_argument('--workdir', default='.', help='каталог для синтетических баз')
+    parser.add_argument('--output', default='benchmark.json', help='файл с результатами')
+    parser.add_argument('--truncate', action='store_true',
+                        help='очищать таблицы схемы content перед каждым прогоном')
+    parser.add_argument('--insert-method', choices=('insert', 'copy', 'copy_binary'), default=INSERT_METHOD)
+    parser.add_argument('--coerce', action='store_true', help='приводить значения к типам колонок Postgres')
+    parser.add_argument('--commit-policy', choices=('batch', 'rows', 'bytes', 'table', 'load'),
+                        default=COMMIT_POLICY)
+    parser.add_argument('--pipeline', action='store_true')
+    parser.add_argument('--writers', type=int, default=1)
+    parser.add_argument('--read-only', action='store_true')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    options = LoadOptions(
+        writers=args.writers if args.pipeline else 0,
+        read_only=args.read_only,
+        coerce=args.coerce,
+        saver_options={'insert_method': args.insert_method, 'commit_policy': args.commit_policy},
+    )
+    report = {
+        'revision': git_revision(),
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'options': {
+            'insert_method': args.insert_method,
+            'commit_policy': args.commit_policy,
+            'writers': options.writers,
+            'read_only': args.read_only,
+            'coerce': args.coerce,
+        },
+        'results': [],
+    }
+    for films in args.sizes:
+        result = benchmark_size(films, args.workdir, dsl, options, args.truncate)
+        report['results'].append(result)
+        print('{films:>10} films {rows:>10} rows {seconds:>9.1f} s {rows_per_sec:>9.0f} rows/s '
+              'rss {peak_rss_kb} KB round trips {round_trips}'.format(**result))
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
@@ -0,0 +1,63 @@
+from dataclasses import dataclass
+import sqlite3
+
+
+@dataclass
+class Checkpoint:
+    """Контрольные точки загрузки: последний записанный ключ и число строк по таблицам"""
+    path: str
+    conn: sqlite3.Connection = None
+
+    def __post_init__(self) -> None:
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS checkpoint (
+                table_name TEXT PRIMARY KEY,
+                last_key INTEGER NOT NULL,
+                row_count INTEGER NOT NULL,
+                done INTEGER NOT NULL DEFAULT 0
+            );
+            """)
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def get(self, table_name: str) -> tuple:
+        """Последний ключ, число строк и признак завершения таблицы"""
+        row = self.conn.execute(
+            """SELECT last_key, row_count, done FROM checkpoint WHERE table_name = ?""",
+            (table_name,),
+        ).fetchone()
+        if row is None:
+            return 0, 0, False
+        return row[0], row[1], bool(row[2])
+
+    def save(self, table_name: str, last_key: int, row_count: int) -> None:
+        """Сохранить контрольную точку после записанной пачки"""
+        self.conn.execute(
+            """INSERT OR REPLACE INTO checkpoint (table_name, last_key, row_count, done)
+               VALUES (?, ?, ?, 0)""",
+            (table_name, last_key, row_count),
+        )
+        self.conn.commit()
+
+    def finish(self, table_name: str) -> None:
+        """Отметить таблицу как полностью загруженную"""
+        self.conn.execute(
+            """INSERT INTO checkpoint (table_name, last_key, row_count, done) VALUES (?, 0, 0, 1)
+               ON CONFLICT (table_name) DO UPDATE SET done = 1""",
+            (table_name,),
+        )
+        self.conn.commit()
+
+    def reset(self) -> None:
+        """Сбросить все контрольные точки перед новой загрузкой"""
+        self.conn.execute("""DELETE FROM checkpoint""")
+        self.conn.commit()
@@ -0,0 +1,102 @@
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+import uuid
+
+from settings import FILM_TYPES
+from settings import ROLE_TYPES
+
+COERCE_ERRORS = (ValueError, TypeError, KeyError, AttributeError)
+
+
+def to_uuid(value) -> uuid.UUID:
+    if isinstance(value, uuid.UUID):
+        return value
+    return uuid.UUID(value)
+
+
+def to_date(value) -> date:
+    if value is None or isinstance(value, date):
+        return value
+    return date.fromisoformat(value)
+
+
+def to_datetime(value) -> datetime:
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def to_float(value) -> float:
+    if value is None:
+        return None
+    return float(value)
+
+
+def to_choice(choices: dict):
+    """Приведение к варианту перечисления: значение исходной базы или уже готовый вариант"""
+    allowed = set(choices.values())
+
+    def convert(value) -> str:
+        if value in allowed:
+            return value
+        if value not in choices:
+            raise ValueError('недопустимое значение {!r}'.format(value))
+        return choices[value]
+    return convert
+
+
+COLUMN_COERCERS = {
+    'id': to_uuid,
+    'film_work_id': to_uuid,
+    'genre_id': to_uuid,
+    'person_id': to_uuid,
+    'creation_date': to_date,
+    'rating': to_float,
+    'type': to_choice(FILM_TYPES),
+    'role': to_choice(ROLE_TYPES),
+    'created_at': to_datetime,
+    'updated_at': to_datetime,
+}
+
+
+@dataclass
+class BatchCoercer:
+    """Приведение пачки строк к типам колонок Postgres по колонкам целиком.
+    Колонка без ошибок преобразуется одним проходом map, при ошибке значения
+    проверяются по одному, а строки с ошибками отделяются от пачки"""
+    headers: list
+    converters: list
+
+    @classmethod
+    def for_headers(cls, headers: list):
+        return cls(headers, [(n, COLUMN_COERCERS[colm]) for n, colm in enumerate(headers)
+                             if colm in COLUMN_COERCERS])
+
+    def __call__(self, data: list) -> tuple:
+        """Возвращает приведённые строки и отклонённые в виде (позиция в пачке, строка, причина)"""
+        columns = [list(column) for column in zip(*data)]
+        errors = {}
+        for n, convert in self.converters:
+            try:
+                columns[n] = list(map(convert, columns[n]))
+            except COERCE_ERRORS:
+                columns[n] = self.convert_each(n, convert, columns[n], errors)
+        rows = list(zip(*columns))
+        if not errors:
+            return rows, []
+        rejected = [(position, data[position], reason) for position, reason in sorted(errors.items())]
+        return [row for position, row in enumerate(rows) if position not in errors], rejected
+
+    def convert_each(self, n: int, convert, column: list, errors: dict) -> list:
+        converted = []
+        for position, value in enumerate(column):
+            try:
+                converted.append(convert(value))
+            except COERCE_ERRORS as error:
+                errors.setdefault(position, '{}: {}'.format(self.headers[n], error))
+                converted.append(None)
+        return converted
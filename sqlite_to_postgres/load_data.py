@@ -1,15 +1,55 @@
-from sqlite_work import SQLiteExtractor
-from pg_work import PostgresSaver
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from functools import partial
+import time
+
+from psycopg2.extensions import parse_dsn
+
+from base import BaseExtractor, BaseSaver
+from sqlite_work import SQLiteExtractor, SQLiteSaver, find_shards
+from pg_work import PostgresExtractor, PostgresSaver, copy_table
+from checkpoint import Checkpoint
+from coercion import BatchCoercer
+from metrics import JsonLinesWriter, LoadMetrics, ProgressPrinter, PrometheusFileWriter
+from batching import batch_sizer_for
+from pool import sized_pool
+from pipeline import Batch, read_batches, run_pipelined, write_batch
 from settings import MANY_TO_MANY_TABLES
-from settings import COUNT_FETCHMANY
+from settings import COMMIT_EVERY
+from settings import COMMIT_POLICY
+from settings import INSERT_METHOD
+from settings import LOAD_WORKERS
+from settings import METRICS_INTERVAL
+from settings import READ_CHUNKS
+from settings import SYNCHRONOUS_COMMIT
+from settings import TRANSFORM_MODE
+from settings import PIPELINE_QUEUE_SIZE
+from settings import PIPELINE_WRITERS
 from settings import dsl
 from settings import sqlite3_path
+from settings import SQLITE_READ_ONLY
+from settings import SYNC_STATE_PATH
+from settings import CHECKPOINT_PATH
+from settings import DEFERRED_SCHEMA_PATH
+from settings import INDEX_WORKERS
+from settings import COERCE_TYPES
+from settings import REJECTS_PATH
+from settings import DEAD_LETTER_PATH
+from settings import PG_POOL_SIZE
+from schema import drop_secondary_schema, restore_secondary_schema
+from schema import rebuild_film_documents, set_document_triggers
+from rejects import RejectWriter
+from sync_state import SyncState
+from verify import verify_shards
 from table_init import TABLE_NAME_CLASSES
 
 
-def load_from_sqlite(sqlite_extractor, postgres_saver):
-    """Основной метод загрузки данных из SQLite в Postgres"""
-    list_table = sqlite_extractor.get_list_table()
+def get_table_order(extractor: BaseExtractor) -> list:
+    """Порядок загрузки таблиц: связующие таблицы в конце"""
+    list_table = extractor.get_list_table()
     last_table = []
     for table in list_table:
         table = table[0]
@@ -18,19 +58,470 @@ def load_from_sqlite(sqlite_extractor, postgres_saver):
                 last_table.append(table)
             else:
                 last_table.insert(0, table)
+    return last_table
 
-    for table in last_table:
-        headers = TABLE_NAME_CLASSES[table].create_headers_list(sqlite_extractor, table)
-        cursor = sqlite_extractor.get_all_data(table, headers)
-        while True:
-            data = cursor.fetchmany(COUNT_FETCHMANY)
-            if data:
-                data = TABLE_NAME_CLASSES[table].create_data_for_insert(headers, data)
-                postgres_saver.insert_data(headers=headers, data=data, table_name=table)
-            else:
-                break
+
+def get_load_stages(tables: list) -> list:
+    """Этапы параллельной загрузки: сначала независимые таблицы, затем связующие"""
+    stages = [
+        [table for table in tables if table not in MANY_TO_MANY_TABLES],
+        [table for table in tables if table in MANY_TO_MANY_TABLES],
+    ]
+    return [stage for stage in stages if stage]
+
+
+def load_table(sqlite_extractor,
+               postgres_saver,
+               table: str,
+               sync_state: SyncState = None,
+               checkpoint: Checkpoint = None,
+               writers: int = 0,
+               queue_size: int = PIPELINE_QUEUE_SIZE,
+               rowid_range: tuple = None,
+               transform_mode: str = TRANSFORM_MODE,
+               rejects: RejectWriter = None,
+               dead_letter: RejectWriter = None,
+               checkpoint_prefix: str = '') -> None:
+    """Загрузка одной таблицы (или диапазона rowid_range её строк) из источника в приёмник.
+    При переданном sync_state переносятся только новые и изменённые строки,
+    при переданном checkpoint загрузка продолжается с последней записанной пачки,
+    при переданном rejects значения приводятся к типам колонок Postgres,
+    а строки, которые привести не удалось, пишутся в rejects вместо записи,
+    при переданном dead_letter строки, нарушающие ограничения, отделяются от пачки и пишутся в dead_letter,
+    при writers > 0 чтение и запись идут внахлёст через очередь из queue_size пачек.
+    Контрольные точки и контрольные суммы сохраняются только после фиксации транзакции,
+    checkpoint_prefix отделяет контрольные точки разных источников (шардов)"""
+    low_rowid, until_rowid = rowid_range or (0, None)
+    checkpoint_key = checkpoint_prefix + (table if rowid_range is None else '{}:{}-{}'.format(table, *rowid_range))
+    last_rowid, row_count, done = checkpoint.get(checkpoint_key) if checkpoint else (low_rowid, 0, False)
+    if done:
+        return
+    if rowid_range is not None:
+        last_rowid = max(last_rowid, low_rowid)
+    headers = TABLE_NAME_CLASSES[table].create_headers_list(sqlite_extractor, table)
+    transform = TABLE_NAME_CLASSES[table].create_transformer(headers, transform_mode)
+    coerce = BatchCoercer.for_headers(headers) if rejects is not None else None
+    batch_sizer = batch_sizer_for(table)
+    upsert = sync_state is not None
+    metrics = postgres_saver.metrics
+    metrics.start_table(table)
+
+    def prepare(batch: Batch) -> Batch:
+        started = time.perf_counter()
+        if sync_state is not None:
+            batch.data, batch.checksums = sync_state.filter_changed(table, headers, batch.data)
+        if batch.data:
+            batch.data = transform(batch.data)
+        if coerce is not None and batch.data:
+            batch.data, rejected = coerce(batch.data)
+            if rejected:
+                reject_rows(batch, rejected)
+        metrics.record(table, rows_transformed=len(batch.data), transform_time=time.perf_counter() - started)
+        return batch
+
+    def reject_rows(batch: Batch, rejected: list) -> None:
+        positions = {position for position, _, _ in rejected}
+        if batch.checksums:
+            batch.checksums = [item for n, item in enumerate(batch.checksums) if n not in positions]
+        for _, row, reason in rejected:
+            rejects.write(table, headers, row, reason)
+        metrics.record(table, rows_rejected=len(rejected))
+
+    def complete(batch: Batch) -> None:
+        if batch.checksums:
+            sync_state.save(batch.checksums)
+        if checkpoint:
+            checkpoint.save(checkpoint_key, batch.last_key, batch.row_count)
+
+    def complete_pipelined(batch: Batch) -> None:
+        batch_sizer.update(batch.written, batch.row_bytes, batch.latency)
+        complete(batch)
+
+    cursor = sqlite_extractor.get_data_from(table, headers, last_rowid, until_rowid)
+    batches = map(prepare, read_batches(cursor, batch_sizer, row_count, metrics, table))
+    if writers > 0:
+        run_pipelined(batches, postgres_saver, headers, table, complete_pipelined,
+                      upsert=upsert, writers=writers, queue_size=queue_size, dead_letter=dead_letter)
+    else:
+        try:
+            for batch in batches:
+                write_batch(postgres_saver, headers, table, batch, upsert, dead_letter)
+                batch_sizer.update(batch.written, batch.row_bytes, batch.latency)
+                postgres_saver.on_commit(partial(complete, batch))
+            postgres_saver.end_table()
+        except Exception:
+            postgres_saver.rollback_connect()
+            raise
+    if checkpoint:
+        postgres_saver.on_commit(partial(checkpoint.finish, checkpoint_key))
+
+
+def load_from_sqlite(sqlite_extractor,
+                     postgres_saver,
+                     sync_state: SyncState = None,
+                     checkpoint: Checkpoint = None,
+                     rejects: RejectWriter = None,
+                     dead_letter: RejectWriter = None,
+                     writers: int = 0,
+                     queue_size: int = PIPELINE_QUEUE_SIZE,
+                     transform_mode: str = TRANSFORM_MODE):
+    """Основной метод загрузки данных из SQLite в Postgres (или из любого источника в любой приёмник)"""
+    for table in get_table_order(sqlite_extractor):
+        load_table(sqlite_extractor, postgres_saver, table, sync_state, checkpoint, writers, queue_size,
+                   transform_mode=transform_mode, rejects=rejects, dead_letter=dead_letter)
+    postgres_saver.commit()
+
+
+@dataclass
+class LoadOptions:
+    """Настройки загрузки, передаваемые в процессы параллельной загрузки"""
+    state_path: str = None
+    checkpoint_path: str = None
+    writers: int = 0
+    queue_size: int = PIPELINE_QUEUE_SIZE
+    saver_options: dict = field(default_factory=dict)
+    read_only: bool = SQLITE_READ_ONLY
+    progress: bool = False
+    metrics_file: str = None
+    metrics_jsonl: str = None
+    source_kind: str = 'sqlite'
+    target_kind: str = 'postgres'
+    transform_mode: str = TRANSFORM_MODE
+    coerce: bool = COERCE_TYPES
+    rejects_path: str = REJECTS_PATH
+    dead_letter_path: str = DEAD_LETTER_PATH
+    pool_size: int = PG_POOL_SIZE
+
+
+def create_extractor(source, options: LoadOptions) -> BaseExtractor:
+    """Источник: путь к файлу SQLite или параметры подключения к Postgres"""
+    if options.source_kind == 'postgres':
+        return PostgresExtractor(source)
+    return SQLiteExtractor(source, read_only=options.read_only)
+
+
+def create_saver(target, options: LoadOptions) -> BaseSaver:
+    """Приёмник: параметры подключения к Postgres или путь к файлу SQLite"""
+    if options.target_kind == 'sqlite':
+        return SQLiteSaver(target,
+                           commit_policy=options.saver_options.get('commit_policy', COMMIT_POLICY),
+                           commit_every=options.saver_options.get('commit_every', COMMIT_EVERY))
+    return PostgresSaver(target, pool=pool_for(target, options), **options.saver_options)
+
+
+def pool_for(pg_data: dict, options: LoadOptions):
+    """Общий пул процесса; соединений в нём не меньше, чем писателей конвейера"""
+    return sized_pool(pg_data, options.writers, options.pool_size)
+
+
+def copy_direct(source: dict, target: dict, options: LoadOptions) -> None:
+    """Прямое копирование таблиц между базами Postgres через COPY в бинарном формате,
+    без разбора строк, контрольных точек и инкрементальной синхронизации"""
+    with PostgresExtractor(source) as extractor, PostgresSaver(
+            target, pool=pool_for(target, options), **options.saver_options) as saver:
+        for table in get_table_order(extractor):
+            headers = TABLE_NAME_CLASSES[table].create_headers_list(extractor, table)
+            saver.metrics.start_table(table)
+            rows = copy_table(extractor, saver, headers, table, upsert=options.state_path is not None)
+            saver.metrics.record(table, rows_read=rows, rows_written=rows)
+            saver.end_table()
+        saver.commit()
+
+
+def open_load(stack: ExitStack,
+              source,
+              target,
+              options: LoadOptions,
+              in_worker: bool = False) -> tuple:
+    """Открыть соединения и файлы состояния загрузки в рамках stack"""
+    pg_conn = stack.enter_context(create_saver(target, options))
+    sqlite_conn = stack.enter_context(create_extractor(source, options))
+    sync_state = stack.enter_context(SyncState(options.state_path)) if options.state_path else None
+    checkpoint = stack.enter_context(Checkpoint(options.checkpoint_path)) if options.checkpoint_path else None
+    rejects = stack.enter_context(RejectWriter(options.rejects_path)) if options.coerce else None
+    dead_letter = stack.enter_context(RejectWriter(options.dead_letter_path)) if options.dead_letter_path else None
+    attach_reporters(stack, sqlite_conn, pg_conn.metrics, options, in_worker)
+    return sqlite_conn, pg_conn, sync_state, checkpoint, rejects, dead_letter
+
+
+def attach_reporters(stack: ExitStack,
+                     sqlite_extractor: BaseExtractor,
+                     metrics: LoadMetrics,
+                     options: LoadOptions,
+                     in_worker: bool = False) -> None:
+    """Подключить вывод прогресса и файлы метрик к счётчикам загрузки.
+    В процессах параллельной загрузки прогресс не выводится,
+    а файл Prometheus пишется отдельно для каждого процесса"""
+    if options.metrics_jsonl:
+        writer = JsonLinesWriter(options.metrics_jsonl)
+        metrics.add_listener(writer)
+        stack.callback(writer.close)
+    if options.metrics_file:
+        path = '{}.{}'.format(options.metrics_file, os.getpid()) if in_worker else options.metrics_file
+        reporter = PrometheusFileWriter(interval=METRICS_INTERVAL, path=path)
+        reporter.start(metrics)
+        stack.callback(reporter.stop)
+    if options.progress and not in_worker:
+        expected = {table: sqlite_extractor.get_row_count(table)
+                    for table in get_table_order(sqlite_extractor)}
+        reporter = ProgressPrinter(interval=METRICS_INTERVAL, expected_rows=expected)
+        reporter.start(metrics)
+        stack.callback(reporter.stop)
+
+
+def load_table_worker(source,
+                      target,
+                      table: str,
+                      options: LoadOptions,
+                      rowid_range: tuple = None,
+                      checkpoint_prefix: str = '') -> dict:
+    """Загрузка таблицы или диапазона её строк в отдельном процессе со своими соединениями.
+    Возвращает счётчики загрузки процесса"""
+    with ExitStack() as stack:
+        sqlite_conn, pg_conn, sync_state, checkpoint, rejects, dead_letter = open_load(
+            stack, source, target, options, in_worker=True)
+        load_table(sqlite_conn, pg_conn, table, sync_state, checkpoint,
+                   options.writers, options.queue_size, rowid_range, options.transform_mode, rejects, dead_letter,
+                   checkpoint_prefix)
+        pg_conn.commit()
+        return pg_conn.metrics.as_dict()
+
+
+def load_parallel(source,
+                  target,
+                  workers: int = LOAD_WORKERS,
+                  options: LoadOptions = None,
+                  chunks: int = READ_CHUNKS) -> None:
+    """Параллельная загрузка: таблицы одного этапа грузятся одновременно,
+    следующий этап начинается после завершения предыдущего.
+    Каждая таблица делится на chunks диапазонов rowid, которые читаются независимо"""
+    options = options or LoadOptions()
+    with create_extractor(source, options) as sqlite_conn:
+        tables = get_table_order(sqlite_conn)
+        ranges = {table: sqlite_conn.plan_rowid_ranges(table, chunks) for table in tables}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for stage in get_load_stages(tables):
+            futures = [executor.submit(load_table_worker, source, target, table, options, rowid_range)
+                       for table in stage for rowid_range in ranges[table]]
+            for future in futures:
+                future.result()
+
+
+def load_shards(shards: list,
+                target,
+                workers: int = LOAD_WORKERS,
+                options: LoadOptions = None,
+                chunks: int = READ_CHUNKS) -> LoadMetrics:
+    """Параллельная загрузка нескольких файлов SQLite (шардов) в одну базу.
+    Задачи (шард, таблица, диапазон rowid) всех шардов делятся на этапы как в load_parallel:
+    связующие таблицы грузятся после независимых таблиц всех шардов.
+    Строки с одинаковым id из разных шардов записываются один раз (on conflict (id)).
+    Возвращает сводные счётчики всех процессов"""
+    options = options or LoadOptions()
+    plan = {}
+    for shard in shards:
+        with create_extractor(shard, options) as sqlite_conn:
+            plan[shard] = {table: sqlite_conn.plan_rowid_ranges(table, chunks)
+                           for table in get_table_order(sqlite_conn)}
+    tables = [table for table in TABLE_NAME_CLASSES if any(table in ranges for ranges in plan.values())]
+    metrics = LoadMetrics()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for stage in get_load_stages(tables):
+            futures = {
+                executor.submit(load_table_worker, shard, target, table, options, rowid_range,
+                                '{}:'.format(os.path.abspath(shard))): (shard, table)
+                for shard, ranges in plan.items() for table in stage if table in ranges
+                for rowid_range in ranges[table]
+            }
+            for future in as_completed(futures):
+                for table, values in future.result()['tables'].items():
+                    metrics.record(table, **values)
+                if options.progress:
+                    shard, table = futures[future]
+                    print('{} {}: всего записано {} строк'.format(
+                        os.path.basename(shard), table, metrics.totals().rows_written))
+    return metrics
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Перенос данных из SQLite в Postgres')
+    parser.add_argument('--source', choices=('sqlite', 'postgres'), default='sqlite',
+                        help='источник: файл SQLite из SQLITE_PATH или база Postgres из --source-dsn')
+    parser.add_argument('--source-dsn',
+                        help='строка подключения к Postgres-источнику, например "dbname=movies host=db"')
+    parser.add_argument('--target', choices=('postgres', 'sqlite'), default='postgres',
+                        help='приёмник: база Postgres из настроек DB_* или файл SQLite из --target-path')
+    parser.add_argument('--target-path',
+                        help='файл SQLite для выгрузки при --target sqlite')
+    parser.add_argument('--shards',
+                        help='шаблон glob или каталог с файлами SQLite; шарды грузятся параллельно '
+                             'в --workers процессов, после загрузки выводится сводная сверка')
+    parser.add_argument('--copy-direct', action='store_true',
+                        help='Postgres -> Postgres: копировать таблицы целиком через COPY в бинарном формате')
+    parser.add_argument('--transform', choices=('fast', 'dataclass', 'none'),
+                        help='преобразование строк; по умолчанию none для Postgres-источника, '
+                             'иначе TRANSFORM_MODE')
+    parser.add_argument('--workers', type=int, default=LOAD_WORKERS,
+                        help='число параллельных процессов загрузки')
+    parser.add_argument('--chunks', type=int, default=READ_CHUNKS,
+                        help='на сколько диапазонов rowid делить каждую таблицу при --workers > 1')
+    parser.add_argument('--read-only', action='store_true', default=SQLITE_READ_ONLY,
+                        help='читать SQLite как неизменяемый файл через mmap')
+    parser.add_argument('--progress', action='store_true',
+                        help='выводить прогресс загрузки в терминал')
+    parser.add_argument('--metrics-file',
+                        help='файл метрик в формате Prometheus, обновляется во время загрузки')
+    parser.add_argument('--metrics-jsonl',
+                        help='журнал событий загрузки в формате JSON lines')
+    parser.add_argument('--incremental', action='store_true',
+                        help='переносить только новые и изменённые строки')
+    parser.add_argument('--state', default=SYNC_STATE_PATH,
+                        help='файл состояния инкрементальной синхронизации')
+    parser.add_argument('--checkpoint', default=CHECKPOINT_PATH,
+                        help='файл контрольных точек загрузки')
+    parser.add_argument('--resume', action='store_true',
+                        help='продолжить загрузку с последней контрольной точки')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='читать из SQLite и писать в Postgres внахлёст')
+    parser.add_argument('--writers', type=int, default=PIPELINE_WRITERS,
+                        help='число потоков записи в режиме --pipeline')
+    parser.add_argument('--queue-size', type=int, default=PIPELINE_QUEUE_SIZE,
+                        help='число пачек в очереди между чтением и записью')
+    parser.add_argument('--pool-size', type=int, default=PG_POOL_SIZE,
+                        help='соединений в пуле Postgres на процесс; 0 - без пула')
+    parser.add_argument('--insert-method', choices=('insert', 'copy', 'copy_binary'), default=INSERT_METHOD,
+                        help='способ записи в Postgres; copy_binary только вместе с --coerce')
+    parser.add_argument('--coerce', action='store_true', default=COERCE_TYPES,
+                        help='приводить значения к типам колонок Postgres перед записью')
+    parser.add_argument('--rejects', default=REJECTS_PATH,
+                        help='файл строк, которые не удалось привести к типам колонок (при --coerce)')
+    parser.add_argument('--dead-letter', default=DEAD_LETTER_PATH,
+                        help='файл строк, нарушающих ограничения Postgres; без него такая строка '
+                             'останавливает загрузку')
+    parser.add_argument('--commit-policy', choices=('batch', 'rows', 'bytes', 'table', 'load'),
+                        default=COMMIT_POLICY, help='когда фиксировать транзакцию')
+    parser.add_argument('--commit-every', type=int, default=COMMIT_EVERY,
+                        help='число строк или байт между фиксациями для политик rows и bytes')
+    parser.add_argument('--async-commit', action='store_true', default=not SYNCHRONOUS_COMMIT,
+                        help='synchronous_commit = off для сессии загрузчика')
+    parser.add_argument('--defer-indexes', action='store_true',
+                        help='первичная загрузка в пустую схему: удалить вторичные индексы и внешние ключи '
+                             'на время загрузки и восстановить после')
+    parser.add_argument('--restore-indexes', action='store_true',
+                        help='только восстановить индексы и ключи после прерванной загрузки с --defer-indexes')
+    parser.add_argument('--index-workers', type=int, default=INDEX_WORKERS,
+                        help='число параллельных построений индексов')
+    parser.add_argument('--schema-backup', default=DEFERRED_SCHEMA_PATH,
+                        help='файл с описанием удалённых индексов и ключей')
+    parser.add_argument('--keep-document-triggers', action='store_true',
+                        help='не отключать триггеры content.film_work_document на время загрузки '
+                             '(по умолчанию они отключаются, а документы пересобираются после загрузки; '
+                             'при --incremental триггеры не отключаются)')
+    args = parser.parse_args()
+    if args.source == 'postgres' and not args.source_dsn:
+        parser.error('для --source postgres нужен --source-dsn')
+    if args.target == 'sqlite' and not args.target_path:
+        parser.error('для --target sqlite нужен --target-path')
+    if args.target == 'sqlite' and (args.pipeline and args.writers > 1 or args.workers > 1):
+        # В SQLite пишет одно соединение за раз: остальные ждут блокировку и падают по таймауту
+        parser.error('--target sqlite поддерживает только одного писателя: --writers 1 и --workers 1')
+    if args.shards and (args.source, args.target) != ('sqlite', 'postgres'):
+        parser.error('--shards работает только для --source sqlite и --target postgres')
+    if args.copy_direct and (args.source, args.target) != ('postgres', 'postgres'):
+        parser.error('--copy-direct работает только для --source postgres и --target postgres')
+    if args.insert_method == 'copy_binary' and not args.coerce:
+        parser.error('--insert-method copy_binary требует --coerce')
+    return args
+
+
+def options_from_args(args: argparse.Namespace) -> LoadOptions:
+    return LoadOptions(
+        state_path=args.state if args.incremental else None,
+        checkpoint_path=args.checkpoint,
+        writers=args.writers if args.pipeline else 0,
+        queue_size=args.queue_size,
+        read_only=args.read_only,
+        progress=args.progress,
+        metrics_file=args.metrics_file,
+        metrics_jsonl=args.metrics_jsonl,
+        coerce=args.coerce,
+        rejects_path=args.rejects,
+        dead_letter_path=args.dead_letter,
+        pool_size=args.pool_size,
+        source_kind=args.source,
+        target_kind=args.target,
+        transform_mode=args.transform or ('none' if args.source == 'postgres' else TRANSFORM_MODE),
+        saver_options={
+            'insert_method': args.insert_method,
+            'commit_policy': args.commit_policy,
+            'commit_every': args.commit_every,
+            'synchronous_commit': not args.async_commit,
+        },
+    )
+
+
+def run_load(args: argparse.Namespace) -> None:
+    options = options_from_args(args)
+    source = parse_dsn(args.source_dsn) if args.source == 'postgres' else sqlite3_path
+    target = args.target_path if args.target == 'sqlite' else dsl
+    if args.copy_direct:
+        copy_direct(source, target, options)
+        return
+    if not args.resume:
+        with Checkpoint(options.checkpoint_path) as checkpoint:
+            checkpoint.reset()
+    if args.shards:
+        load_shards_report(args, target, options)
+    elif args.workers > 1:
+        load_parallel(source, target, args.workers, options, args.chunks)
+    else:
+        with ExitStack() as stack:
+            load_from_sqlite(*open_load(stack, source, target, options),
+                             writers=options.writers, queue_size=options.queue_size,
+                             transform_mode=options.transform_mode)
+
+
+def load_shards_report(args: argparse.Namespace, target: dict, options: LoadOptions) -> None:
+    """Загрузка шардов со сводными счётчиками и сверкой id всех шардов с Postgres"""
+    shards = find_shards(args.shards)
+    if not shards:
+        raise ValueError('Не найдено файлов SQLite: {}'.format(args.shards))
+    metrics = load_shards(shards, target, max(args.workers, 1), options, args.chunks)
+    print('Шардов: {}'.format(len(shards)))
+    for table, values in metrics.as_dict()['tables'].items():
+        print('{}: прочитано {rows_read} записано {rows_written} отклонено {rows_rejected} '
+              'в dead letter {rows_dead_letter}'.format(table, **values))
+    with PostgresSaver(target, pool=pool_for(target, options)) as pg_conn:
+        reports = verify_shards(shards, pg_conn, options.read_only)
+    for report in reports:
+        print(report)
+        for item in report.missing[:10]:
+            print('    missing {}'.format(item))
+    if not all(report.ok for report in reports):
+        raise ValueError('Не все строки шардов есть в Postgres')
 
 
 if __name__ == '__main__':
-    with PostgresSaver(dsl) as pg_conn, SQLiteExtractor(sqlite3_path) as sqlite_conn:
-        load_from_sqlite(sqlite_conn, pg_conn)
+    args = parse_args()
+    if args.target != 'postgres':
+        run_load(args)
+    elif args.restore_indexes:
+        restore_secondary_schema(dsl, args.schema_backup, args.index_workers)
+    else:
+        if args.defer_indexes and not args.resume:
+            with PostgresSaver(dsl, pool=pool_for(dsl, options_from_args(args))) as pg_conn:
+                drop_secondary_schema(pg_conn, args.schema_backup)
+        # Триггеры документов срабатывают на каждую пачку; при полной загрузке документы собираются
+        # один раз после неё. Инкрементальная загрузка пишет только изменённые строки, и триггеры
+        # обновляют документы лишь затронутых кинопроизведений вместо пересборки всего каталога
+        keep_triggers = args.keep_document_triggers or args.incremental
+        triggers = [] if keep_triggers else set_document_triggers(dsl, enabled=False)
+        try:
+            run_load(args)
+        finally:
+            if triggers:
+                set_document_triggers(dsl, enabled=True)
+        if args.defer_indexes:
+            restore_secondary_schema(dsl, args.schema_backup, args.index_workers)
+        if triggers:
+            print('Пересобрано документов: {}'.format(rebuild_film_documents(dsl)))
@@ -0,0 +1,198 @@
+from abc import ABC, abstractmethod
+from dataclasses import asdict, dataclass, field, fields
+import json
+import os
+import sys
+import threading
+import time
+
+
+@dataclass
+class TableMetrics:
+    rows_read: int = 0
+    rows_transformed: int = 0
+    rows_written: int = 0
+    rows_rejected: int = 0
+    rows_dead_letter: int = 0
+    bytes_sent: int = 0
+    batches: int = 0
+    round_trips: int = 0
+    read_time: float = 0.0
+    transform_time: float = 0.0
+    write_time: float = 0.0
+
+
+@dataclass
+class LoadMetrics:
+    """Счётчики загрузки по таблицам: строки и время чтения, преобразования и записи,
+    объём отправленных данных и число обращений к Postgres"""
+    tables: dict = field(default_factory=dict)
+    commits: int = 0
+    current_table: str = None
+    started_at: float = field(default_factory=time.time)
+    last_write_at: float = None
+    listeners: list = field(default_factory=list, repr=False)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add_listener(self, listener) -> None:
+        """listener(metrics, table_name, values) вызывается после каждого учёта"""
+        self.listeners.append(listener)
+
+    def start_table(self, table_name: str) -> None:
+        with self.lock:
+            self.current_table = table_name
+            self.tables.setdefault(table_name, TableMetrics())
+        for listener in self.listeners:
+            listener(self, table_name, {})
+
+    def record(self, table_name: str, **values) -> None:
+        with self.lock:
+            table = self.tables.setdefault(table_name, TableMetrics())
+            for name, value in values.items():
+                setattr(table, name, getattr(table, name) + value)
+            if values.get('rows_written'):
+                self.last_write_at = time.time()
+        for listener in self.listeners:
+            listener(self, table_name, values)
+
+    def record_commit(self) -> None:
+        with self.lock:
+            self.commits += 1
+
+    def totals(self) -> TableMetrics:
+        with self.lock:
+            return TableMetrics(**{
+                item.name: sum(getattr(table, item.name) for table in self.tables.values())
+                for item in fields(TableMetrics)
+            })
+
+    @property
+    def round_trips(self) -> int:
+        return self.totals().round_trips + self.commits
+
+    def as_dict(self) -> dict:
+        totals = self.totals()
+        with self.lock:
+            tables = {name: asdict(table) for name, table in self.tables.items()}
+        return {
+            'tables': tables,
+            'totals': asdict(totals),
+            'commits': self.commits,
+            'round_trips': totals.round_trips + self.commits,
+        }
+
+
+@dataclass
+class PeriodicReporter(ABC):
+    """Вывод состояния загрузки раз в interval секунд в отдельном потоке,
+    чтобы остановка записи была видна и без новых событий"""
+    interval: float = 1.0
+    metrics: LoadMetrics = None
+    stopped: threading.Event = field(default_factory=threading.Event, repr=False)
+    thread: threading.Thread = None
+
+    def start(self, metrics: LoadMetrics) -> None:
+        self.metrics = metrics
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.report()
+
+    @abstractmethod
+    def report(self) -> None:
+        """Вывести текущее состояние метрик"""
+
+
+@dataclass
+class ProgressPrinter(PeriodicReporter):
+    """Строка прогресса в терминале: текущая таблица, записанные строки,
+    скорость, оценка оставшегося времени и время без записи"""
+    expected_rows: dict = field(default_factory=dict)
+    stream: object = sys.stderr
+
+    def report(self) -> None:
+        metrics = self.metrics
+        totals = metrics.totals()
+        with metrics.lock:
+            current_table = metrics.current_table
+            table_written = metrics.tables.get(current_table, TableMetrics()).rows_written
+            last_write_at = metrics.last_write_at
+        elapsed = time.time() - metrics.started_at
+        expected = sum(self.expected_rows.values())
+        rate = totals.rows_written / elapsed if elapsed else 0
+        eta = (expected - totals.rows_written) / rate if rate and expected else None
+        line = '{} {}/{} | всего {}/{} | {:.0f} строк/с | осталось {}'.format(
+            current_table or '-',
+            table_written, self.expected_rows.get(current_table, '?'),
+            totals.rows_written, expected or '?',
+            rate,
+            '{:.0f} с'.format(eta) if eta is not None else '?',
+        )
+        if last_write_at is not None:
+            idle = time.time() - last_write_at
+            if idle > 5 * self.interval:
+                line += ' | нет записи {:.0f} с'.format(idle)
+        self.stream.write('\r' + line.ljust(100))
+        self.stream.flush()
+
+    def stop(self) -> None:
+        super().stop()
+        self.stream.write('\n')
+
+
+@dataclass
+class PrometheusFileWriter(PeriodicReporter):
+    """Метрики в текстовом формате Prometheus (для textfile collector),
+    файл заменяется атомарно"""
+    path: str = 'loader.prom'
+
+    def report(self) -> None:
+        metrics = self.metrics
+        with metrics.lock:
+            tables = {name: asdict(table) for name, table in metrics.tables.items()}
+            commits = metrics.commits
+            last_write_at = metrics.last_write_at
+            current_table = metrics.current_table
+        lines = []
+        for name in asdict(TableMetrics()):
+            metric = 'sqlite_to_postgres_{}{}'.format(name, '_seconds' if name.endswith('_time') else '_total')
+            lines.append('# TYPE {} counter'.format(metric))
+            lines += ['{}{{table="{}"}} {}'.format(metric, table, values[name]) for table, values in tables.items()]
+        lines += [
+            '# TYPE sqlite_to_postgres_commits_total counter',
+            'sqlite_to_postgres_commits_total {}'.format(commits),
+            '# TYPE sqlite_to_postgres_last_write_timestamp_seconds gauge',
+            'sqlite_to_postgres_last_write_timestamp_seconds {}'.format(last_write_at or 0),
+            '# TYPE sqlite_to_postgres_current_table gauge',
+        ] + ['sqlite_to_postgres_current_table{{table="{}"}} {}'.format(
+            table, int(table == current_table)) for table in tables]
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as output:
+            output.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.path)
+
+
+@dataclass
+class JsonLinesWriter:
+    """Журнал событий загрузки: строка JSON на каждый учёт (пачку)"""
+    path: str
+    output: object = None
+
+    def __post_init__(self) -> None:
+        self.output = open(self.path, 'a', buffering=1)
+
+    def __call__(self, metrics: LoadMetrics, table_name: str, values: dict) -> None:
+        event = {'ts': time.time(), 'pid': os.getpid(), 'table': table_name}
+        event.update(values or {'event': 'start_table'})
+        self.output.write(json.dumps(event) + '\n')
+
+    def close(self) -> None:
+        self.output.close()
@@ -1,36 +1,162 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from datetime import date, datetime, timezone
+import io
+import itertools
+import os
+import struct
+import threading
+import uuid
 
 import psycopg2
-from psycopg2.extras import DictCursor
+from psycopg2.extensions import register_adapter
+from psycopg2.extras import DictCursor, UUID_adapter
+
+from base import BaseExtractor, BaseSaver, conflict_clause
+from metrics import LoadMetrics
+from pool import ConnectionPool
+from settings import COMMIT_EVERY
+from settings import COMMIT_POLICY
+from settings import INSERT_METHOD
+from settings import PG_ITERSIZE
+from settings import PG_SQL_SELECT
+from settings import PG_SQL_SELECT_FROM_ID
+from settings import SYNCHRONOUS_COMMIT
+
+
+# Приведённые значения id передаются в запросы как uuid (чтение uuid остаётся строками)
+register_adapter(uuid.UUID, UUID_adapter)
+
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def copy_value(value) -> str:
+    """Представление значения в текстовом формате COPY"""
+    if value is None:
+        return '\\N'
+    return str(value).translate(COPY_ESCAPES)
+
+
+BINARY_COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+BINARY_COPY_TRAILER = struct.pack('!h', -1)
+BINARY_NULL = struct.pack('!i', -1)
+PG_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+PG_EPOCH_DAYS = PG_EPOCH.date().toordinal()
+
+
+def binary_text(value: str) -> bytes:
+    data = value.encode()
+    return struct.pack('!i', len(data)) + data
+
+
+def binary_timestamptz(value: datetime) -> bytes:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    delta = value - PG_EPOCH
+    return struct.pack('!iq', 8, (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+
+BINARY_ENCODERS = {
+    str: binary_text,
+    uuid.UUID: lambda value: struct.pack('!i', 16) + value.bytes,
+    float: lambda value: struct.pack('!id', 8, value),
+    date: lambda value: struct.pack('!ii', 4, value.toordinal() - PG_EPOCH_DAYS),
+    datetime: binary_timestamptz,
+}
+
+
+def binary_copy_value(value) -> bytes:
+    """Представление значения в двоичном формате COPY; тип колонки определяется
+    типом значения, поэтому значения должны быть приведены заранее (coercion.py)"""
+    if value is None:
+        return BINARY_NULL
+    try:
+        encoder = BINARY_ENCODERS[type(value)]
+    except KeyError:
+        raise TypeError('нет двоичного представления COPY для {}'.format(type(value).__name__))
+    return encoder(value)
 
 
 @dataclass
-class PostgresSaver:
+class PostgresSaver(BaseSaver):
+    row_errors = (psycopg2.IntegrityError, psycopg2.DataError)
+
     data: dict
     conn_pg: psycopg2.extensions.connection = None
+    insert_method: str = INSERT_METHOD
+    commit_policy: str = COMMIT_POLICY
+    commit_every: int = COMMIT_EVERY
+    synchronous_commit: bool = SYNCHRONOUS_COMMIT
+    pending_rows: int = 0
+    pending_bytes: int = 0
+    commit_callbacks: list = field(default_factory=list)
+    metrics: LoadMetrics = field(default_factory=LoadMetrics)
+    pool: ConnectionPool = None
 
     def __post_init__(self) -> None:
-        self.conn_pg = psycopg2.connect(**self.data, cursor_factory=DictCursor)
+        if self.pool is not None:
+            self.conn_pg = self.pool.getconn()
+        else:
+            self.conn_pg = psycopg2.connect(**self.data, cursor_factory=DictCursor)
+        # Соединение из пула могло остаться с настройкой предыдущего владельца
+        if not self.synchronous_commit or self.pool is not None:
+            with self.conn_pg.cursor() as pg_cursor:
+                pg_cursor.execute("""SET synchronous_commit TO {};""".format(
+                    'on' if self.synchronous_commit else 'off'))
+            self.conn_pg.commit()
+
+    def clone(self):
+        """Новое соединение (из того же пула) с теми же настройками записи"""
+        return PostgresSaver(self.data,
+                             insert_method=self.insert_method,
+                             commit_policy=self.commit_policy,
+                             commit_every=self.commit_every,
+                             synchronous_commit=self.synchronous_commit,
+                             metrics=self.metrics,
+                             pool=self.pool)
 
     def close_connect(self) -> None:
-        self.conn_pg.close()
+        """Закрыть соединение или вернуть его в пул; повторный вызов ничего не делает"""
+        if self.conn_pg is None:
+            return
+        if self.pool is not None:
+            self.pool.putconn(self.conn_pg)
+        else:
+            self.conn_pg.close()
+        self.conn_pg = None
 
-    def rollback_connect(self) -> None:
+    def commit_transaction(self) -> None:
+        self.conn_pg.commit()
+
+    def rollback_transaction(self) -> None:
         self.conn_pg.rollback()
 
-    def __del__(self) -> None:
-        self.close_connect()
+    def execute_savepoint(self, statement: str) -> None:
+        with self.conn_pg.cursor() as pg_cursor:
+            pg_cursor.execute(statement)
 
-    def __enter__(self):
-        return self
+    def check_constraints(self) -> None:
+        """Внешние ключи объявлены DEFERRABLE INITIALLY DEFERRED и без этого
+        проверялись бы только при фиксации, уже вне точки сохранения"""
+        with self.conn_pg.cursor() as pg_cursor:
+            pg_cursor.execute("""SET CONSTRAINTS ALL IMMEDIATE""")
 
-    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
-        self.close_connect()
+    def write_rows(self,
+                   headers: list,
+                   data: list,
+                   table_name: str,
+                   upsert: bool = False) -> int:
+        """Запись данных в Postgres выбранным способом (insert, copy или copy_binary)"""
+        if self.insert_method == 'copy':
+            return self.copy_data(headers=headers, data=data, table_name=table_name, upsert=upsert)
+        if self.insert_method == 'copy_binary':
+            return self.copy_binary_data(headers=headers, data=data, table_name=table_name, upsert=upsert)
+        return self.insert_data(headers=headers, data=data, table_name=table_name, upsert=upsert)
 
     def insert_data(self,
-                    headers: set,
+                    headers: list,
                     data: list,
-                    table_name: str) -> None:
+                    table_name: str,
+                    upsert: bool = False) -> int:
         """Запись данных в Postgres"""
         values_s = '(' + ', '.join(['%s'] * len(headers)) + ')'
         headers_s = '(' + ', '.join([i for i in headers]) + ')'
@@ -39,7 +165,176 @@ class PostgresSaver:
             sql_text = """
                 INSERT INTO content.{table_name} {headers}
                 VALUES {args}
-                on conflict (id) do nothing;
-                """.format(table_name=table_name, headers=headers_s, args=args,)
+                {conflict};
+                """.format(table_name=table_name, headers=headers_s, args=args,
+                           conflict=conflict_clause(headers, upsert))
             pg_cursor.execute(sql_text)
-        self.conn_pg.commit()
+        self.metrics.record(table_name, round_trips=1, bytes_sent=len(sql_text))
+        return len(sql_text)
+
+    def copy_data(self,
+                  headers: list,
+                  data: list,
+                  table_name: str,
+                  upsert: bool = False) -> int:
+        """Запись данных в Postgres через COPY во временную таблицу и слияние с основной"""
+        buffer = io.StringIO(''.join(
+            '\t'.join(copy_value(value) for value in item) + '\n' for item in data
+        ))
+        self.copy_stream(headers, buffer, table_name, upsert=upsert)
+        return buffer.tell()
+
+    def copy_binary_data(self,
+                         headers: list,
+                         data: list,
+                         table_name: str,
+                         upsert: bool = False) -> int:
+        """Запись приведённых к типам колонок данных через COPY в двоичном формате"""
+        row_header = struct.pack('!h', len(headers))
+        buffer = io.BytesIO(b''.join(
+            [BINARY_COPY_HEADER]
+            + [row_header + b''.join(map(binary_copy_value, item)) for item in data]
+            + [BINARY_COPY_TRAILER]
+        ))
+        self.copy_stream(headers, buffer, table_name, 'binary', upsert)
+        return buffer.tell()
+
+    def copy_stream(self,
+                    headers: list,
+                    stream,
+                    table_name: str,
+                    copy_format: str = 'text',
+                    upsert: bool = False) -> int:
+        """COPY потока в формате copy_format во временную таблицу и слияние с основной.
+        Возвращает число скопированных строк"""
+        headers_s = '(' + ', '.join([i for i in headers]) + ')'
+        staging = 'staging_{}'.format(table_name)
+        with self.conn_pg.cursor() as pg_cursor:
+            pg_cursor.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS {staging}
+                (LIKE content.{table_name} INCLUDING DEFAULTS);
+                TRUNCATE {staging};
+                """.format(staging=staging, table_name=table_name))
+            pg_cursor.copy_expert(
+                """COPY {staging} {headers} FROM STDIN (FORMAT {copy_format})""".format(
+                    staging=staging, headers=headers_s, copy_format=copy_format),
+                stream,
+            )
+            rows = pg_cursor.rowcount
+            pg_cursor.execute("""
+                INSERT INTO content.{table_name} {headers}
+                SELECT {columns} FROM {staging}
+                {conflict};
+                """.format(table_name=table_name, headers=headers_s,
+                           columns=', '.join(headers), staging=staging,
+                           conflict=conflict_clause(headers, upsert)))
+        self.metrics.record(table_name, round_trips=3, bytes_sent=stream.tell() if stream.seekable() else 0)
+        return rows
+
+
+@dataclass
+class PostgresExtractor(BaseExtractor):
+    """Чтение таблиц схемы content из Postgres.
+    Строки читаются именованным (серверным) курсором по возрастанию id,
+    ключ контрольной точки — id последней строки"""
+    data: dict
+    conn_pg: psycopg2.extensions.connection = None
+    itersize: int = PG_ITERSIZE
+    row_counts: dict = field(default_factory=dict)
+    cursor_names: itertools.count = field(default_factory=itertools.count)
+
+    def __post_init__(self) -> None:
+        self.conn_pg = psycopg2.connect(**self.data)
+        self.conn_pg.set_session(readonly=True)
+
+    def close(self) -> None:
+        self.conn_pg.close()
+
+    def get_list_table(self) -> list:
+        """Получить список таблиц схемы content"""
+        with self.conn_pg.cursor() as pg_cursor:
+            pg_cursor.execute("""
+                SELECT table_name FROM information_schema.tables
+                WHERE table_schema = 'content' AND table_type = 'BASE TABLE';
+                """)
+            return pg_cursor.fetchall()
+
+    def get_headers(self, table_name: str) -> list:
+        """Получить заголовки таблицы в порядке объявления колонок"""
+        with self.conn_pg.cursor() as pg_cursor:
+            pg_cursor.execute("""
+                SELECT column_name FROM information_schema.columns
+                WHERE table_schema = 'content' AND table_name = %s
+                ORDER BY ordinal_position;
+                """, (table_name,))
+            return [row[0] for row in pg_cursor.fetchall()]
+
+    def get_row_count(self, table_name: str) -> int:
+        """Число строк таблицы; считается один раз за запуск"""
+        if table_name not in self.row_counts:
+            with self.conn_pg.cursor() as pg_cursor:
+                pg_cursor.execute("""SELECT COUNT(*) FROM content.{}""".format(table_name))
+                self.row_counts[table_name] = pg_cursor.fetchone()[0]
+        return self.row_counts[table_name]
+
+    def get_data_from(self,
+                      table_name: str,
+                      headers: list,
+                      last_key: str = None,
+                      until_key: str = None):
+        """Получить записи таблицы после указанного id в именованном курсоре; id идёт первой колонкой.
+        Деление на диапазоны не поддерживается, until_key не используется"""
+        pg_cursor = self.conn_pg.cursor(name='extract_{}_{}'.format(table_name, next(self.cursor_names)))
+        pg_cursor.itersize = self.itersize
+        if last_key:
+            pg_cursor.execute(PG_SQL_SELECT_FROM_ID.format(', '.join(headers), table_name), (last_key,))
+        else:
+            pg_cursor.execute(PG_SQL_SELECT.format(', '.join(headers), table_name))
+        return pg_cursor
+
+    def copy_to(self, headers: list, stream, table_name: str, copy_format: str = 'binary') -> int:
+        """Выгрузка колонок headers таблицы в поток через COPY TO STDOUT.
+        Возвращает число выгруженных строк"""
+        with self.conn_pg.cursor() as pg_cursor:
+            pg_cursor.copy_expert(
+                """COPY (SELECT {columns} FROM content.{table_name}) TO STDOUT (FORMAT {copy_format})""".format(
+                    columns=', '.join(headers), table_name=table_name, copy_format=copy_format),
+                stream,
+            )
+            return pg_cursor.rowcount
+
+
+def copy_table(postgres_extractor: PostgresExtractor,
+               postgres_saver: PostgresSaver,
+               headers: list,
+               table_name: str,
+               upsert: bool = False) -> int:
+    """Прямое копирование таблицы между базами Postgres без разбора строк:
+    COPY TO STDOUT источника пишется в канал в отдельном потоке,
+    а COPY FROM STDIN приёмника читает его во временную таблицу в бинарном формате"""
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def copy_out(stream) -> None:
+        try:
+            with stream:
+                postgres_extractor.copy_to(headers, stream, table_name)
+        except Exception as error:
+            errors.append(error)
+
+    with open(read_fd, 'rb') as reader:
+        thread = threading.Thread(target=copy_out, args=(open(write_fd, 'wb'),), daemon=True)
+        thread.start()
+        try:
+            rows = postgres_saver.copy_stream(headers, reader, table_name, 'binary', upsert)
+        except Exception as error:
+            reader.close()
+            thread.join()
+            if errors and not isinstance(errors[0], BrokenPipeError):
+                raise errors[0] from error
+            raise
+        thread.join()
+    if errors:
+        raise errors[0]
+    postgres_saver.after_write(rows, 0)
+    return rows
@@ -0,0 +1,203 @@
+from dataclasses import dataclass, field
+import queue
+import threading
+import time
+
+from batching import estimate_row_bytes
+from metrics import LoadMetrics
+from pg_work import PostgresSaver
+from rejects import RejectWriter
+
+
+@dataclass
+class Batch:
+    """Пачка строк таблицы с ключом последней строки для контрольной точки"""
+    seq: int
+    last_key: int
+    row_count: int
+    data: list
+    checksums: list = None
+    latency: float = 0.0
+    written: int = 0
+    row_bytes: int = 0
+
+
+@dataclass
+class BatchTracker:
+    """Завершение записанных пачек строго по порядку чтения,
+    чтобы контрольная точка не обгоняла незаписанные пачки"""
+    complete: callable
+    next_seq: int = 0
+    pending: dict = field(default_factory=dict)
+
+    def add(self, batch: Batch) -> None:
+        self.pending[batch.seq] = batch
+        while self.next_seq in self.pending:
+            self.complete(self.pending.pop(self.next_seq))
+            self.next_seq += 1
+
+    def drain(self, results: queue.Queue) -> None:
+        """Обработать готовые результаты писателей; ошибка записи пробрасывается"""
+        while True:
+            try:
+                batch, error = results.get_nowait()
+            except queue.Empty:
+                return
+            if error is not None:
+                raise error
+            self.add(batch)
+
+
+def read_batches(cursor,
+                 batch_sizer,
+                 row_count: int = 0,
+                 metrics: LoadMetrics = None,
+                 table_name: str = None):
+    """Чтение пачек из курсора SQLite, rowid идёт первой колонкой"""
+    seq = 0
+    while True:
+        started = time.perf_counter()
+        data = cursor.fetchmany(batch_sizer.size)
+        if metrics is not None:
+            metrics.record(table_name, rows_read=len(data), read_time=time.perf_counter() - started)
+        if not data:
+            break
+        row_count += len(data)
+        yield Batch(seq=seq, last_key=data[-1][0], row_count=row_count, data=[row[1:] for row in data])
+        seq += 1
+
+
+def write_batch(postgres_saver: PostgresSaver,
+                headers: list,
+                table_name: str,
+                batch: Batch,
+                upsert: bool = False,
+                dead_letter: RejectWriter = None) -> Batch:
+    """Запись пачки в Postgres с замером времени.
+    При переданном dead_letter строки, на которых падает запись, отделяются
+    делением пачки пополам и пишутся в dead_letter с текстом ошибки.
+    Строки пачки освобождаются, остаётся статистика для подбора размера пачки"""
+    if batch.data:
+        started = time.perf_counter()
+        if dead_letter is None:
+            postgres_saver.save_data(headers=headers, data=batch.data, table_name=table_name, upsert=upsert)
+            batch.written = len(batch.data)
+        else:
+            batch.written = write_isolated(postgres_saver, headers, table_name, batch, upsert, dead_letter)
+        batch.latency = time.perf_counter() - started
+        postgres_saver.metrics.record(table_name, rows_written=batch.written, batches=1,
+                                      write_time=batch.latency)
+        batch.row_bytes = estimate_row_bytes(batch.data)
+    batch.data = None
+    return batch
+
+
+def write_isolated(postgres_saver: PostgresSaver,
+                   headers: list,
+                   table_name: str,
+                   batch: Batch,
+                   upsert: bool,
+                   dead_letter: RejectWriter) -> int:
+    """Запись пачки с отделением плохих строк; контрольные суммы отделённых строк
+    не сохраняются, чтобы инкрементальная загрузка повторила их"""
+    rejected = []
+
+    def reject(row: tuple, reason: str) -> None:
+        rejected.append(row)
+        dead_letter.write(table_name, headers, row, reason)
+
+    written = postgres_saver.save_data_isolated(headers, batch.data, table_name, reject, upsert)
+    if rejected:
+        postgres_saver.metrics.record(table_name, rows_dead_letter=len(rejected))
+        if batch.checksums:
+            id_index = headers.index('id')
+            rejected_ids = {str(row[id_index]) for row in rejected}
+            batch.checksums = [item for item in batch.checksums if str(item[1]) not in rejected_ids]
+    return written
+
+
+def pipeline_writer(postgres_saver: PostgresSaver,
+                    headers: list,
+                    table_name: str,
+                    upsert: bool,
+                    tasks: queue.Queue,
+                    results: queue.Queue,
+                    dead_letter: RejectWriter = None) -> None:
+    """Писатель: забирает пачки из очереди до None. Пачка возвращается читателю
+    после фиксации транзакции. Любая ошибка записи, фиксации в конце таблицы или отката
+    передаётся читателю; после неё писатель разбирает очередь без записи,
+    чтобы читатель не заблокировался"""
+    failed = False
+    while True:
+        batch = tasks.get()
+        if batch is None:
+            break
+        if failed:
+            continue
+        try:
+            write_batch(postgres_saver, headers, table_name, batch, upsert, dead_letter)
+            postgres_saver.on_commit(lambda batch=batch: results.put((batch, None)))
+        except Exception as error:
+            failed = True
+            report_failure(postgres_saver, results, batch, error)
+    if not failed:
+        try:
+            postgres_saver.end_table()
+        except Exception as error:
+            report_failure(postgres_saver, results, None, error)
+
+
+def report_failure(postgres_saver: PostgresSaver, results: queue.Queue, batch: Batch, error: Exception) -> None:
+    """Откатить транзакцию писателя и передать ошибку читателю, даже если откат не удался"""
+    try:
+        postgres_saver.rollback_connect()
+    except Exception:
+        pass
+    finally:
+        results.put((batch, error))
+
+
+def run_pipelined(batches,
+                  postgres_saver: PostgresSaver,
+                  headers: list,
+                  table_name: str,
+                  complete: callable,
+                  upsert: bool = False,
+                  writers: int = 1,
+                  queue_size: int = 4,
+                  dead_letter: RejectWriter = None) -> None:
+    """Чтение и запись внахлёст: текущий поток читает пачки в ограниченную очередь,
+    writers потоков пишут их в Postgres, каждый через своё соединение.
+    Дополнительные соединения не видят незафиксированных данных основного,
+    поэтому при writers > 1 основное соединение фиксируется перед стартом,
+    а дополнительные - в конце таблицы при любой политике"""
+    if writers > 1 and postgres_saver.pending_rows:
+        postgres_saver.commit()
+    tasks = queue.Queue(maxsize=queue_size)
+    results = queue.Queue()
+    savers = [postgres_saver] + [postgres_saver.clone() for _ in range(writers - 1)]
+    threads = [
+        threading.Thread(target=pipeline_writer, args=(saver, headers, table_name, upsert, tasks, results, dead_letter))
+        for saver in savers
+    ]
+    for thread in threads:
+        thread.start()
+    tracker = BatchTracker(complete)
+    try:
+        for batch in batches:
+            tasks.put(batch)
+            tracker.drain(results)
+    finally:
+        for _ in threads:
+            tasks.put(None)
+        for thread in threads:
+            thread.join()
+        for saver in savers[1:]:
+            if saver.pending_rows:
+                saver.commit()
+            saver.close_connect()
+    tracker.drain(results)
+    if postgres_saver.commit_callbacks:
+        # Политика 'load': пачки основного соединения завершаются при итоговой фиксации,
+        # уже после выхода из этой функции
+        postgres_saver.on_commit(lambda: tracker.drain(results))
@@ -0,0 +1,150 @@
+import atexit
+from dataclasses import dataclass, field
+import os
+import threading
+import time
+
+import psycopg2
+from psycopg2.extras import DictCursor
+from psycopg2.pool import ThreadedConnectionPool
+
+from settings import PG_CONNECT_RETRIES
+from settings import PG_CONNECT_RETRY_DELAY
+from settings import PG_POOL_MIN
+from settings import PG_POOL_SIZE
+from settings import PG_SESSION_SETTINGS
+
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """Соединение пула; настройки сессии применяются один раз за время жизни соединения"""
+    configured = False
+
+
+@dataclass
+class ConnectionPool:
+    """Потокобезопасный пул соединений Postgres.
+    При исчерпании пула getconn ждёт освобождения соединения, а не падает.
+    Перед выдачей соединение проверяется запросом SELECT 1, разорванное заменяется новым;
+    ошибки подключения повторяются retries раз с паузой retry_delay.
+    Размер пула можно увеличить (grow), но не уменьшить"""
+    data: dict
+    maxconn: int = PG_POOL_SIZE
+    minconn: int = PG_POOL_MIN
+    session: dict = field(default_factory=lambda: dict(PG_SESSION_SETTINGS))
+    retries: int = PG_CONNECT_RETRIES
+    retry_delay: float = PG_CONNECT_RETRY_DELAY
+    pool: ThreadedConnectionPool = None
+    slots: threading.Semaphore = None
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def __post_init__(self) -> None:
+        if self.maxconn <= 0:
+            # Семафор без мест: getconn ждал бы вечно
+            raise ValueError('Размер пула должен быть положительным: {}'.format(self.maxconn))
+        self.slots = threading.Semaphore(self.maxconn)
+        self.pool = self.with_retries(
+            ThreadedConnectionPool, min(self.minconn, self.maxconn), self.maxconn,
+            connection_factory=PooledConnection, cursor_factory=DictCursor, **self.data)
+
+    def with_retries(self, func, *args, **kwargs):
+        for attempt in range(self.retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except TRANSIENT_ERRORS:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.retry_delay * (attempt + 1))
+
+    def grow(self, maxconn: int) -> None:
+        """Довести число соединений пула до maxconn; ожидающие getconn получают новые места сразу"""
+        with self.lock:
+            if maxconn <= self.maxconn:
+                return
+            added = maxconn - self.maxconn
+            self.maxconn = self.pool.maxconn = maxconn
+            self.slots.release(added)
+
+    def getconn(self) -> PooledConnection:
+        """Исправное соединение с применёнными настройками сессии"""
+        self.slots.acquire()
+        try:
+            return self.with_retries(self.checkout)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def checkout(self) -> PooledConnection:
+        conn = self.pool.getconn()
+        try:
+            with conn.cursor() as pg_cursor:
+                pg_cursor.execute("""SELECT 1""")
+                if not conn.configured:
+                    for name, value in self.session.items():
+                        pg_cursor.execute("""SELECT set_config(%s, %s, false)""", (name, str(value)))
+            conn.commit()
+        except TRANSIENT_ERRORS:
+            self.pool.putconn(conn, close=True)
+            raise
+        conn.configured = True
+        return conn
+
+    def putconn(self, conn: PooledConnection) -> None:
+        """Вернуть соединение; незавершённая транзакция откатывается, закрытое соединение отбрасывается"""
+        try:
+            self.pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self.slots.release()
+
+    def closeall(self) -> None:
+        if not self.pool.closed:
+            self.pool.closeall()
+
+
+SHARED_POOLS = {}
+SHARED_POOLS_LOCK = threading.Lock()
+# Пулы, унаследованные при fork: их сокеты принадлежат родителю, поэтому в дочернем процессе
+# они не используются и не закрываются, а ссылки на них хранятся, чтобы соединения не закрыл сборщик мусора
+INHERITED_POOLS = []
+
+
+def shared_pool(data: dict, maxconn: int = PG_POOL_SIZE) -> ConnectionPool:
+    """Общий для процесса пул соединений к базе data: его используют все загрузчики
+    и проверки в процессе, в том числе задачи, которые пул процессов выполняет в одном процессе.
+    Пул создаётся при первом обращении и закрывается при завершении процесса;
+    если уже созданный пул меньше maxconn, он увеличивается.
+    При maxconn <= 0 пул не используется: возвращается None, и PostgresSaver открывает своё соединение"""
+    if maxconn <= 0:
+        return None
+    key = tuple(sorted(data.items()))
+    with SHARED_POOLS_LOCK:
+        if key not in SHARED_POOLS:
+            SHARED_POOLS[key] = ConnectionPool(data, maxconn=maxconn)
+        SHARED_POOLS[key].grow(maxconn)
+        return SHARED_POOLS[key]
+
+
+def sized_pool(data: dict, connections: int, pool_size: int = PG_POOL_SIZE) -> ConnectionPool:
+    """Общий пул не меньше чем на connections одновременных соединений;
+    при pool_size <= 0 пул не используется (None)"""
+    if pool_size <= 0:
+        return None
+    return shared_pool(data, max(pool_size, connections))
+
+
+def forget_inherited_pools() -> None:
+    """После fork дочерний процесс открывает свои пулы"""
+    global SHARED_POOLS_LOCK
+    SHARED_POOLS_LOCK = threading.Lock()
+    INHERITED_POOLS.extend(SHARED_POOLS.values())
+    SHARED_POOLS.clear()
+
+
+os.register_at_fork(after_in_child=forget_inherited_pools)
+
+
+@atexit.register
+def close_shared_pools() -> None:
+    for pool in SHARED_POOLS.values():
+        pool.closeall()
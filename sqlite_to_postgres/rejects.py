@@ -0,0 +1,34 @@
+from dataclasses import dataclass, field
+import json
+import os
+import threading
+import time
+
+
+@dataclass
+class RejectWriter:
+    """Файл отклонённых строк: строка JSON на запись с таблицей, значениями и причиной"""
+    path: str
+    output: object = None
+    count: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def __post_init__(self) -> None:
+        self.output = open(self.path, 'a', buffering=1)
+
+    def close(self) -> None:
+        self.output.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def write(self, table_name: str, headers: list, row: tuple, reason: str) -> None:
+        event = {'ts': time.time(), 'pid': os.getpid(), 'table': table_name,
+                 'row': dict(zip(headers, row)), 'reason': reason}
+        line = json.dumps(event, ensure_ascii=False, default=str) + '\n'
+        with self.lock:
+            self.output.write(line)
+            self.count += 1
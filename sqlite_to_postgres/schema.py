@@ -0,0 +1,194 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+
+from pg_work import PostgresSaver
+from pool import ConnectionPool
+from pool import shared_pool
+from pool import sized_pool
+from settings import DOCUMENT_BATCH_SIZE
+from table_init import TABLE_NAME_CLASSES
+
+SQL_INDEXES = """
+    SELECT i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid), i.indisprimary
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'content'
+      AND NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conindid = i.indexrelid AND contype IN ('p', 'u', 'x'))
+    ORDER BY 1;
+    """
+SQL_CONSTRAINTS = """
+    SELECT c.conrelid::regclass::text, c.conname, c.contype, pg_get_constraintdef(c.oid),
+           CASE WHEN c.contype = 'u' THEN pg_get_indexdef(c.conindid) END
+    FROM pg_constraint c
+    JOIN pg_namespace n ON n.oid = c.connamespace
+    WHERE n.nspname = 'content'
+    ORDER BY 1, 2;
+    """
+# Триггеры, поддерживающие content.film_work_document (миграция movies 0005)
+SQL_DOCUMENT_TRIGGERS = """
+    SELECT t.tgrelid::regclass::text, t.tgname
+    FROM pg_trigger t
+    JOIN pg_class c ON c.oid = t.tgrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'content' AND NOT t.tgisinternal AND t.tgname LIKE 'film\\_work\\_document\\_%'
+    ORDER BY 1, 2;
+    """
+
+
+def describe_schema(postgres_saver: PostgresSaver) -> dict:
+    """Индексы и ограничения схемы content"""
+    with postgres_saver.conn_pg.cursor() as pg_cursor:
+        pg_cursor.execute(SQL_INDEXES)
+        indexes = [list(row) for row in pg_cursor.fetchall()]
+        pg_cursor.execute(SQL_CONSTRAINTS)
+        constraints = [list(row) for row in pg_cursor.fetchall()]
+    postgres_saver.conn_pg.commit()
+    return {'indexes': indexes, 'constraints': constraints}
+
+
+def is_content_empty(postgres_saver: PostgresSaver) -> bool:
+    """Все загружаемые таблицы схемы content пусты"""
+    with postgres_saver.conn_pg.cursor() as pg_cursor:
+        for table in TABLE_NAME_CLASSES:
+            pg_cursor.execute("""SELECT EXISTS (SELECT 1 FROM content.{})""".format(table))
+            if pg_cursor.fetchone()[0]:
+                return False
+    return True
+
+
+def drop_secondary_schema(postgres_saver: PostgresSaver, backup_path: str) -> dict:
+    """Удалить вторичные индексы, уникальные и внешние ключи перед первичной загрузкой.
+    Первичные ключи остаются: на них держится on conflict (id).
+    Описание удалённого сохраняется в backup_path до удаления"""
+    if not is_content_empty(postgres_saver):
+        raise ValueError('Отложить индексы можно только при загрузке в пустую схему content')
+    schema = describe_schema(postgres_saver)
+    with open(backup_path, 'w') as backup:
+        json.dump(schema, backup, indent=2)
+    with postgres_saver.conn_pg.cursor() as pg_cursor:
+        for table, name, contype, _, _ in schema['constraints']:
+            if contype == 'f':
+                pg_cursor.execute("""ALTER TABLE {} DROP CONSTRAINT {}""".format(table, name))
+        for table, name, contype, _, _ in schema['constraints']:
+            if contype == 'u':
+                pg_cursor.execute("""ALTER TABLE {} DROP CONSTRAINT {}""".format(table, name))
+        for name, _, primary in schema['indexes']:
+            if not primary:
+                pg_cursor.execute("""DROP INDEX {}""".format(name))
+    postgres_saver.conn_pg.commit()
+    return schema
+
+
+def execute_statement(pg_data: dict, statement: str, pool: ConnectionPool = None) -> None:
+    """Выполнить DDL в отдельном соединении из пула pool или из общего пула"""
+    with PostgresSaver(pg_data, pool=pool or shared_pool(pg_data)) as postgres_saver:
+        with postgres_saver.conn_pg.cursor() as pg_cursor:
+            pg_cursor.execute(statement)
+        postgres_saver.conn_pg.commit()
+
+
+def run_parallel(pg_data: dict, statements: list, workers: int) -> None:
+    """Выполнить DDL в workers потоков; пул увеличивается до числа потоков, чтобы они не ждали соединений"""
+    pool = sized_pool(pg_data, workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(execute_statement, pg_data, statement, pool) for statement in statements]:
+            future.result()
+
+
+def restore_secondary_schema(pg_data: dict, backup_path: str, workers: int) -> None:
+    """Восстановить удалённое после загрузки: индексы (в том числе под уникальные ключи)
+    строятся параллельно, внешние ключи добавляются как NOT VALID и затем проверяются.
+    После восстановления схема сверяется с сохранённым описанием"""
+    with open(backup_path) as backup:
+        schema = json.load(backup)
+    with PostgresSaver(pg_data, pool=shared_pool(pg_data)) as postgres_saver:
+        current = describe_schema(postgres_saver)
+    existing = {row[1] for row in current['constraints']} | {row[0] for row in current['indexes']}
+    unique = [row for row in schema['constraints'] if row[2] == 'u' and row[1] not in existing]
+    foreign_keys = [row for row in schema['constraints'] if row[2] == 'f' and row[1] not in existing]
+
+    run_parallel(pg_data, [
+        definition for name, definition, primary in schema['indexes']
+        if not primary and name not in existing
+    ] + [index_definition for _, _, _, _, index_definition in unique], workers)
+    for table, name, _, _, _ in unique:
+        execute_statement(pg_data, """ALTER TABLE {0} ADD CONSTRAINT {1} UNIQUE USING INDEX {1}""".format(
+            table, name.split('.')[-1]))
+    for table, name, _, definition, _ in foreign_keys:
+        execute_statement(pg_data, """ALTER TABLE {} ADD CONSTRAINT {} {} NOT VALID""".format(
+            table, name, definition))
+    run_parallel(pg_data, [
+        """ALTER TABLE {} VALIDATE CONSTRAINT {}""".format(table, name)
+        for table, name, _, _, _ in foreign_keys
+    ], workers)
+
+    with PostgresSaver(pg_data, pool=shared_pool(pg_data)) as postgres_saver:
+        differences = compare_schema(schema, describe_schema(postgres_saver))
+    if differences:
+        raise ValueError('Схема content после восстановления отличается: {}'.format(differences))
+
+
+def compare_schema(expected: dict, actual: dict) -> list:
+    """Различия между описаниями схемы"""
+    differences = []
+    for kind in ('indexes', 'constraints'):
+        expected_rows = {tuple(row) for row in expected[kind]}
+        actual_rows = {tuple(row) for row in actual[kind]}
+        differences += [('missing', kind, row) for row in sorted(expected_rows - actual_rows)]
+        differences += [('unexpected', kind, row) for row in sorted(actual_rows - expected_rows)]
+    return differences
+
+
+def set_document_triggers(pg_data: dict, enabled: bool) -> list:
+    """Включить или отключить триггеры документов кинопроизведений.
+    Возвращает список (таблица, триггер); пустой, если документов в базе нет"""
+    with PostgresSaver(pg_data, pool=shared_pool(pg_data)) as postgres_saver:
+        with postgres_saver.conn_pg.cursor() as pg_cursor:
+            pg_cursor.execute(SQL_DOCUMENT_TRIGGERS)
+            triggers = [tuple(row) for row in pg_cursor.fetchall()]
+            for table, name in triggers:
+                pg_cursor.execute("""ALTER TABLE {} {} TRIGGER {}""".format(
+                    table, 'ENABLE' if enabled else 'DISABLE', name))
+        postgres_saver.conn_pg.commit()
+    return triggers
+
+
+def rebuild_film_documents(pg_data: dict, batch_size: int = DOCUMENT_BATCH_SIZE) -> int:
+    """Пересобрать content.film_work_document после загрузки с отключёнными триггерами,
+    как команда rebuild_film_documents: пачками по id, каждая в своей транзакции,
+    затем заменить документы удалённых кинопроизведений надгробиями"""
+    rebuilt = 0
+    last_id = '00000000-0000-0000-0000-000000000000'
+    with PostgresSaver(pg_data, pool=shared_pool(pg_data)) as postgres_saver:
+        with postgres_saver.conn_pg.cursor() as pg_cursor:
+            while True:
+                pg_cursor.execute("""SELECT id FROM content.film_work WHERE id > %s ORDER BY id LIMIT %s""",
+                                  (last_id, batch_size))
+                film_ids = [row[0] for row in pg_cursor.fetchall()]
+                if not film_ids:
+                    break
+                pg_cursor.execute("""SELECT content.refresh_film_work_documents(%s::uuid[])""", (film_ids,))
+                postgres_saver.conn_pg.commit()
+                rebuilt += len(film_ids)
+                last_id = film_ids[-1]
+            pg_cursor.execute("""
+                WITH removed AS (
+                    DELETE FROM content.film_work_document d
+                    WHERE NOT EXISTS (SELECT 1 FROM content.film_work fw WHERE fw.id = d.film_work_id)
+                    RETURNING film_work_id
+                )
+                INSERT INTO content.film_work_tombstone (film_work_id, deleted_at)
+                SELECT film_work_id, now() FROM removed
+                ON CONFLICT (film_work_id) DO UPDATE
+                SET deleted_at = EXCLUDED.deleted_at, changed_xid = EXCLUDED.changed_xid
+                """)
+            # Кинопроизведения, вставленные заново при отключённых триггерах
+            pg_cursor.execute("""
+                DELETE FROM content.film_work_tombstone t
+                WHERE EXISTS (SELECT 1 FROM content.film_work fw WHERE fw.id = t.film_work_id)
+                """)
+        postgres_saver.conn_pg.commit()
+    return rebuilt
@@ -15,7 +15,116 @@ dsl = {
         'port': os.environ.get('DB_PORT')
     }
 sqlite3_path = os.environ.get('SQLITE_PATH')
+# Файлы SQLite, которые ищутся в каталоге шардов
+SHARD_PATTERNS = ('*.db', '*.sqlite', '*.sqlite3')
+# Чтение SQLite как неизменяемого файла только для чтения с отображением в память
+SQLITE_READ_ONLY = os.environ.get('SQLITE_READ_ONLY', False) == 'True'
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 2 ** 30))
+SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', 64 * 1024))
 MANY_TO_MANY_TABLES = ['genre_film_work', 'person_film_work']
 SQL_SELECT = """SELECT {} FROM {};"""
+SQL_SELECT_FROM_ROWID = """SELECT rowid, {} FROM {} WHERE rowid > ? ORDER BY rowid;"""
+SQL_SELECT_ROWID_RANGE = """SELECT rowid, {} FROM {} WHERE rowid > ? AND rowid <= ? ORDER BY rowid;"""
+PG_SQL_SELECT = """SELECT id, {} FROM content.{} ORDER BY id;"""
+PG_SQL_SELECT_FROM_ID = """SELECT id, {} FROM content.{} WHERE id > %s ORDER BY id;"""
+# Число строк, получаемых за один запрос к именованному курсору Postgres
+PG_ITERSIZE = int(os.environ.get('PG_ITERSIZE', 10000))
+# Схема таблиц SQLite: исходная база и приёмник при выгрузке из Postgres
+SQLITE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS film_work (
+        id TEXT PRIMARY KEY,
+        title TEXT NOT NULL,
+        description TEXT,
+        creation_date DATE,
+        file_path TEXT,
+        rating FLOAT,
+        type TEXT NOT NULL,
+        created_at timestamp with time zone,
+        updated_at timestamp with time zone
+    );
+    CREATE TABLE IF NOT EXISTS genre (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        description TEXT,
+        created_at timestamp with time zone,
+        updated_at timestamp with time zone
+    );
+    CREATE TABLE IF NOT EXISTS person (
+        id TEXT PRIMARY KEY,
+        full_name TEXT NOT NULL,
+        created_at timestamp with time zone,
+        updated_at timestamp with time zone
+    );
+    CREATE TABLE IF NOT EXISTS genre_film_work (
+        id TEXT PRIMARY KEY,
+        film_work_id TEXT NOT NULL,
+        genre_id TEXT NOT NULL,
+        created_at timestamp with time zone
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS film_work_genre ON genre_film_work (film_work_id, genre_id);
+    CREATE TABLE IF NOT EXISTS person_film_work (
+        id TEXT PRIMARY KEY,
+        film_work_id TEXT NOT NULL,
+        person_id TEXT NOT NULL,
+        role TEXT NOT NULL,
+        created_at timestamp with time zone
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS film_work_person_role ON person_film_work (film_work_id, person_id, role);
+    """
 TIMESTAMP_WITH_TIMEZONE = datetime.now(timezone.utc)
 COUNT_FETCHMANY = 200
+# Постоянный размер пачки для отдельных таблиц, отключает адаптивный подбор
+COUNT_FETCHMANY_TABLES = {}
+ADAPTIVE_BATCH = os.environ.get('ADAPTIVE_BATCH', 'True') == 'True'
+BATCH_MIN_SIZE = 50
+BATCH_MAX_SIZE = 20000
+BATCH_MEMORY_BUDGET = int(os.environ.get('BATCH_MEMORY_BUDGET', 8 * 1024 * 1024))
+BATCH_TARGET_LATENCY = float(os.environ.get('BATCH_TARGET_LATENCY', 0.5))
+# Способ записи в Postgres: 'insert' (INSERT ... VALUES), 'copy' (COPY через временную таблицу)
+# или 'copy_binary' (COPY в двоичном формате, только вместе с приведением типов COERCE_TYPES)
+INSERT_METHOD = os.environ.get('INSERT_METHOD', 'insert')
+# Когда фиксировать транзакцию: 'batch' (каждая пачка), 'rows' или 'bytes' (каждые COMMIT_EVERY строк или байт),
+# 'table' (каждая таблица), 'load' (одна транзакция на всю загрузку)
+COMMIT_POLICY = os.environ.get('COMMIT_POLICY', 'batch')
+COMMIT_EVERY = int(os.environ.get('COMMIT_EVERY', 100000))
+SYNCHRONOUS_COMMIT = os.environ.get('SYNCHRONOUS_COMMIT', 'True') == 'True'
+# Пул соединений Postgres на процесс; 0 - отдельное соединение на каждый PostgresSaver
+PG_POOL_SIZE = int(os.environ.get('PG_POOL_SIZE', 4))
+PG_POOL_MIN = 1
+PG_CONNECT_RETRIES = int(os.environ.get('PG_CONNECT_RETRIES', 3))
+PG_CONNECT_RETRY_DELAY = float(os.environ.get('PG_CONNECT_RETRY_DELAY', 1.0))
+# Настройки сессии для соединений пула, например PG_WORK_MEM=64MB
+PG_SESSION_SETTINGS = {
+    name: os.environ.get(variable)
+    for name, variable in (('work_mem', 'PG_WORK_MEM'), ('maintenance_work_mem', 'PG_MAINTENANCE_WORK_MEM'))
+    if os.environ.get(variable)
+}
+# Преобразование строк перед вставкой: 'fast' (без dataclass), 'dataclass' (с проверкой полей)
+# или 'none' (строки переносятся как есть, в том числе created_at и updated_at)
+TRANSFORM_MODE = os.environ.get('TRANSFORM_MODE', 'fast')
+# Приведение значений к типам колонок Postgres перед записью;
+# строки, которые не удалось привести, пишутся в REJECTS_PATH
+COERCE_TYPES = os.environ.get('COERCE_TYPES', False) == 'True'
+REJECTS_PATH = os.environ.get('REJECTS_PATH', 'rejects.jsonl')
+# Файл строк, на которых падает запись (нарушение ограничений); не задан - ошибка останавливает загрузку
+DEAD_LETTER_PATH = os.environ.get('DEAD_LETTER_PATH')
+# Значения исходной базы для FilmTypes и PersonFilmWork.RoleTypes
+FILM_TYPES = {'movie': 'MOV', 'tv_show': 'TVS'}
+ROLE_TYPES = {'actor': 'ACT', 'producer': 'PRD', 'director': 'DRC'}
+LOAD_WORKERS = int(os.environ.get('LOAD_WORKERS', 1))
+# На сколько диапазонов rowid делить таблицу при параллельной загрузке
+READ_CHUNKS = int(os.environ.get('READ_CHUNKS', 1))
+PIPELINE_WRITERS = int(os.environ.get('PIPELINE_WRITERS', 1))
+PIPELINE_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', 4))
+# Асинхронная загрузка (async_load.py): соединения asyncpg, одновременно ждущие ответа Postgres
+ASYNC_CONNECTIONS = int(os.environ.get('ASYNC_CONNECTIONS', 8))
+ASYNC_BATCH_SIZE = int(os.environ.get('ASYNC_BATCH_SIZE', 1000))
+ASYNC_QUEUE_SIZE = int(os.environ.get('ASYNC_QUEUE_SIZE', 16))
+SYNC_STATE_PATH = os.environ.get('SYNC_STATE_PATH', 'sync_state.sqlite')
+CHECKPOINT_PATH = os.environ.get('CHECKPOINT_PATH', 'checkpoint.sqlite')
+DEFERRED_SCHEMA_PATH = os.environ.get('DEFERRED_SCHEMA_PATH', 'deferred_schema.json')
+INDEX_WORKERS = int(os.environ.get('INDEX_WORKERS', 4))
+# Кинопроизведений на транзакцию при пересборке content.film_work_document после загрузки
+DOCUMENT_BATCH_SIZE = int(os.environ.get('DOCUMENT_BATCH_SIZE', 1000))
+METRICS_INTERVAL = float(os.environ.get('METRICS_INTERVAL', 1.0))
+VERIFY_CHUNK_SIZE = int(os.environ.get('VERIFY_CHUNK_SIZE', 10000))
@@ -1,21 +1,66 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from datetime import date
+import glob
+import os
 import sqlite3
+import threading
+from urllib.request import pathname2url
 
+from base import BaseExtractor, BaseSaver, conflict_clause
+from metrics import LoadMetrics
+from settings import COMMIT_EVERY
+from settings import COMMIT_POLICY
 from settings import SQL_SELECT
+from settings import SQLITE_CACHE_SIZE
+from settings import SQLITE_MMAP_SIZE
+from settings import SQLITE_READ_ONLY
+from settings import SQL_SELECT_FROM_ROWID
+from settings import SQL_SELECT_ROWID_RANGE
+from settings import SQLITE_SCHEMA
+from settings import SHARD_PATTERNS
+
+
+def find_shards(pattern: str) -> list:
+    """Файлы SQLite по шаблону glob или все файлы SHARD_PATTERNS в каталоге"""
+    if os.path.isdir(pattern):
+        paths = [path for item in SHARD_PATTERNS for path in glob.glob(os.path.join(pattern, item))]
+    else:
+        paths = glob.glob(pattern)
+    return sorted(set(paths))
 
 
 @dataclass
-class SQLiteExtractor:
+class SQLiteExtractor(BaseExtractor):
     db_path: str
     conn: sqlite3.Connection = None
     cursor: sqlite3.Cursor = None
+    read_only: bool = SQLITE_READ_ONLY
+    table_info: dict = field(default_factory=dict)
+    row_counts: dict = field(default_factory=dict)
 
     def __post_init__(self) -> None:
-        self.conn = sqlite3.connect(self.db_path)
+        if self.read_only:
+            self.conn = self.connect_read_only(self.db_path)
+        else:
+            self.conn = sqlite3.connect(self.db_path)
         self.cursor = self.conn.cursor()
 
+    @staticmethod
+    def connect_read_only(db_path: str) -> sqlite3.Connection:
+        """Соединение с неизменяемым файлом: без блокировок, поэтому таких соединений
+        может быть несколько одновременно; чтение через mmap и увеличенный кэш страниц"""
+        uri = 'file:{}?mode=ro&immutable=1'.format(pathname2url(os.path.abspath(db_path)))
+        conn = sqlite3.connect(uri, uri=True)
+        conn.execute("""PRAGMA mmap_size = {}""".format(SQLITE_MMAP_SIZE))
+        conn.execute("""PRAGMA cache_size = -{}""".format(SQLITE_CACHE_SIZE))
+        conn.execute("""PRAGMA query_only = ON""")
+        return conn
+
     def close(self) -> None:
-        self.conn.close()
+        """Закрыть соединение; повторный вызов (в том числе из __del__) ничего не делает"""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
 
     def close_cursor(self) -> None:
         self.cursor.close()
@@ -23,24 +68,131 @@ class SQLiteExtractor:
     def __del__(self) -> None:
         self.close()
 
-    def __enter__(self):
-        return self
-
-    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
-        self.close()
-
     def get_list_table(self) -> list:
         """Получить список всех табиц"""
         self.cursor.execute("""SELECT name FROM sqlite_master WHERE type='table';""")
         return self.cursor.fetchall()
 
-    def get_headers(self, table_name: str) -> set:
-        """Получить заголовки табоицы"""
-        self.cursor.execute("""SELECT * FROM {} limit 1""".format(table_name))
-        headers = [i[0] for i in self.cursor.description]
-        return set(headers)
+    def get_table_info(self, table_name: str) -> list:
+        """Колонки таблицы и их типы в порядке объявления; читаются один раз за запуск"""
+        if table_name not in self.table_info:
+            rows = self.conn.execute("""PRAGMA table_info({})""".format(table_name)).fetchall()
+            self.table_info[table_name] = [(row[1], row[2]) for row in sorted(rows)]
+        return self.table_info[table_name]
+
+    def get_headers(self, table_name: str) -> list:
+        """Получить заголовки таблицы в порядке объявления колонок"""
+        return [name for name, _ in self.get_table_info(table_name)]
 
-    def get_all_data(self, table_name: str, headers: set) -> sqlite3.Cursor:
+    def get_row_count(self, table_name: str) -> int:
+        """Число строк таблицы; считается один раз за запуск"""
+        if table_name not in self.row_counts:
+            self.row_counts[table_name] = self.conn.execute(
+                """SELECT COUNT(*) FROM {}""".format(table_name)).fetchone()[0]
+        return self.row_counts[table_name]
+
+    def plan_rowid_ranges(self, table_name: str, parts: int) -> list:
+        """Разбить таблицу на parts диапазонов rowid вида (после, до включительно)"""
+        low, high = self.conn.execute("""SELECT MIN(rowid), MAX(rowid) FROM {}""".format(table_name)).fetchone()
+        if low is None or parts <= 1:
+            return [None]
+        step = -(-(high - low + 1) // parts)
+        return [(start - 1, min(start + step - 1, high)) for start in range(low, high + 1, step)]
+
+    def get_all_data(self, table_name: str, headers: list) -> sqlite3.Cursor:
         """Получить все записи из таблицы"""
         self.cursor.execute(SQL_SELECT.format(', '.join(headers), table_name))
         return self.cursor
+
+    def get_data_from(self,
+                      table_name: str,
+                      headers: list,
+                      last_rowid: int = 0,
+                      until_rowid: int = None) -> sqlite3.Cursor:
+        """Получить записи таблицы после указанного rowid (и не дальше until_rowid)
+        в отдельном курсоре; rowid идёт первой колонкой"""
+        if until_rowid is None:
+            return self.conn.execute(SQL_SELECT_FROM_ROWID.format(', '.join(headers), table_name), (last_rowid,))
+        return self.conn.execute(SQL_SELECT_ROWID_RANGE.format(', '.join(headers), table_name),
+                                 (last_rowid, until_rowid))
+
+
+def sqlite_value(value):
+    """Значение для записи в SQLite: даты и время сохраняются строкой, как в исходной базе"""
+    if isinstance(value, date):
+        return str(value)
+    return value
+
+
+def value_size(value) -> int:
+    """Объём значения в байтах: строки в UTF-8, NULL пустой, числа по 8 байт"""
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, bytes):
+        return len(value)
+    return 8
+
+
+@dataclass
+class SQLiteSaver(BaseSaver):
+    """Запись в файл SQLite со схемой исходных таблиц (выгрузка из Postgres).
+    Соединение создаётся в одном потоке, а пишет в него писатель конвейера (--pipeline),
+    поэтому проверка потока отключена, а обращения к соединению идут под lock"""
+    row_errors = (sqlite3.IntegrityError,)
+
+    db_path: str
+    conn: sqlite3.Connection = None
+    commit_policy: str = COMMIT_POLICY
+    commit_every: int = COMMIT_EVERY
+    pending_rows: int = 0
+    pending_bytes: int = 0
+    commit_callbacks: list = field(default_factory=list)
+    metrics: LoadMetrics = field(default_factory=LoadMetrics)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def __post_init__(self) -> None:
+        self.conn = sqlite3.connect(self.db_path, timeout=60, check_same_thread=False)
+        with self.lock:
+            self.conn.executescript(SQLITE_SCHEMA)
+
+    def clone(self):
+        return SQLiteSaver(self.db_path,
+                           commit_policy=self.commit_policy,
+                           commit_every=self.commit_every,
+                           metrics=self.metrics)
+
+    def close_connect(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+    def commit_transaction(self) -> None:
+        with self.lock:
+            self.conn.commit()
+
+    def rollback_transaction(self) -> None:
+        with self.lock:
+            self.conn.rollback()
+
+    def execute_savepoint(self, statement: str) -> None:
+        with self.lock:
+            if not self.conn.in_transaction:
+                self.conn.execute('BEGIN')
+            self.conn.execute(statement)
+
+    def write_rows(self,
+                   headers: list,
+                   data: list,
+                   table_name: str,
+                   upsert: bool = False) -> int:
+        """Запись данных в SQLite; возвращает объём записанных значений"""
+        sql_text = """INSERT INTO {table_name} ({headers}) VALUES ({values}) {conflict};""".format(
+            table_name=table_name, headers=', '.join(headers), values=', '.join(['?'] * len(headers)),
+            conflict=conflict_clause(headers, upsert))
+        data = [tuple(sqlite_value(value) for value in row) for row in data]
+        with self.lock:
+            self.conn.executemany(sql_text, data)
+        size = sum(value_size(value) for row in data for value in row)
+        self.metrics.record(table_name, bytes_sent=size)
+        return size
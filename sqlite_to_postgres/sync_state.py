@@ -0,0 +1,61 @@
+from dataclasses import dataclass
+import hashlib
+from operator import itemgetter
+import sqlite3
+
+
+@dataclass
+class SyncState:
+    """Контрольные суммы перенесённых строк для инкрементальной синхронизации"""
+    path: str
+    conn: sqlite3.Connection = None
+
+    def __post_init__(self) -> None:
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS row_state (
+                table_name TEXT NOT NULL,
+                id TEXT NOT NULL,
+                checksum TEXT NOT NULL,
+                PRIMARY KEY (table_name, id)
+            );
+            """)
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    @staticmethod
+    def checksum(headers: tuple, row: tuple) -> str:
+        """Контрольная сумма строки, не зависящая от порядка колонок"""
+        return hashlib.md5(repr(sorted(zip(headers, row), key=itemgetter(0))).encode()).hexdigest()
+
+    def filter_changed(self,
+                       table_name: str,
+                       headers: list,
+                       data: list) -> tuple:
+        """Отобрать новые и изменившиеся строки.
+        Возвращает строки и их контрольные суммы для сохранения после записи"""
+        id_index = headers.index('id')
+        checksums = {row[id_index]: self.checksum(headers, row) for row in data}
+        saved = dict(self.conn.execute(
+            """SELECT id, checksum FROM row_state WHERE table_name = ? AND id IN ({})""".format(
+                ', '.join(['?'] * len(checksums))),
+            (table_name, *checksums),
+        ))
+        changed = [row for row in data if saved.get(row[id_index]) != checksums[row[id_index]]]
+        return changed, [(table_name, row[id_index], checksums[row[id_index]]) for row in changed]
+
+    def save(self, checksums: list) -> None:
+        """Сохранить контрольные суммы записанных строк"""
+        self.conn.executemany(
+            """INSERT OR REPLACE INTO row_state (table_name, id, checksum) VALUES (?, ?, ?)""",
+            checksums,
+        )
+        self.conn.commit()
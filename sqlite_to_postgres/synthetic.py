@@ -0,0 +1,93 @@
+import argparse
+from datetime import date, timedelta
+import random
+import sqlite3
+import uuid
+
+from settings import FILM_TYPES
+from settings import ROLE_TYPES
+from settings import SQLITE_SCHEMA
+
+GENRES = 30
+PERSONS_PER_FILM = 3
+GENRES_PER_FILM = 2
+# Значения, которые принимает приведение типов (--coerce)
+ROLES = tuple(ROLE_TYPES)
+TYPES = tuple(FILM_TYPES)
+TIMESTAMP = '2021-06-16 20:14:09.221838+00'
+INSERT_BATCH = 10000
+
+
+def random_uuid(rnd: random.Random) -> str:
+    return str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+
+
+def insert_batches(conn: sqlite3.Connection, sql: str, rows) -> None:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == INSERT_BATCH:
+            conn.executemany(sql, batch)
+            batch = []
+    if batch:
+        conn.executemany(sql, batch)
+
+
+def create_synthetic_db(path: str, films: int, seed: int = 0) -> dict:
+    """Синтетическая база SQLite со схемой исходных таблиц.
+    На каждый фильм приходится одна персона, GENRES_PER_FILM жанров
+    и PERSONS_PER_FILM участников. Возвращает число строк по таблицам"""
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("""PRAGMA journal_mode = OFF""")
+    conn.execute("""PRAGMA synchronous = OFF""")
+    conn.executescript(SQLITE_SCHEMA)
+    genre_ids = [random_uuid(rnd) for _ in range(GENRES)]
+    film_ids = [random_uuid(rnd) for _ in range(films)]
+    person_ids = [random_uuid(rnd) for _ in range(films)]
+    insert_batches(conn, """INSERT INTO genre VALUES (?, ?, ?, ?, ?)""", (
+        (genre_id, 'Genre {}'.format(n), 'Description of genre {}'.format(n), TIMESTAMP, TIMESTAMP)
+        for n, genre_id in enumerate(genre_ids)
+    ))
+    insert_batches(conn, """INSERT INTO film_work VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", (
+        (film_id,
+         'Film {}'.format(n),
+         ' '.join('word{}'.format(rnd.randrange(1000)) for _ in range(rnd.randrange(10, 60))),
+         (date(1950, 1, 1) + timedelta(days=rnd.randrange(25000))).isoformat() if n % 3 else None,
+         None,
+         round(rnd.uniform(0, 10), 1),
+         TYPES[n % len(TYPES)],
+         TIMESTAMP,
+         TIMESTAMP)
+        for n, film_id in enumerate(film_ids)
+    ))
+    insert_batches(conn, """INSERT INTO person VALUES (?, ?, ?, ?)""", (
+        (person_id, 'Person {}'.format(n), TIMESTAMP, TIMESTAMP)
+        for n, person_id in enumerate(person_ids)
+    ))
+    insert_batches(conn, """INSERT INTO genre_film_work VALUES (?, ?, ?, ?)""", (
+        (random_uuid(rnd), film_id, genre_ids[(n + k) % GENRES], TIMESTAMP)
+        for n, film_id in enumerate(film_ids) for k in range(GENRES_PER_FILM)
+    ))
+    insert_batches(conn, """INSERT INTO person_film_work VALUES (?, ?, ?, ?, ?)""", (
+        (random_uuid(rnd), film_id, person_ids[(n + k) % films], ROLES[k % len(ROLES)], TIMESTAMP)
+        for n, film_id in enumerate(film_ids) for k in range(PERSONS_PER_FILM)
+    ))
+    conn.commit()
+    conn.close()
+    return {
+        'genre': GENRES,
+        'film_work': films,
+        'person': films,
+        'genre_film_work': films * GENRES_PER_FILM,
+        'person_film_work': films * PERSONS_PER_FILM,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Синтетическая база SQLite для проверки и замеров загрузки')
+    parser.add_argument('path', help='путь к создаваемой базе')
+    parser.add_argument('--films', type=int, default=10000, help='число фильмов')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(create_synthetic_db(args.path, args.films, args.seed))
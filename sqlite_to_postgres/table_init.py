@@ -1,42 +1,78 @@
 from dataclasses import dataclass, fields
-from datetime import datetime
+from datetime import date, datetime
+from functools import partial
+from operator import itemgetter
 
-from sqlite_work import SQLiteExtractor
+from base import BaseExtractor
 from settings import TIMESTAMP_WITH_TIMEZONE
+from settings import TRANSFORM_MODE
 
 
 class TableWork:
+    constant_fields = ('created_at', 'updated_at')
 
     def sorted_values(self, headers: list) -> tuple:
         return tuple(self.__dict__.get(colm) for colm in headers)
 
     @classmethod
     def create_headers_list(cls,
-                            sqlite_extractor: SQLiteExtractor,
-                            table: str) -> tuple:
-        headers = sqlite_extractor.get_headers(table)
-        table_class_headers = set(map(lambda x: x.name, fields(cls)))
-        headers = headers.intersection(table_class_headers)
-        return headers
+                            extractor: BaseExtractor,
+                            table: str) -> list:
+        """Общие колонки таблицы источника и dataclass в порядке колонок источника"""
+        table_class_headers = {field.name for field in fields(cls)}
+        return [colm for colm in extractor.get_headers(table) if colm in table_class_headers]
 
     @classmethod
     def create_data_for_insert(cls,
-                               headers: set,
+                               headers: list,
                                data: list) -> dict:
         for n, table_data in enumerate(data):
-            table_data = dict(zip(tuple(headers), table_data))
+            table_data = dict(zip(headers, table_data))
             table_class = cls(**table_data)
             data[n] = (table_class.sorted_values(headers))
         return data
 
+    @classmethod
+    def create_row_transformer(cls, headers: list):
+        """Преобразование пачки строк в кортежи для вставки без создания экземпляров
+        dataclass: постоянные поля дописываются в конец строки из значений по умолчанию,
+        колонки переставляются одним itemgetter"""
+        defaults = {field.name: field.default for field in fields(cls) if field.name in cls.constant_fields}
+        tail = tuple(defaults[colm] for colm in headers if colm in defaults)
+        if not tail:
+            return list
+        indices = []
+        constant = len(headers)
+        for n, colm in enumerate(headers):
+            if colm in defaults:
+                indices.append(constant)
+                constant += 1
+            else:
+                indices.append(n)
+        getter = itemgetter(*indices)
+
+        def transform(data: list) -> list:
+            return [getter((*row, *tail)) for row in data]
+        return transform
+
+    @classmethod
+    def create_transformer(cls, headers: list, mode: str = TRANSFORM_MODE):
+        """Преобразование пачки строк: быстрое ('fast'), через dataclass ('dataclass')
+        или без изменений ('none')"""
+        if mode == 'none':
+            return list
+        if mode == 'dataclass':
+            return partial(cls.create_data_for_insert, headers)
+        return cls.create_row_transformer(headers)
+
 
 @dataclass
 class FilmWork(TableWork):
     id: str
     title: str
     description: str
-    creation_date: str
-    rating: str
+    creation_date: date
+    rating: float
     type: str
     created_at: datetime = TIMESTAMP_WITH_TIMEZONE
     updated_at: datetime = TIMESTAMP_WITH_TIMEZONE
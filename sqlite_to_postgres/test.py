@@ -1,21 +1,76 @@
+from contextlib import closing
+from dataclasses import fields
+from datetime import date, datetime, timezone
+import asyncio
+import json
+import os
+import sqlite3
+import struct
+import tempfile
 import unittest
+from unittest import mock
+import uuid
 
+import psycopg2
+
+from async_load import CountedConnection, copy_batch
+from batching import BatchSizer
+from checkpoint import Checkpoint
+from coercion import BatchCoercer
 from load_data import PostgresSaver, SQLiteExtractor
 from load_data import dsl, sqlite3_path
+from load_data import load_table
+from load_data import parse_args
+from pg_work import binary_copy_value
+from pipeline import Batch, run_pipelined, write_batch
+from pool import ConnectionPool, shared_pool, sized_pool
+from rejects import RejectWriter
+from schema import run_parallel
+from settings import SQLITE_SCHEMA
+from sqlite_work import SQLiteSaver
+from synthetic import create_synthetic_db
+from sync_state import SyncState
+from table_init import TABLE_NAME_CLASSES
+from verify import verify
+
+
+def create_source(path: str, rows: dict) -> None:
+    """Файл SQLite со схемой исходной базы и строками {таблица: [{колонка: значение}]}"""
+    conn = sqlite3.connect(path)
+    conn.executescript(SQLITE_SCHEMA)
+    for table, table_rows in rows.items():
+        for row in table_rows:
+            conn.execute("""INSERT INTO {} ({}) VALUES ({})""".format(
+                table, ', '.join(row), ', '.join(['?'] * len(row))), tuple(row.values()))
+    conn.commit()
+    conn.close()
 
-TABLE_FIELDS = {
-    'genre': 'id, name, description',
-    'film_work': 'id, title, description, creation_date, rating, type',
-    'genre_film_work': 'id, film_work_id, genre_id',
-    'person': 'id, full_name',
-    'person_film_work': 'id, film_work_id, role'
 
-}
+def genres(count: int) -> list:
+    return [{'id': str(uuid.uuid4()), 'name': 'genre {}'.format(n), 'description': None} for n in range(count)]
+
+
+class SQLiteFixtureTestCase(unittest.TestCase):
+    """Загрузка из файла SQLite в файл SQLite во временном каталоге, без Postgres"""
+
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+        self.source = os.path.join(self.tmp_dir, 'source.db')
+        self.target = os.path.join(self.tmp_dir, 'target.db')
+
+    def target_rows(self, table: str) -> dict:
+        conn = sqlite3.connect(self.target)
+        try:
+            return {row[0]: row[1:] for row in conn.execute("""SELECT * FROM {}""".format(table))}
+        finally:
+            conn.close()
 
 
 class TestTransferDataSQL(unittest.TestCase):
     def setUp(self) -> None:
-        self.pg_conn = PostgresSaver(data=dsl)
+        self.pg_conn = PostgresSaver(data=dsl, pool=shared_pool(dsl))
         self.sqlite_conn = SQLiteExtractor(sqlite3_path)
 
     def test_diff_count_values_table(self):
@@ -30,16 +85,423 @@ class TestTransferDataSQL(unittest.TestCase):
                 count_pg = pg_cursor.fetchone()[0]
             assert count_sql == count_pg
 
-    def test_diff_values_table_genre(self):
-        for table, fields in TABLE_FIELDS.items():
-            self.sqlite_conn.cursor.execute("""SELECT {0}  FROM {1}""".format(fields, table))
-            data_sql = self.sqlite_conn.cursor.fetchall()
-            for item_sql in data_sql[:2]:
-                with self.pg_conn.conn_pg.cursor() as pg_cursor:
-                    pg_cursor.execute("""SELECT {0} FROM content.{1} WHERE id = '{2}'""".format(fields, table, item_sql[0]))
-                    item_pg = pg_cursor.fetchall()[0]
-                    assert set(item_pg) == set(item_sql)
+    def test_diff_values_tables(self):
+        for report in verify(self.sqlite_conn, self.pg_conn):
+            assert report.ok, str(report)
 
     def tearDown(self) -> None:
         self.sqlite_conn.close()
-        self.pg_conn.close_connect()
\ No newline at end of file
+        self.pg_conn.close_connect()
+
+
+class TestPipelineCommit(unittest.TestCase):
+    def run_table(self, saver: PostgresSaver, table: str, headers: list, row: tuple) -> list:
+        completed = []
+        batches = iter([Batch(seq=0, last_key=1, row_count=1, data=[row])])
+        run_pipelined(batches, saver, headers, table, completed.append)
+        return completed
+
+    def test_failed_commit_is_reported(self):
+        # Внешние ключи проверяются только при фиксации в конце таблицы
+        with PostgresSaver(data=dsl, pool=shared_pool(dsl), commit_policy='table') as saver:
+            with self.assertRaises(psycopg2.IntegrityError):
+                self.run_table(saver, 'genre_film_work', ['id', 'film_work_id', 'genre_id', 'created_at'],
+                               (str(uuid.uuid4()), str(uuid.uuid4()), str(uuid.uuid4()),
+                                datetime.now(timezone.utc)))
+
+    def test_load_policy_completes_after_final_commit(self):
+        genre_id = str(uuid.uuid4())
+        now = datetime.now(timezone.utc)
+        with PostgresSaver(data=dsl, pool=shared_pool(dsl), commit_policy='load') as saver:
+            try:
+                completed = self.run_table(saver, 'genre', ['id', 'name', 'description', 'created_at', 'updated_at'],
+                                           (genre_id, 'pipeline test', None, now, now))
+                self.assertEqual(completed, [])
+                saver.commit()
+                self.assertEqual([batch.row_count for batch in completed], [1])
+            finally:
+                with saver.conn_pg.cursor() as pg_cursor:
+                    pg_cursor.execute("""DELETE FROM content.genre WHERE id = %s""", (genre_id,))
+                saver.conn_pg.commit()
+
+
+SQL_TABLE_COLUMNS = """
+    SELECT attname, format_type(atttypid, atttypmod), attnotnull
+    FROM pg_attribute
+    WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+    ORDER BY attnum;
+    """
+
+
+class PostgresFixtureTestCase(unittest.TestCase):
+    """Отдельная временная база Postgres с пустыми копиями таблиц content (колонки и первичный ключ).
+    Рабочая база только читается, временная удаляется после тестов класса"""
+    tables = ()
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.data = dict(dsl, dbname='{}_test_{}'.format(dsl['dbname'], os.getpid()))
+        with closing(psycopg2.connect(**dsl)) as conn, conn.cursor() as cursor:
+            columns = {}
+            for table in cls.tables:
+                cursor.execute(SQL_TABLE_COLUMNS, ['content.' + table])
+                columns[table] = cursor.fetchall()
+        cls.admin_execute("""CREATE DATABASE {}""".format(cls.data['dbname']))
+        cls.addClassCleanup(cls.admin_execute, """DROP DATABASE {}""".format(cls.data['dbname']))
+        with closing(psycopg2.connect(**cls.data)) as conn, conn, conn.cursor() as cursor:
+            cursor.execute("""CREATE SCHEMA content""")
+            for table, table_columns in columns.items():
+                cursor.execute("""CREATE TABLE content.{} ({}, PRIMARY KEY (id))""".format(table, ', '.join(
+                    '{} {}{}'.format(name, column_type, ' NOT NULL' if not_null else '')
+                    for name, column_type, not_null in table_columns)))
+
+    @staticmethod
+    def admin_execute(sql: str) -> None:
+        """CREATE DATABASE и DROP DATABASE выполняются вне транзакции"""
+        with closing(psycopg2.connect(**dsl)) as conn:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(sql)
+
+
+class TestCoercedVerify(PostgresFixtureTestCase):
+    """Сверка после загрузки с приведением типов: type и role в Postgres записаны вариантами
+    перечислений, а в синтетической базе SQLite - значениями исходной базы"""
+    tables = ('film_work', 'person_film_work')
+
+    def test_verify_after_coerced_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source = os.path.join(tmp_dir, 'source.db')
+            create_synthetic_db(source, films=20)
+            with PostgresSaver(data=self.data) as saver, SQLiteExtractor(source) as sqlite_conn, \
+                    RejectWriter(os.path.join(tmp_dir, 'rejects.jsonl')) as rejects:
+                for table in self.tables:
+                    load_table(sqlite_conn, saver, table, rejects=rejects)
+                saver.commit()
+                for report in verify(sqlite_conn, saver, self.tables, coerce=True):
+                    assert report.ok, str(report)
+                assert not any(report.ok for report in verify(sqlite_conn, saver, self.tables, coerce=False))
+
+
+class TestBatchCoercer(unittest.TestCase):
+    headers = ['id', 'title', 'type']
+
+    def setUp(self) -> None:
+        self.ids = [uuid.uuid4() for _ in range(5)]
+        self.coerce = BatchCoercer.for_headers(self.headers)
+
+    def test_clean_batch_is_converted_by_columns(self):
+        data = [(str(film_id), 'film', 'movie') for film_id in self.ids]
+        with mock.patch.object(BatchCoercer, 'convert_each', autospec=True) as convert_each:
+            rows, rejected = self.coerce(data)
+        convert_each.assert_not_called()
+        self.assertEqual(rejected, [])
+        self.assertEqual(rows, [(film_id, 'film', 'MOV') for film_id in self.ids])
+
+    def test_failed_column_falls_back_to_values(self):
+        data = [(str(film_id), 'film', 'movie') for film_id in self.ids]
+        data[1] = ('not-a-uuid', 'film', 'movie')
+        data[3] = (str(self.ids[3]), 'film', 'cartoon')
+        data[4] = ('not-a-uuid', 'film', 'cartoon')
+        with mock.patch.object(BatchCoercer, 'convert_each', autospec=True,
+                               side_effect=BatchCoercer.convert_each) as convert_each:
+            rows, rejected = self.coerce(data)
+        # Значения перебираются по одному только в колонках с ошибкой
+        self.assertEqual([call.args[1] for call in convert_each.call_args_list], [0, 2])
+        self.assertEqual(rows, [(self.ids[0], 'film', 'MOV'), (self.ids[2], 'film', 'MOV')])
+        self.assertEqual([(position, row) for position, row, _ in rejected],
+                         [(1, data[1]), (3, data[3]), (4, data[4])])
+        # Причина - первая колонка с ошибкой
+        self.assertEqual([reason.split(':')[0] for _, _, reason in rejected], ['id', 'type', 'id'])
+
+    def test_converted_values_pass_through(self):
+        rows, rejected = self.coerce([(self.ids[0], 'film', 'TVS')])
+        self.assertEqual((rows, rejected), ([(self.ids[0], 'film', 'TVS')], []))
+
+
+class TestBinaryCopyValue(unittest.TestCase):
+
+    def test_encoding(self):
+        value = uuid.uuid4()
+        cases = [
+            (None, b'\xff\xff\xff\xff'),
+            ('ab', b'\x00\x00\x00\x02ab'),
+            ('я', b'\x00\x00\x00\x02' + 'я'.encode()),
+            (value, b'\x00\x00\x00\x10' + value.bytes),
+            (1.5, b'\x00\x00\x00\x08' + struct.pack('!d', 1.5)),
+            (date(2000, 1, 2), b'\x00\x00\x00\x04\x00\x00\x00\x01'),
+            (date(1999, 12, 31), b'\x00\x00\x00\x04\xff\xff\xff\xff'),
+            (datetime(2000, 1, 1, 0, 0, 1, 5, tzinfo=timezone.utc), b'\x00\x00\x00\x08' + struct.pack('!q', 1000005)),
+            # Время без часового пояса считается UTC
+            (datetime(2000, 1, 1, 0, 0, 1), b'\x00\x00\x00\x08' + struct.pack('!q', 1000000)),
+        ]
+        for value, expected in cases:
+            with self.subTest(value=value):
+                self.assertEqual(binary_copy_value(value), expected)
+
+    def test_unsupported_type(self):
+        with self.assertRaises(TypeError):
+            binary_copy_value(1)
+
+
+class TestIncrementalSync(SQLiteFixtureTestCase):
+
+    def sync(self) -> int:
+        """Инкрементальная загрузка жанров; число записанных строк"""
+        with SQLiteExtractor(self.source) as extractor, SQLiteSaver(self.target) as saver, \
+                SyncState(os.path.join(self.tmp_dir, 'state.sqlite')) as sync_state:
+            load_table(extractor, saver, 'genre', sync_state)
+            saver.commit()
+            return saver.metrics.totals().rows_written
+
+    def test_unchanged_rows_are_skipped_and_changed_resent(self):
+        rows = genres(5)
+        create_source(self.source, {'genre': rows})
+        self.assertEqual(self.sync(), 5)
+        self.assertEqual(self.sync(), 0)
+        conn = sqlite3.connect(self.source)
+        conn.execute("""UPDATE genre SET name = 'renamed' WHERE id = ?""", (rows[2]['id'],))
+        conn.commit()
+        conn.close()
+        self.assertEqual(self.sync(), 1)
+        self.assertEqual(self.target_rows('genre')[rows[2]['id']][0], 'renamed')
+        self.assertEqual(self.sync(), 0)
+
+
+class TestCheckpoint(SQLiteFixtureTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.rows = genres(6)
+        create_source(self.source, {'genre': self.rows})
+        self.checkpoint = Checkpoint(os.path.join(self.tmp_dir, 'checkpoint.sqlite'))
+        self.addCleanup(self.checkpoint.close)
+
+    def load(self, commit_policy: str = 'batch', commit: bool = True) -> int:
+        with SQLiteExtractor(self.source) as extractor, \
+                SQLiteSaver(self.target, commit_policy=commit_policy) as saver:
+            load_table(extractor, saver, 'genre', checkpoint=self.checkpoint)
+            if commit:
+                saver.commit()
+            return saver.metrics.totals().rows_written
+
+    def test_resume_after_last_key_and_finish(self):
+        # Первые четыре строки (rowid 1-4) записаны прошлой загрузкой
+        self.checkpoint.save('genre', 4, 4)
+        self.assertEqual(self.load(), 2)
+        self.assertEqual(set(self.target_rows('genre')), {row['id'] for row in self.rows[4:]})
+        self.assertEqual(self.checkpoint.get('genre'), (6, 6, True))
+        self.assertEqual(self.load(), 0)
+
+    def test_uncommitted_load_keeps_checkpoint(self):
+        self.checkpoint.save('genre', 4, 4)
+        self.load(commit_policy='load', commit=False)
+        self.assertEqual(self.checkpoint.get('genre'), (4, 4, False))
+        self.assertEqual(self.target_rows('genre'), {})
+
+
+class SourceHeaders:
+    """Источник, у которого известны только колонки таблицы"""
+
+    def __init__(self, headers: list):
+        self.headers = headers
+
+    def get_headers(self, table_name: str) -> list:
+        return self.headers
+
+
+class TestRowTransformer(unittest.TestCase):
+    values = ('text', None, date(2020, 1, 31), 7.5, '2021-01-01 00:00:00+00')
+
+    def source_variants(self, table_class) -> list:
+        """Колонки источника: в порядке dataclass, в обратном порядке и с переименованными
+        колонками времени, которых нет в dataclass"""
+        names = [field.name for field in fields(table_class)]
+        renamed = ['created' if name == 'created_at' else 'modified' if name == 'updated_at' else name
+                   for name in names]
+        return [names, names[::-1], renamed + ['file_path']]
+
+    def test_fast_path_matches_dataclass_path(self):
+        for table, table_class in TABLE_NAME_CLASSES.items():
+            for source in self.source_variants(table_class):
+                headers = table_class.create_headers_list(SourceHeaders(source), table)
+                rows = [tuple(self.values[(n + shift) % len(self.values)] for n in range(len(headers)))
+                        for shift in range(len(self.values))]
+                with self.subTest(table=table, headers=headers):
+                    expected = table_class.create_transformer(headers, 'dataclass')(list(rows))
+                    self.assertEqual(table_class.create_transformer(headers, 'fast')(list(rows)), expected)
+
+
+class TestBatchSizer(unittest.TestCase):
+
+    def sizer(self, **kwargs) -> BatchSizer:
+        options = dict(size=100, adaptive=True, min_size=50, max_size=1000, memory_budget=10 ** 6, target_latency=1.0)
+        options.update(kwargs)
+        return BatchSizer(**options)
+
+    def test_grows_when_fast_at_most_twice(self):
+        sizer = self.sizer()
+        sizer.update(rows=100, row_bytes=100, latency=0.1)
+        self.assertEqual(sizer.size, 200)
+        for _ in range(10):
+            sizer.update(rows=sizer.size, row_bytes=100, latency=0.0)
+        self.assertEqual(sizer.size, 1000)
+
+    def test_shrinks_when_slow_down_to_min(self):
+        sizer = self.sizer(size=800)
+        sizer.update(rows=800, row_bytes=100, latency=2.0)
+        self.assertEqual(sizer.size, 400)
+        sizer.update(rows=400, row_bytes=100, latency=100.0)
+        self.assertEqual(sizer.size, 50)
+
+    def test_memory_budget(self):
+        sizer = self.sizer(memory_budget=30000)
+        sizer.update(rows=100, row_bytes=200, latency=0.1)
+        self.assertEqual(sizer.size, 150)
+
+    def test_fixed_size(self):
+        sizer = self.sizer(adaptive=False)
+        sizer.update(rows=100, row_bytes=100, latency=10.0)
+        sizer.update(rows=0, row_bytes=100, latency=0.0)
+        self.assertEqual(sizer.size, 100)
+        sizer = self.sizer()
+        sizer.update(rows=0, row_bytes=100, latency=10.0)
+        self.assertEqual(sizer.size, 100)
+
+
+class TestPipelineOrder(SQLiteFixtureTestCase):
+    """Пачки нескольких писателей завершаются по порядку чтения,
+    контрольная точка не обгоняет незафиксированные пачки"""
+    headers = ['id', 'name', 'description']
+
+    def run_batches(self, bad_batch: int = None) -> tuple:
+        batches = []
+        for seq in range(12):
+            data = [(row['id'], row['name'], row['description']) for row in genres(5)]
+            if seq == bad_batch:
+                # NOT NULL: писатель этой пачки падает
+                data[2] = (str(uuid.uuid4()), None, None)
+            batches.append(Batch(seq=seq, last_key=seq + 1, row_count=(seq + 1) * 5, data=data))
+        ids = {batch.seq: [row[0] for row in batch.data] for batch in batches}
+        completed = []
+        with Checkpoint(os.path.join(self.tmp_dir, 'checkpoint.sqlite')) as checkpoint, \
+                SQLiteSaver(self.target, commit_policy='batch') as saver:
+
+            def complete(batch: Batch) -> None:
+                completed.append(batch.seq)
+                checkpoint.save('genre', batch.last_key, batch.row_count)
+
+            error = None
+            try:
+                run_pipelined(iter(batches), saver, self.headers, 'genre', complete, writers=3, queue_size=2)
+            except sqlite3.IntegrityError as raised:
+                error = raised
+            return completed, checkpoint.get('genre'), ids, error
+
+    def test_batches_complete_in_order(self):
+        completed, (last_key, row_count, _), _, error = self.run_batches()
+        self.assertIsNone(error)
+        self.assertEqual(completed, list(range(12)))
+        self.assertEqual((last_key, row_count), (12, 60))
+        self.assertEqual(len(self.target_rows('genre')), 60)
+
+    def test_failed_writer_stops_checkpoint(self):
+        completed, (last_key, _, _), ids, error = self.run_batches(bad_batch=7)
+        self.assertIsNotNone(error)
+        self.assertEqual(completed, list(range(len(completed))))
+        self.assertLess(len(completed), 8)
+        self.assertEqual(last_key, len(completed))
+        written = set(self.target_rows('genre'))
+        for seq in completed:
+            self.assertTrue(set(ids[seq]) <= written)
+        self.assertFalse(set(ids[7]) & written)
+
+
+class TestSQLiteTarget(SQLiteFixtureTestCase):
+    headers = ['id', 'name', 'description']
+
+    def test_bytes_policy_commits(self):
+        with SQLiteSaver(self.target, commit_policy='bytes', commit_every=100) as saver:
+            for expected_commits in (0, 1):
+                rows = [(row['id'], row['name'], row['description']) for row in genres(2)]
+                saver.save_data(self.headers, rows, 'genre')
+                self.assertEqual(saver.metrics.commits, expected_commits)
+            self.assertEqual(len(self.target_rows('genre')), 4)
+
+    def test_single_writer_only(self):
+        for extra in (['--pipeline', '--writers', '2'], ['--workers', '2']):
+            argv = ['load_data.py', '--target', 'sqlite', '--target-path', self.target] + extra
+            with self.subTest(extra=extra), mock.patch('sys.argv', argv), mock.patch('sys.stderr'):
+                with self.assertRaises(SystemExit):
+                    parse_args()
+
+
+class TestWriteIsolated(SQLiteFixtureTestCase):
+    """Отделение строк, на которых падает запись, делением пачки через точки сохранения"""
+    headers = ['id', 'name', 'description']
+
+    def write(self, bad_positions: tuple) -> tuple:
+        data = [(row['id'], row['name'], row['description']) for row in genres(16)]
+        for position in bad_positions:
+            # NOT NULL: запись этой строки падает
+            data[position] = (data[position][0], None, 'bad {}'.format(position))
+        batch = Batch(seq=0, last_key=16, row_count=16, data=data,
+                      checksums=[('genre', row[0], 'checksum') for row in data])
+        dead_letter_path = os.path.join(self.tmp_dir, 'dead_letter.jsonl')
+        with SQLiteSaver(self.target) as saver, RejectWriter(dead_letter_path) as dead_letter:
+            write_batch(saver, self.headers, 'genre', batch, dead_letter=dead_letter)
+            saver.commit()
+        with open(dead_letter_path) as dead_letter_file:
+            events = [json.loads(line) for line in dead_letter_file]
+        return data, batch, events
+
+    def check(self, bad_positions: tuple) -> None:
+        data, batch, events = self.write(bad_positions)
+        bad_ids = {data[position][0] for position in bad_positions}
+        good_ids = {row[0] for row in data} - bad_ids
+        self.assertEqual(batch.written, len(good_ids))
+        self.assertEqual(set(self.target_rows('genre')), good_ids)
+        self.assertEqual([event['row'] for event in events],
+                         [dict(zip(self.headers, data[position])) for position in bad_positions])
+        for event in events:
+            self.assertEqual(event['table'], 'genre')
+            self.assertIn('NOT NULL', event['reason'])
+        # Контрольные суммы отделённых строк не сохраняются: инкрементальная загрузка повторит их
+        self.assertEqual({item[1] for item in batch.checksums}, good_ids)
+
+    def test_single_bad_row(self):
+        self.check((5,))
+
+    def test_several_bad_rows(self):
+        self.check((0, 6, 7, 15))
+
+
+class TestPoolSize(unittest.TestCase):
+
+    def test_zero_size_means_no_pool(self):
+        self.assertIsNone(shared_pool(dsl, 0))
+        self.assertIsNone(sized_pool(dsl, 4, pool_size=0))
+        with self.assertRaises(ValueError):
+            ConnectionPool(dsl, maxconn=0)
+
+    def test_pool_grows_to_workers(self):
+        self.assertGreaterEqual(sized_pool(dsl, 6, pool_size=2).maxconn, 6)
+
+    def test_parallel_statements_without_pool(self):
+        with mock.patch('schema.sized_pool', return_value=None), \
+                mock.patch('schema.shared_pool', return_value=None) as pool:
+            run_parallel(dsl, ["""SELECT 1"""] * 4, workers=2)
+        self.assertEqual(pool.call_count, 4)
+
+
+class TestCountedConnection(unittest.TestCase):
+
+    def test_copy_batch_round_trips(self):
+        conn = mock.MagicMock()
+        conn.execute = mock.AsyncMock()
+        conn.copy_to_table = mock.AsyncMock()
+        counted = CountedConnection(conn)
+        asyncio.run(copy_batch(counted, 'genre', ['id', 'name'], [], [('1', 'a'), ('2', 'b')]))
+        # BEGIN, создание временной таблицы, COPY, слияние, COMMIT
+        self.assertEqual(counted.round_trips, 5)
+        self.assertEqual(conn.execute.await_count + conn.copy_to_table.await_count, 3)
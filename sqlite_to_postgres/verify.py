@@ -0,0 +1,244 @@
+import argparse
+from dataclasses import dataclass, field
+import hashlib
+import sys
+
+from pg_work import PostgresSaver
+from pool import shared_pool
+from settings import COERCE_TYPES
+from settings import FILM_TYPES
+from settings import ROLE_TYPES
+from settings import VERIFY_CHUNK_SIZE
+from settings import dsl
+from settings import sqlite3_path
+from sqlite_work import SQLiteExtractor, find_shards
+
+VERIFY_FIELDS = {
+    'genre': ('id', 'name', 'description'),
+    'film_work': ('id', 'title', 'description', 'creation_date', 'rating', 'type'),
+    'genre_film_work': ('id', 'film_work_id', 'genre_id'),
+    'person': ('id', 'full_name'),
+    'person_film_work': ('id', 'film_work_id', 'person_id', 'role'),
+}
+
+# Значения перечислений, которые приведение типов (--coerce) записывает вместо значений SQLite
+COERCED_CHOICES = {
+    'type': FILM_TYPES,
+    'role': ROLE_TYPES,
+}
+
+
+def coerced_choices(table: str) -> tuple:
+    """Замены значений SQLite по колонкам сверки таблицы (None — без замены)"""
+    return tuple(COERCED_CHOICES.get(colm) for colm in VERIFY_FIELDS[table])
+
+
+def normalize(row, choices: tuple = ()) -> tuple:
+    """Значения строки в одном представлении для SQLite и Postgres.
+    choices — замены значений по колонкам, как при загрузке с приведением типов"""
+    if choices:
+        row = [value if mapping is None else mapping.get(value, value) for value, mapping in zip(row, choices)]
+    return tuple(None if value is None else str(value) for value in row)
+
+
+def chunk_hash(rows: list) -> str:
+    return hashlib.md5(repr(rows).encode()).hexdigest()
+
+
+@dataclass
+class SortedStream:
+    """Строки курсора, отсортированные по id, с выдачей до заданной границы"""
+    cursor: object
+    chunk_size: int
+    buffer: list = field(default_factory=list)
+    position: int = 0
+
+    def take_until(self, bound: str = None) -> list:
+        """Строки с id < bound (все оставшиеся при bound = None)"""
+        rows = []
+        while True:
+            if self.position == len(self.buffer):
+                self.buffer = [normalize(row) for row in self.cursor.fetchmany(self.chunk_size)]
+                self.position = 0
+                if not self.buffer:
+                    return rows
+            row = self.buffer[self.position]
+            if bound is not None and row[0] >= bound:
+                return rows
+            rows.append(row)
+            self.position += 1
+
+
+@dataclass
+class TableReport:
+    table: str
+    rows_sqlite: int = 0
+    rows_pg: int = 0
+    chunks: int = 0
+    mismatched_chunks: int = 0
+    missing: list = field(default_factory=list)
+    extra: list = field(default_factory=list)
+    different: list = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not (self.missing or self.extra or self.different)
+
+    def __str__(self) -> str:
+        return ('{0.table}: sqlite={0.rows_sqlite} postgres={0.rows_pg} chunks={0.chunks} '
+                'mismatched={0.mismatched_chunks} missing={1} extra={2} different={3}').format(
+            self, len(self.missing), len(self.extra), len(self.different))
+
+
+def compare_rows(report: TableReport, sqlite_rows: list, pg_rows: list) -> None:
+    """Построчное сравнение несовпавшей пачки"""
+    sqlite_by_id = {row[0]: row for row in sqlite_rows}
+    pg_by_id = {row[0]: row for row in pg_rows}
+    report.missing += [i for i in sqlite_by_id if i not in pg_by_id]
+    report.extra += [i for i in pg_by_id if i not in sqlite_by_id]
+    report.different += [i for i, row in sqlite_by_id.items() if i in pg_by_id and pg_by_id[i] != row]
+
+
+def verify_table(sqlite_extractor: SQLiteExtractor,
+                 postgres_saver: PostgresSaver,
+                 table: str,
+                 chunk_size: int = VERIFY_CHUNK_SIZE,
+                 coerce: bool = COERCE_TYPES) -> TableReport:
+    """Сверка таблицы целиком: обе стороны читаются потоком по id пачками,
+    сравниваются хэши пачек, построчно проверяются только несовпавшие пачки.
+    При coerce значения перечислений SQLite сравниваются в том виде, в каком их записывает --coerce"""
+    fields = ', '.join(VERIFY_FIELDS[table])
+    choices = coerced_choices(table) if coerce else ()
+    report = TableReport(table)
+    sqlite_cursor = sqlite_extractor.conn.cursor()
+    sqlite_cursor.execute("""SELECT {} FROM {} ORDER BY id""".format(fields, table))
+    with postgres_saver.conn_pg.cursor(name='verify_{}'.format(table)) as pg_cursor:
+        pg_cursor.itersize = chunk_size
+        pg_cursor.execute("""SELECT {} FROM content.{} ORDER BY id""".format(fields, table))
+        pg_stream = SortedStream(pg_cursor, chunk_size)
+        sqlite_rows = [normalize(row, choices) for row in sqlite_cursor.fetchmany(chunk_size)]
+        while True:
+            next_rows = [normalize(row, choices) for row in sqlite_cursor.fetchmany(chunk_size)]
+            bound = next_rows[0][0] if next_rows else None
+            pg_rows = pg_stream.take_until(bound)
+            report.chunks += 1
+            report.rows_sqlite += len(sqlite_rows)
+            report.rows_pg += len(pg_rows)
+            if chunk_hash(sqlite_rows) != chunk_hash(pg_rows):
+                report.mismatched_chunks += 1
+                compare_rows(report, sqlite_rows, pg_rows)
+            if not next_rows:
+                break
+            sqlite_rows = next_rows
+    postgres_saver.conn_pg.commit()
+    sqlite_cursor.close()
+    return report
+
+
+def verify(sqlite_extractor: SQLiteExtractor,
+           postgres_saver: PostgresSaver,
+           tables: list = None,
+           chunk_size: int = VERIFY_CHUNK_SIZE,
+           coerce: bool = COERCE_TYPES) -> list:
+    return [verify_table(sqlite_extractor, postgres_saver, table, chunk_size, coerce)
+            for table in tables or VERIFY_FIELDS]
+
+
+@dataclass
+class ShardTableReport:
+    """Сводная сверка таблицы по всем шардам: все id шардов должны быть в Postgres.
+    Строки с одинаковым id в разных шардах хранятся в Postgres один раз,
+    поэтому rows_pg может быть меньше rows_shards"""
+    table: str
+    shards: int = 0
+    rows_shards: int = 0
+    rows_pg: int = 0
+    missing: list = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.missing
+
+    def __str__(self) -> str:
+        return '{0.table}: shards={0.shards} sqlite={0.rows_shards} postgres={0.rows_pg} missing={1}'.format(
+            self, len(self.missing))
+
+
+def find_missing_ids(sqlite_extractor: SQLiteExtractor,
+                     postgres_saver: PostgresSaver,
+                     table: str,
+                     chunk_size: int = VERIFY_CHUNK_SIZE) -> tuple:
+    """Число строк таблицы SQLite и её id, которых нет в Postgres; id проверяются пачками"""
+    sqlite_cursor = sqlite_extractor.conn.execute("""SELECT id FROM {}""".format(table))
+    rows, missing = 0, []
+    with postgres_saver.conn_pg.cursor() as pg_cursor:
+        while True:
+            ids = [row[0] for row in sqlite_cursor.fetchmany(chunk_size)]
+            if not ids:
+                break
+            rows += len(ids)
+            pg_cursor.execute("""SELECT id::text FROM content.{} WHERE id = ANY(%s::uuid[])""".format(table), (ids,))
+            found = {row[0] for row in pg_cursor.fetchall()}
+            missing += [i for i in ids if i not in found]
+    postgres_saver.conn_pg.commit()
+    sqlite_cursor.close()
+    return rows, missing
+
+
+def verify_shards(shards: list,
+                  postgres_saver: PostgresSaver,
+                  read_only: bool = False,
+                  tables: list = None,
+                  chunk_size: int = VERIFY_CHUNK_SIZE) -> list:
+    reports = {table: ShardTableReport(table) for table in tables or VERIFY_FIELDS}
+    for shard in shards:
+        with SQLiteExtractor(shard, read_only=read_only) as sqlite_conn:
+            shard_tables = {row[0] for row in sqlite_conn.get_list_table()}
+            for table, report in reports.items():
+                if table not in shard_tables:
+                    continue
+                rows, missing = find_missing_ids(sqlite_conn, postgres_saver, table, chunk_size)
+                report.shards += 1
+                report.rows_shards += rows
+                report.missing += missing
+    with postgres_saver.conn_pg.cursor() as pg_cursor:
+        for table, report in reports.items():
+            pg_cursor.execute("""SELECT COUNT(*) FROM content.{}""".format(table))
+            report.rows_pg = pg_cursor.fetchone()[0]
+    postgres_saver.conn_pg.commit()
+    return list(reports.values())
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Сверка данных SQLite и Postgres')
+    parser.add_argument('tables', nargs='*', metavar='table',
+                        help='таблицы для сверки ({}), по умолчанию все'.format(', '.join(VERIFY_FIELDS)))
+    parser.add_argument('--chunk-size', type=int, default=VERIFY_CHUNK_SIZE,
+                        help='число строк в сравниваемой пачке')
+    parser.add_argument('--show-ids', type=int, default=10,
+                        help='сколько расхождений выводить по каждой таблице')
+    parser.add_argument('--shards',
+                        help='шаблон glob или каталог с файлами SQLite: проверить, что все их id есть в Postgres')
+    parser.add_argument('--coerce', action='store_true', default=COERCE_TYPES,
+                        help='данные загружены с приведением типов (--coerce): сравнивать type и role после замены')
+    args = parser.parse_args()
+    unknown = set(args.tables) - set(VERIFY_FIELDS)
+    if unknown:
+        parser.error('неизвестные таблицы: {}'.format(', '.join(sorted(unknown))))
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.shards:
+        with PostgresSaver(dsl, pool=shared_pool(dsl)) as pg_conn:
+            reports = verify_shards(find_shards(args.shards), pg_conn, tables=args.tables, chunk_size=args.chunk_size)
+    else:
+        with PostgresSaver(dsl, pool=shared_pool(dsl)) as pg_conn, SQLiteExtractor(sqlite3_path) as sqlite_conn:
+            reports = verify(sqlite_conn, pg_conn, args.tables, args.chunk_size, args.coerce)
+    for report in reports:
+        print(report)
+        for kind in ('missing', 'extra', 'different'):
+            for item in getattr(report, kind, [])[:args.show_ids]:
+                print('    {} {}'.format(kind, item))
+    sys.exit(0 if all(report.ok for report in reports) else 1)